@@ -0,0 +1,90 @@
+import logging
+import threading
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Tuple
+from data.database import Database
+
+TRADING_DAYS_PER_YEAR = 252.0
+DEFAULT_BENCHMARK = '000300.SH'
+
+# 进程内共享的指数收盘价面板：{db_path: (数据版本, 面板)}；数据版本变化时整表重载
+_PANEL_CACHE: Dict[str, Tuple[tuple, pd.DataFrame]] = {}
+_PANEL_LOCK = threading.Lock()
+
+
+def _panel_version(db: Database) -> tuple:
+    # INSERT OR REPLACE 总会分配新的 rowid，行数 + 最大 rowid 足以识别任何写入/删除
+    row = db.fetch_one("SELECT COUNT(*) AS n, MAX(rowid) AS last_rowid FROM index_daily_price")
+    return (row['n'], row['last_rowid']) if row else (0, None)
+
+
+def index_panel(db: Database) -> pd.DataFrame:
+    """
+    全部指数的对齐收盘价面板（行：交易日，列：指数代码）。
+    进程内缓存，每次调用只做一次轻量的版本查询；指数行情更新后自动重载。
+    """
+    version = _panel_version(db)
+    with _PANEL_LOCK:
+        cached = _PANEL_CACHE.get(db.db_path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        df = pd.DataFrame(db.fetch_all("SELECT ts_code, date, close FROM index_daily_price"))
+        if df.empty:
+            panel = pd.DataFrame(dtype=float)
+        else:
+            df['date'] = pd.to_datetime(df['date'])
+            panel = df.pivot(index='date', columns='ts_code', values='close').sort_index().astype(float)
+        _PANEL_CACHE[db.db_path] = (version, panel)
+        logging.getLogger(__name__).info(f"指数面板已加载: {panel.shape[1]} 个指数, {panel.shape[0]} 个交易日")
+        return panel
+
+
+def benchmark_curves(db: Database, codes: List[str], dates: pd.DatetimeIndex) -> pd.DataFrame:
+    """取指定指数在给定交易日上的收盘价（按日期向前填充对齐），缺少数据的指数不返回。"""
+    panel = index_panel(db)
+    codes = [c for c in codes if c in panel.columns]
+    if not codes or len(dates) == 0:
+        return pd.DataFrame(index=dates, dtype=float)
+    aligned = panel[codes].loc[:dates[-1]].ffill().reindex(dates, method='ffill')
+    return aligned.dropna(axis=1, how='all')
+
+
+def benchmark_stats(values: pd.Series, start_value: float, closes: pd.DataFrame) -> pd.DataFrame:
+    """
+    相对各基准的超额表现（每个基准一行，百分比指标已 *100）：
+    - excess_return: 区间总收益之差
+    - beta / alpha: 日收益对基准日收益回归；alpha 按 252 个交易日年化
+    - tracking_error: 日超额收益标准差，按 sqrt(252) 年化
+    - information_ratio: 年化超额收益 / 跟踪误差
+    """
+    columns = ['excess_return', 'beta', 'alpha', 'tracking_error', 'information_ratio']
+    if values is None or values.empty or closes.empty:
+        return pd.DataFrame(columns=columns, dtype=float)
+
+    v = values.astype(float).to_numpy()
+    r = v / np.concatenate(([float(start_value)], v[:-1])) - 1.0
+    c = closes.to_numpy(dtype=float)
+    # 基准首日以当日收盘为基点（收益为 0）；区间开始前已缺失的值由首个有效值回填
+    c = pd.DataFrame(c).bfill().to_numpy()
+    b = np.vstack([np.zeros((1, c.shape[1])), c[1:] / c[:-1] - 1.0])
+    b = np.nan_to_num(b)
+
+    r_mean, b_mean = r.mean(), b.mean(axis=0)
+    b_var = ((b - b_mean) ** 2).mean(axis=0)
+    cov = ((r - r_mean)[:, None] * (b - b_mean)).mean(axis=0)
+    beta = np.divide(cov, b_var, out=np.zeros_like(cov), where=b_var > 0)
+    alpha = (r_mean - beta * b_mean) * TRADING_DAYS_PER_YEAR
+    active = r[:, None] - b
+    te = active.std(axis=0, ddof=1) * np.sqrt(TRADING_DAYS_PER_YEAR) if len(r) > 1 else np.zeros(c.shape[1])
+    active_annual = active.mean(axis=0) * TRADING_DAYS_PER_YEAR
+    ir = np.divide(active_annual, te, out=np.zeros_like(te), where=te > 0)
+    excess = (v[-1] / float(start_value) - 1.0) - (c[-1] / c[0] - 1.0)
+
+    return pd.DataFrame({
+        'excess_return': excess * 100,
+        'beta': beta,
+        'alpha': alpha * 100,
+        'tracking_error': te * 100,
+        'information_ratio': ir,
+    }, index=closes.columns)
@@ -0,0 +1,196 @@
+"""
+批量回测：按规格文件展开 策略 × 参数组 × 区间 × 股票池，在进程池中运行并汇总结果表。
+
+用法:
+    python -m backtest.batch specs/nightly.json [--workers 4] [--output output/batch_results.csv] [--force]
+
+规格文件（JSON）示例:
+    {
+      "engine": "vectorized",
+      "initial_capital": 1000000,
+      "max_positions": 10,
+      "strategies": [
+        {"name": "FiveStepStrategy", "params": [{}]},
+        {"name": "SMA20_120_VolStop30Strategy", "params": [{"signal_valid_days": 2}, {"signal_valid_days": 3}]}
+      ],
+      "periods": [["20230101", "20231231"], ["20240101", "20241231"]],
+      "universes": {"pool": "backtest_pool", "watchlist": "watchlist", "custom": ["600000.SH", "000001.SZ"]}
+    }
+
+股票池可写 "backtest_pool"（自选列表中加入回测池的股票）、"watchlist"（全部自选）、"all"（全部股票）或代码列表。
+每个任务按与 run_backtest 相同的内容哈希写入回测记录库；已有结果的任务直接跳过（--force 强制重算），
+因此中断后重新运行即可续跑。
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Any, List
+
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from data.database import Database  # noqa: E402
+from strategies.base import required_warmup  # noqa: E402
+from strategies.manager import StrategyManager  # noqa: E402
+from backtest.engine import (PRELOADED_ENGINES, build_run_spec, load_price_data, simulate_backtest,  # noqa: E402
+                             slice_price_data)
+from backtest.run_store import BacktestRunStore, run_key  # noqa: E402
+
+# 工作进程内共享的行情数据（每个进程只从数据库加载一次，所有任务复用）
+_WORKER_STATE: Dict[str, Any] = {}
+
+
+def resolve_universe(db: Database, universe) -> List[str]:
+    """将规格中的股票池描述解析为代码列表。"""
+    if isinstance(universe, list):
+        return sorted(set(universe))
+    queries = {
+        'backtest_pool': "SELECT ts_code FROM watchlist WHERE in_pool = 1",
+        'watchlist': "SELECT ts_code FROM watchlist",
+        'all': "SELECT ts_code FROM stocks",
+    }
+    if universe not in queries:
+        raise ValueError(f"未知的股票池: {universe}")
+    return sorted(r['ts_code'] for r in db.fetch_all(queries[universe]))
+
+
+def expand_jobs(spec: Dict[str, Any], db: Database, manager: StrategyManager) -> List[Dict[str, Any]]:
+    """展开规格为任务列表；每个任务附带回测记录库的 run_id。"""
+    engine = spec.get('engine', 'vectorized')
+    if engine not in PRELOADED_ENGINES:
+        raise ValueError(f"批量回测不支持引擎: {engine}（可选 {', '.join(PRELOADED_ENGINES)}）")
+    initial_capital = float(spec.get('initial_capital', 1_000_000))
+    max_positions = int(spec.get('max_positions', 10))
+    universes = {name: resolve_universe(db, u) for name, u in spec['universes'].items()}
+
+    jobs = []
+    for strat in spec['strategies']:
+        strategy_class = manager.get_strategy_class(strat['name'])
+        if not strategy_class:
+            raise ValueError(f"策略 '{strat['name']}' 未找到")
+        for params in strat.get('params') or [{}]:
+            for start_date, end_date in spec['periods']:
+                for universe_name, ts_codes in universes.items():
+                    run_spec = build_run_spec(db, strat['name'], strategy_class, ts_codes, start_date, end_date,
+                                              initial_capital, max_positions, params, engine)
+                    jobs.append({
+                        'run_id': run_key(run_spec),
+                        'spec': run_spec,
+                        'universe': universe_name,
+                        'strategy_params': params,
+                        'warmup_bars': required_warmup(strategy_class, params),
+                    })
+    return jobs
+
+
+def _init_worker(ts_codes, start_date, end_date, warmup_bars):
+    # 每个工作进程只加载一次覆盖全部任务的行情（最早区间之前的最大预热K线 ~ 最晚结束日期）
+    logging.basicConfig(level=logging.WARNING)
+    db = Database()
+    price_data, _ = load_price_data(db, ts_codes, start_date, end_date, warmup_bars=warmup_bars)
+    _WORKER_STATE.update({'price_data': price_data, 'manager': StrategyManager(db)})
+
+
+def _run_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    st = _WORKER_STATE
+    spec = job['spec']
+    strategy_class = st['manager'].get_strategy_class(spec['strategy'])
+    panel = slice_price_data(st['price_data'], spec['ts_codes'], spec['start_date'], spec['end_date'],
+                             job['warmup_bars'])
+    if not panel:
+        raise ValueError("回测区间内没有任何标的的行情数据")
+    result = simulate_backtest(strategy_class, panel, spec['start_date'], spec['initial_capital'],
+                               spec['max_positions'], job['strategy_params'], spec['engine'])
+    result.update({
+        'included_ts_codes': list(panel.keys()),
+        'skipped_ts_codes': [c for c in spec['ts_codes'] if c not in panel],
+        'warmup_bars': job['warmup_bars'],
+    })
+    return result
+
+
+def _result_row(job: Dict[str, Any], metrics: Dict[str, Any], status: str) -> Dict[str, Any]:
+    spec = job['spec']
+    return {
+        'run_id': job['run_id'],
+        'status': status,
+        'strategy': spec['strategy'],
+        'params': json.dumps(job['strategy_params'], ensure_ascii=False, sort_keys=True),
+        'universe': job['universe'],
+        'n_codes': len(spec['ts_codes']),
+        'start_date': spec['start_date'],
+        'end_date': spec['end_date'],
+        'engine': spec['engine'],
+        **metrics,
+    }
+
+
+def run_batch(spec: Dict[str, Any], max_workers: int | None = None, force: bool = False) -> pd.DataFrame:
+    """运行批量回测并返回汇总表（每个任务一行）。已有结果的任务直接读取（force=True 时重算）。"""
+    logger = logging.getLogger(__name__)
+    db = Database()
+    store = BacktestRunStore(db)
+    jobs = expand_jobs(spec, db, StrategyManager(db))
+
+    rows: Dict[str, Dict[str, Any]] = {}
+    pending, queued = [], set()
+    for job in jobs:
+        existing = None if force else store.get(job['run_id'])
+        if existing is not None:
+            rows[job['run_id']] = _result_row(job, existing['metrics'], 'cached')
+        elif job['run_id'] not in queued:
+            pending.append(job)
+            queued.add(job['run_id'])
+    logger.info(f"批量回测：共 {len(jobs)} 个任务，已有结果 {len(rows)} 个，待运行 {len(pending)} 个")
+
+    if pending:
+        all_codes = sorted(set().union(*(j['spec']['ts_codes'] for j in pending)))
+        start_date = min(j['spec']['start_date'] for j in pending)
+        end_date = max(j['spec']['end_date'] for j in pending)
+        warmup = max(j['warmup_bars'] for j in pending)
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(), initializer=_init_worker,
+                                 initargs=(all_codes, start_date, end_date, warmup)) as pool:
+            futures = {pool.submit(_run_job, job): job for job in pending}
+            for done, future in enumerate(as_completed(futures), start=1):
+                job = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.exception(f"任务失败 {job['spec']['strategy']} {job['universe']} "
+                                     f"{job['spec']['start_date']}~{job['spec']['end_date']}: {e}")
+                    rows[job['run_id']] = _result_row(job, {}, f'failed: {e}')
+                    continue
+                # 每完成一个任务立即写入回测记录库，中断后可续跑
+                store.save(job['run_id'], job['spec'], result)
+                rows[job['run_id']] = _result_row(job, result['metrics'], 'done')
+                logger.info(f"[{done}/{len(pending)}] {job['spec']['strategy']} {job['universe']} "
+                            f"{job['spec']['start_date']}~{job['spec']['end_date']} "
+                            f"总收益 {result['metrics']['total_return']:.2f}%")
+
+    return pd.DataFrame([rows[job['run_id']] for job in jobs if job['run_id'] in rows])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='批量回测（策略 × 参数 × 区间 × 股票池）')
+    parser.add_argument('spec', help='规格文件路径（JSON）')
+    parser.add_argument('--workers', type=int, default=None, help='工作进程数（默认 CPU 核数）')
+    parser.add_argument('--output', default=os.path.join('output', 'batch_results.csv'), help='汇总结果 CSV 路径')
+    parser.add_argument('--force', action='store_true', help='忽略已有结果，全部重算')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    with open(args.spec, 'r', encoding='utf-8') as f:
+        spec = json.load(f)
+    table = run_batch(spec, max_workers=args.workers, force=args.force)
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    table.to_csv(args.output, index=False, encoding='utf-8-sig')
+    logging.getLogger(__name__).info(f"汇总结果已保存至: {args.output}（{len(table)} 行）")
+    return 1 if table['status'].str.startswith('failed').any() else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""
+追加写入的列式事件文件（订单、成交、逐日净值）。
+
+首选 Arrow IPC 文件格式（pyarrow，按需导入）：每积累 batch_rows 行写出一个 RecordBatch，
+回测过程中常驻内存的只有当前批次；读取时整列零拷贝载入，便于事后分析。
+未安装 pyarrow 时退化为同名目录下按批次编号的 .npz 段文件，接口与读取结果一致。
+"""
+import glob
+import os
+import numpy as np
+import pandas as pd
+from typing import Dict, Any, Tuple
+
+# 列类型：'datetime'（秒精度）、'str'、'float'
+ORDER_SCHEMA: Tuple[Tuple[str, str], ...] = (
+    ('datetime', 'datetime'), ('ts_code', 'str'), ('side', 'str'), ('size', 'float'),
+    ('price', 'float'), ('value', 'float'), ('commission', 'float'),
+)
+TRADE_SCHEMA: Tuple[Tuple[str, str], ...] = (
+    ('ts_code', 'str'), ('open_datetime', 'datetime'), ('close_datetime', 'datetime'), ('direction', 'str'),
+    ('size', 'float'), ('open_price', 'float'), ('profit', 'float'), ('profit_comm', 'float'),
+)
+EQUITY_SCHEMA: Tuple[Tuple[str, str], ...] = (
+    ('date', 'datetime'), ('value', 'float'), ('cash', 'float'),
+)
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc  # noqa: F401
+        return pyarrow
+    except ImportError:
+        return None
+
+
+def _column_array(values: list, kind: str) -> np.ndarray:
+    if kind == 'datetime':
+        return pd.to_datetime(pd.Series(values, dtype=object)).to_numpy(dtype='datetime64[s]')
+    if kind == 'str':
+        return np.array([str(v) for v in values], dtype=str)
+    return np.asarray(values, dtype=float)
+
+
+class ColumnarWriter:
+    """按批追加写入一个列式事件文件（path 不含扩展名）。"""
+
+    def __init__(self, path: str, schema: Tuple[Tuple[str, str], ...], batch_rows: int = 4096):
+        self.path = path
+        self.schema = schema
+        self.batch_rows = batch_rows
+        self.rows_written = 0
+        self._buffer: Dict[str, list] = {name: [] for name, _ in schema}
+        self._pa = _pyarrow()
+        self._writer = None
+        self._segments = 0
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    def append(self, row: Dict[str, Any]) -> None:
+        for name, _ in self.schema:
+            self._buffer[name].append(row.get(name))
+        if len(self._buffer[self.schema[0][0]]) >= self.batch_rows:
+            self.flush()
+
+    def flush(self) -> None:
+        n = len(self._buffer[self.schema[0][0]])
+        if n == 0:
+            return
+        columns = {name: _column_array(self._buffer[name], kind) for name, kind in self.schema}
+        if self._pa is not None:
+            batch = self._pa.RecordBatch.from_arrays([self._pa.array(columns[name]) for name, _ in self.schema],
+                                                     names=[name for name, _ in self.schema])
+            if self._writer is None:
+                self._writer = self._pa.ipc.new_file(f'{self.path}.arrow', batch.schema)
+            self._writer.write_batch(batch)
+        else:
+            os.makedirs(f'{self.path}.d', exist_ok=True)
+            np.savez(os.path.join(f'{self.path}.d', f'{self._segments:06d}.npz'), **columns)
+            self._segments += 1
+        self.rows_written += n
+        self._buffer = {name: [] for name, _ in self.schema}
+
+    def close(self) -> None:
+        self.flush()
+        if self._pa is not None:
+            if self._writer is None:
+                # 空文件也写出表头，读取时得到空表
+                schema = self._pa.schema([(name, self._pa.from_numpy_dtype(_column_array([], kind).dtype))
+                                          for name, kind in self.schema])
+                self._writer = self._pa.ipc.new_file(f'{self.path}.arrow', schema)
+            self._writer.close()
+            self._writer = None
+        else:
+            os.makedirs(f'{self.path}.d', exist_ok=True)
+
+
+def write_columnar(path: str, schema: Tuple[Tuple[str, str], ...], records) -> None:
+    """一次性写出记录列表（如批量回测在工作进程中产生的结果）。"""
+    writer = ColumnarWriter(path, schema)
+    for row in records:
+        writer.append(row)
+    writer.close()
+
+
+def read_columnar(path: str, schema: Tuple[Tuple[str, str], ...]) -> pd.DataFrame:
+    """读取 ColumnarWriter 写出的文件（自动识别 Arrow IPC 或 .npz 段目录）。文件不存在时返回空表。"""
+    columns = [name for name, _ in schema]
+    if os.path.exists(f'{path}.arrow'):
+        pa = _pyarrow()
+        if pa is None:
+            raise ImportError("读取 Arrow 格式的回测记录需要安装 pyarrow")
+        with pa.memory_map(f'{path}.arrow', 'r') as source:
+            df = pa.ipc.open_file(source).read_all().to_pandas()
+    elif os.path.isdir(f'{path}.d'):
+        parts = []
+        for seg in sorted(glob.glob(os.path.join(f'{path}.d', '*.npz'))):
+            with np.load(seg, allow_pickle=False) as payload:
+                parts.append(pd.DataFrame({name: payload[name] for name in columns}))
+        df = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=columns)
+    else:
+        df = pd.DataFrame(columns=columns)
+    for name, kind in schema:
+        if kind == 'datetime':
+            df[name] = pd.to_datetime(df[name])
+        elif kind == 'float':
+            df[name] = df[name].astype(float)
+    return df[columns]
+
+
+class RunRecorder:
+    """一次回测的事件记录器：订单、已平仓交易与逐日净值分别追加写入 directory 下的列式文件。"""
+
+    def __init__(self, directory: str, batch_rows: int = 4096):
+        self.directory = directory
+        self.orders = ColumnarWriter(os.path.join(directory, 'orders'), ORDER_SCHEMA, batch_rows)
+        self.trades = ColumnarWriter(os.path.join(directory, 'trades'), TRADE_SCHEMA, batch_rows)
+        self.equity = ColumnarWriter(os.path.join(directory, 'equity'), EQUITY_SCHEMA, batch_rows)
+
+    def record_order(self, order: Dict[str, Any]) -> None:
+        self.orders.append(order)
+
+    def record_trade(self, trade: Dict[str, Any]) -> None:
+        self.trades.append(trade)
+
+    def record_equity(self, date, value: float, cash: float) -> None:
+        self.equity.append({'date': date, 'value': value, 'cash': cash})
+
+    def close(self) -> None:
+        for writer in (self.orders, self.trades, self.equity):
+            writer.close()
+
+
+def read_run(directory: str) -> Dict[str, pd.DataFrame]:
+    """读取 RunRecorder 写出的全部事件（orders / trades / equity）。"""
+    return {
+        'orders': read_columnar(os.path.join(directory, 'orders'), ORDER_SCHEMA),
+        'trades': read_columnar(os.path.join(directory, 'trades'), TRADE_SCHEMA),
+        'equity': read_columnar(os.path.join(directory, 'equity'), EQUITY_SCHEMA),
+    }
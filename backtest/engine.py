@@ -1,16 +1,30 @@
 import backtrader as bt
 import pandas as pd
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Tuple, Callable
 import os
+import shutil
+import tempfile
 from data.database import Database
 from strategies.manager import StrategyManager
+from strategies.base import SignalData, build_signals, with_signals, required_warmup, resolve_params
 from config.settings import get_settings
+from backtest.metrics import compute_metrics
+from backtest.vectorized import run_vectorized, SLIPPAGE_PERC
+from backtest.memmap_panel import run_memmap_backtest, RssPeakSampler
+from backtest.run_store import BacktestRunStore, RUNS_DIR, data_version, run_key
+from backtest.columnar import RunRecorder, read_run
+from analysis.benchmarks import DEFAULT_BENCHMARK, benchmark_curves, benchmark_stats
+from utils.plotting import DEFAULT_MAX_POINTS, line_trace, slice_range
+from utils.timing import span, timed, current_span
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import logging
 
 settings = get_settings()
 
+# 撮合/指标口径版本：语义变化时递增，使历史回测缓存失效
+ENGINE_VERSION = '2'
+
 # --- 自定义资金管理器 (Custom Sizer) ---
 class RemainingCashSizer(bt.Sizer):
     """
@@ -24,13 +38,9 @@ class RemainingCashSizer(bt.Sizer):
 
     def _getsizing(self, comminfo, cash, data, isbuy):
         if isbuy:
-            # 计算当前已有的持仓数量
-            open_positions = 0
-            for d in self.strategy.datas:
-                pos = self.strategy.getposition(d)
-                if pos.size != 0:
-                    open_positions += 1
-            
+            # 当前已有的持仓数量（策略基类增量维护的持仓集合）
+            open_positions = len(self.strategy.held)
+
             # 如果持仓已满，则不再买入
             if open_positions >= self.p.max_positions:
                 return 0
@@ -49,38 +59,70 @@ class RemainingCashSizer(bt.Sizer):
             # 如果是卖出操作，则卖出全部持仓
             return self.strategy.getposition(data).size
 
-def create_backtest_plot(results, ts_codes, strategy_name, start_date: str, end_date: str, db: Database,
-                         initial_capital: float, normalized: bool = True) -> go.Figure:
-    """使用Plotly创建带有沪深300对比和回撤子图的回测图表。
+class ValueRecorder(bt.Analyzer):
+    """精简分析器：每根K线只记录组合总资产与现金，指标在回测结束后统一向量化计算。
+    传入 recorder（backtest.columnar.RunRecorder）时同时逐日追加写入净值文件。"""
+    params = (('recorder', None),)
+
+    def start(self):
+        self.dates, self.values, self.cash = [], [], []
+        self._value = self._cash = None
+
+    def notify_fund(self, cash, value, fundvalue, shares):
+        self._cash, self._value = cash, value
+
+    def next(self):
+        self.dates.append(self.strategy.datetime.datetime(0))
+        self.values.append(self._value)
+        self.cash.append(self._cash)
+        if self.p.recorder is not None:
+            self.p.recorder.record_equity(self.dates[-1], self._value, self._cash)
+
+    def get_analysis(self):
+        index = pd.DatetimeIndex(self.dates).normalize()
+        return {
+            'values': pd.Series(self.values, index=index, dtype=float),
+            'cash': pd.Series(self.cash, index=index, dtype=float),
+        }
+
+
+class ProgressReporter(bt.Analyzer):
+    """每根K线调用一次 callback(已完成K线数, 总K线数)；回调抛出的异常（如任务被取消）会中止回测。"""
+    params = (('callback', None), ('total', 0))
+
+    def start(self):
+        self.count = 0
+
+    def next(self):
+        self.count += 1
+        self.p.callback(self.count, self.p.total)
+
+
+# 基准曲线配色（策略固定为 royalblue）
+BENCHMARK_COLORS = ('firebrick', 'darkorange', 'seagreen', 'purple', 'saddlebrown', 'teal', 'gray')
+
+
+def create_backtest_plot(values: pd.Series, strategy_name, benchmark_closes: pd.DataFrame,
+                         initial_capital: float, normalized: bool = True,
+                         benchmark_names: Dict[str, str] | None = None,
+                         max_points: int | None = DEFAULT_MAX_POINTS, x_range=None) -> go.Figure:
+    """使用Plotly创建带有基准指数对比和回撤子图的回测图表。
+    - values: 逐日组合总资产
+    - benchmark_closes: 与 values 对齐的基准指数收盘价（每列一个指数，见 analysis.benchmarks.benchmark_curves）
     - normalized=True 显示归一化净值；否则显示绝对净值（以初始资金为基准）。
+    - max_points: 每条曲线的最大点数（LTTB 降采样，见 utils.plotting）；None 表示不降采样。
+    - x_range: 可选的 (起, 止) 显示区间；净值归一与回撤仍按全区间计算，只对区间内的原始数据降采样。
     """
-    strat = results[0]
-    # TimeReturn analyzer dict -> daily returns
-    ret_series = pd.Series(strat.analyzers.timereturn.get_analysis())
-    if ret_series.empty:
-        ret_series = pd.Series(dtype=float)
-
     # 构建组合净值（归一化）
     try:
-        port_curve = (1 + ret_series).cumprod()
+        port_curve = values / float(initial_capital)
         port_curve.index = pd.to_datetime(port_curve.index)
         # 若需要，仅从第一个交易日开始
         first_valid = port_curve.first_valid_index()
         if first_valid is not None:
             port_curve = port_curve.loc[first_valid:]
     except Exception:
-        port_curve = ret_series
-
-    # 获取沪深300
-    hs300_df = pd.DataFrame(db.fetch_all(
-        "SELECT date, close FROM index_daily_price WHERE ts_code = '000300.SH' AND date BETWEEN ? AND ? ORDER BY date",
-        (start_date, end_date)
-    ))
-    hs300_curve = None
-    if not hs300_df.empty:
-        hs300_df['date'] = pd.to_datetime(hs300_df['date'])
-        hs300_df.set_index('date', inplace=True)
-        hs300_curve = hs300_df['close'] / hs300_df['close'].iloc[0]
+        port_curve = pd.Series(dtype=float)
 
     # 归一化或绝对净值转换
     if not port_curve.empty:
@@ -91,15 +133,15 @@ def create_backtest_plot(results, ts_codes, strategy_name, start_date: str, end_
     else:
         strat_equity = pd.Series(dtype=float)
 
-    if hs300_curve is not None and not hs300_curve.empty:
-        if not normalized:
-            hs300_equity = hs300_curve * float(initial_capital)
-        else:
-            hs300_equity = hs300_curve
+    # 基准：以各自首个有效收盘价归一
+    bench_equity = pd.DataFrame(dtype=float)
+    if benchmark_closes is not None and not benchmark_closes.empty:
+        closes = benchmark_closes
         if not strat_equity.empty:
-            hs300_equity = hs300_equity.loc[strat_equity.index.min():]
-    else:
-        hs300_equity = None
+            closes = closes.loc[strat_equity.index.min():]
+        bench_equity = closes / closes.bfill().iloc[0]
+        if not normalized:
+            bench_equity = bench_equity * float(initial_capital)
 
     # 计算回撤
     def drawdown(series: pd.Series) -> pd.Series:
@@ -110,33 +152,36 @@ def create_backtest_plot(results, ts_codes, strategy_name, start_date: str, end_
         return dd
 
     strat_dd = drawdown(strat_equity)
-    hs300_dd = drawdown(hs300_equity) if hs300_equity is not None else pd.Series(dtype=float)
 
     # 子图：上净值，下回撤
     fig = make_subplots(rows=2, cols=1, shared_xaxes=True, vertical_spacing=0.08,
                         row_heights=[0.7, 0.3], subplot_titles=("净值曲线", "回撤"))
 
+    def trace(series: pd.Series, name: str, **kwargs):
+        return line_trace(slice_range(series, x_range), name, max_points=max_points, **kwargs)
+
     if not strat_equity.empty:
-        fig.add_trace(go.Scatter(x=strat_equity.index, y=strat_equity.values,
-                                 name='策略净值' + ('(归一)' if normalized else ''),
-                                 line=dict(color='royalblue', width=2)), row=1, col=1)
-    if hs300_equity is not None and not hs300_equity.empty:
-        fig.add_trace(go.Scatter(x=hs300_equity.index, y=hs300_equity.values,
-                                 name='沪深300' + ('(归一)' if normalized else ''),
-                                 line=dict(color='firebrick', width=1.5, dash='dash')), row=1, col=1)
+        fig.add_trace(trace(strat_equity, '策略净值' + ('(归一)' if normalized else ''),
+                            line=dict(color='royalblue', width=2)), row=1, col=1)
+    names = benchmark_names or {}
+    for k, code in enumerate(bench_equity.columns):
+        color = BENCHMARK_COLORS[k % len(BENCHMARK_COLORS)]
+        label = names.get(code, code)
+        curve = bench_equity[code].dropna()
+        fig.add_trace(trace(curve, label + ('(归一)' if normalized else ''),
+                            line=dict(color=color, width=1.5, dash='dash')), row=1, col=1)
+        fig.add_trace(trace(drawdown(curve), f'{label}回撤', line=dict(color=color, width=1, dash='dash')),
+                      row=2, col=1)
 
     if not strat_dd.empty:
-        fig.add_trace(go.Scatter(x=strat_dd.index, y=strat_dd.values,
-                                 name='策略回撤', line=dict(color='royalblue', width=1)), row=2, col=1)
-    if not hs300_dd.empty:
-        fig.add_trace(go.Scatter(x=hs300_dd.index, y=hs300_dd.values,
-                                 name='沪深300回撤', line=dict(color='firebrick', width=1, dash='dash')), row=2, col=1)
+        fig.add_trace(trace(strat_dd, '策略回撤', line=dict(color='royalblue', width=1)), row=2, col=1)
 
     fig.update_yaxes(title_text=('归一化净值' if normalized else '净值'), row=1, col=1)
     fig.update_yaxes(title_text='回撤', tickformat='.0%', row=2, col=1)
+    title_benchmarks = '、'.join(names.get(c, c) for c in bench_equity.columns)
     fig.update_layout(
         height=640,
-        title_text=f"Backtest: {strategy_name}（对比沪深300）",
+        title_text=f"Backtest: {strategy_name}" + (f"（对比{title_benchmarks}）" if title_benchmarks else ""),
         xaxis_title="日期",
         legend_title="图例",
         template="plotly_white",
@@ -144,134 +189,357 @@ def create_backtest_plot(results, ts_codes, strategy_name, start_date: str, end_
     )
     return fig
 
-def run_backtest(strategy_name: str, ts_codes: List[str], start_date: str, end_date: str,
-                 initial_capital: float, max_positions: int, normalized: bool = True,
-                 strategy_params: dict | None = None) -> Dict[str, Any]:
+def load_price_data(db: Database, ts_codes: List[str], start_date: str, end_date: str,
+                    warmup_bars: int = 0) -> Tuple[Dict[str, pd.DataFrame], List[str]]:
+    """
+    按标的读取日线行情（索引为 datetime）：[start_date, end_date] 区间内的K线，
+    外加 start_date 之前最近的 warmup_bars 根K线用于指标预热。
+    预热K线不足的标的照常保留（信号在预热完成前为 False）；区间内没有任何K线的标的被跳过。
+    """
+    price_data: Dict[str, pd.DataFrame] = {}
+    skipped_ts_codes = []
+    query = (
+        "SELECT date, open, high, low, close, volume FROM ("
+        "  SELECT date, open, high, low, close, volume FROM daily_price"
+        "  WHERE ts_code = ? AND date < ? ORDER BY date DESC LIMIT ?"
+        ") UNION ALL "
+        "SELECT date, open, high, low, close, volume FROM daily_price WHERE ts_code = ? AND date BETWEEN ? AND ? "
+        "ORDER BY date"
+    )
+    with span('load_price_data', tickers=len(ts_codes)) as load:
+        for ts_code in ts_codes:
+            with span('sql') as sql:
+                rows = db.fetch_all(query, (ts_code, start_date, int(warmup_bars), ts_code, start_date, end_date))
+                sql.add(rows=len(rows))
+            with span('dataframe'):
+                df = pd.DataFrame(rows)
+                if df.empty or df['date'].iloc[-1] < start_date:
+                    skipped_ts_codes.append(ts_code)
+                    continue
+                df['date'] = pd.to_datetime(df['date'])
+                df.set_index('date', inplace=True)
+            price_data[ts_code] = df
+            load.add(rows=len(df))
+    return price_data, skipped_ts_codes
+
+
+def run_cerebro(strategy_class, price_data: Dict[str, pd.DataFrame], initial_capital: float,
+                max_positions: int, strategy_params: dict | None = None, trade_start=None, lean: bool = True,
+                progress: Callable[[int, int], None] | None = None, recorder: RunRecorder | None = None,
+                signals: Dict[str, pd.DataFrame] | None = None):
+    """用给定的行情数据运行一次 Backtrader 回测，返回策略实例。
+
+    trade_start: 可选的开始交易日期；此前的K线仅用于指标预热，不产生订单。
+    买卖信号在运行前由策略模块的 compute_signals 向量化算好，作为 SignalData 的附加行传入。
+    lean: True 时只挂 ValueRecorder（逐日资产/现金），订单与成交由策略自身记录，指标回测后统一计算；
+          False 时额外挂上 backtrader 自带的 SharpeRatio/DrawDown/Returns/TradeAnalyzer/TimeReturn，便于核对口径。
+    progress: 可选的逐K线进度回调 progress(已完成, 总数)。
+    recorder: 可选的事件记录器；传入时订单、成交与逐日净值边运行边写盘，策略不再在内存中累积订单/成交列表。
+    signals: 可选的预先算好的信号 {ts_code: DataFrame}（可覆盖比 price_data 更长的区间，按行情日期截取）；
+             未给出时按 price_data 调用 build_signals。
+    """
     cerebro = bt.Cerebro()
-    
-    strategy_manager = StrategyManager(Database())
-    strategy_class = strategy_manager.get_strategy_class(strategy_name)
-    if not strategy_class:
-        raise ValueError(f"策略 '{strategy_name}' 未找到")
-    
+
     # 为策略传递参数：将 max_positions 传入，便于策略内限制当日新开仓数量
-    sp = strategy_params or {}
+    sp = dict(strategy_params or {})
+    if trade_start is not None:
+        sp['trade_start'] = pd.Timestamp(trade_start).date()
+    if recorder is not None:
+        sp['recorder'] = recorder
     try:
         cerebro.addstrategy(strategy_class, max_positions=max_positions, **sp)
     except TypeError:
         # 若策略不支持这些参数，回退只传 max_positions
         cerebro.addstrategy(strategy_class, max_positions=max_positions)
 
-    db = Database()
-    included_ts_codes = []
-    skipped_ts_codes = []
-    for ts_code in ts_codes:
-        query = "SELECT date, open, high, low, close, volume FROM daily_price WHERE ts_code = ? AND date BETWEEN ? AND ? ORDER BY date"
-        df = pd.DataFrame(db.fetch_all(query, (ts_code, start_date, end_date)))
-        # 需要至少满足最长指标窗口（本策略最长为240天）
-        if not df.empty and len(df) > 240:
-            df['date'] = pd.to_datetime(df['date'])
-            df.set_index('date', inplace=True)
-            data_feed = bt.feeds.PandasData(dataname=df)
-            cerebro.adddata(data_feed, name=ts_code)
-            included_ts_codes.append(ts_code)
-        else:
-            skipped_ts_codes.append(ts_code)
+    for ts_code, df in price_data.items():
+        sig = signals[ts_code].reindex(df.index) if signals is not None else build_signals(strategy_class, df, strategy_params)
+        cerebro.adddata(SignalData(dataname=with_signals(df, sig)), name=ts_code)
 
     # --- Broker, Sizer, and Slippage Configuration ---
     cerebro.broker.setcash(initial_capital)
     # 设置手续费
     cerebro.broker.setcommission(commission=settings.BACKTEST_FEE_RATE)
     # 设置滑点 (0.01% = 0.0001)
-    cerebro.broker.set_slippage_perc(perc=0.0001)
+    cerebro.broker.set_slippage_perc(perc=SLIPPAGE_PERC)
     
     # 使用自定义的资金管理器
     cerebro.addsizer(RemainingCashSizer, max_positions=max_positions)
 
     # --- Analyzers ---
-    cerebro.addanalyzer(bt.analyzers.SharpeRatio, _name='sharpe_ratio')
-    cerebro.addanalyzer(bt.analyzers.DrawDown, _name='drawdown')
-    cerebro.addanalyzer(bt.analyzers.Returns, _name='returns')
-    cerebro.addanalyzer(bt.analyzers.TradeAnalyzer, _name='trade_analyzer')
-    cerebro.addanalyzer(bt.analyzers.TimeReturn, _name='timereturn')
+    # 收益/回撤/夏普等由 backtest.metrics 基于开始交易日之后的逐日资产计算（排除预热期）
+    cerebro.addanalyzer(ValueRecorder, _name='value_recorder', recorder=recorder)
+    if not lean:
+        cerebro.addanalyzer(bt.analyzers.SharpeRatio, _name='sharpe_ratio')
+        cerebro.addanalyzer(bt.analyzers.DrawDown, _name='drawdown')
+        cerebro.addanalyzer(bt.analyzers.Returns, _name='returns')
+        cerebro.addanalyzer(bt.analyzers.TradeAnalyzer, _name='trade_analyzer')
+        cerebro.addanalyzer(bt.analyzers.TimeReturn, _name='timereturn')
+    if progress is not None:
+        total = len(pd.DatetimeIndex(sorted(set().union(*(df.index for df in price_data.values())))))
+        cerebro.addanalyzer(ProgressReporter, _name='progress', callback=progress, total=total)
 
     logging.getLogger(__name__).info("--- 开始运行 Backtrader 回测 ---")
     # 使用 step-by-step 模式以规避 Python 3.13 下 backtrader runonce 的潜在兼容性问题
-    results = cerebro.run(runonce=False)
+    with span('cerebro.run', tickers=len(price_data)):
+        results = cerebro.run(runonce=False)
     logging.getLogger(__name__).info("--- 回测结束 ---")
+    return results[0]
 
-    thestrat = results[0]
-    trade_analysis = thestrat.analyzers.trade_analyzer.get_analysis()
-    
-    metrics = {
-        'total_return': thestrat.analyzers.returns.get_analysis().get('rtot', 0) * 100,
-        'annual_return': thestrat.analyzers.returns.get_analysis().get('rann', 0) * 100,
-        'sharpe_ratio': 0,
-        'max_drawdown': thestrat.analyzers.drawdown.get_analysis().get('max', {}).get('drawdown', 0),
-        'total_trades': trade_analysis.get('total', {}).get('total', 0),
-        'win_rate': 0,
+
+def daily_values(thestrat, initial_capital: float) -> pd.Series:
+    """逐日组合总资产（ValueRecorder 记录）。"""
+    return thestrat.analyzers.value_recorder.get_analysis()['values']
+
+
+def daily_cash(thestrat) -> pd.Series:
+    """逐日现金余额（ValueRecorder 记录）。"""
+    return thestrat.analyzers.value_recorder.get_analysis()['cash']
+
+
+def trade_counts(thestrat) -> Tuple[int, int]:
+    """（总交易数, 盈利交易数）：策略增量统计的开仓数与盈利平仓数，口径同 TradeAnalyzer（净盈亏 >= 0 记为盈利）。"""
+    return thestrat.opened_trades, thestrat.won_trades
+
+
+@timed('csv_export')
+def trades_csv_bytes(trades: pd.DataFrame) -> bytes:
+    """已平仓交易记录的 CSV（中文列名、UTF-8 BOM），用于下载时按需生成。"""
+    output_df = pd.DataFrame({
+        '交易时间': pd.to_datetime(trades['close_datetime']).dt.strftime('%Y-%m-%d %H:%M:%S'),
+        'ts_code': trades['ts_code'],
+        '开仓价格': trades['open_price'].astype(float).round(2),
+        '数量': trades['size'],
+        '平仓方向': trades['direction'].map(lambda x: '卖出(平多)' if x == 'long' else '买入(平空)'),
+        '盈利': trades['profit_comm'].astype(float).round(2)
+    })
+    return output_df.to_csv(index=False).encode('utf-8-sig')
+
+
+@timed('csv_export')
+def orders_csv_bytes(orders: pd.DataFrame) -> bytes:
+    """订单执行明细（包含买入与卖出）的 CSV（中文列名、UTF-8 BOM），用于下载时按需生成。"""
+    output_df = pd.DataFrame({
+        '时间': pd.to_datetime(orders['datetime']).dt.strftime('%Y-%m-%d %H:%M:%S'),
+        'ts_code': orders['ts_code'],
+        '方向': orders['side'].map({'buy': '买入', 'sell': '卖出'}),
+        'size': orders['size'],
+        'price': orders['price'],
+        'commission': orders['commission'],
+    })
+    return output_df.to_csv(index=False).encode('utf-8-sig')
+
+
+BACKTEST_ENGINES = ('backtrader', 'vectorized', 'memmap')
+# 在预先加载到内存的行情上运行的引擎（walk-forward、批量回测可共享同一份行情）
+PRELOADED_ENGINES = ('backtrader', 'vectorized')
+
+
+def build_run_spec(db: Database, strategy_name: str, strategy_class, ts_codes: List[str], start_date: str,
+                   end_date: str, initial_capital: float, max_positions: int, strategy_params: dict | None,
+                   engine: str) -> Dict[str, Any]:
+    """回测请求的规范化描述（用于回测记录库的内容哈希）。股票池去重排序；交易成本（手续费率、滑点）也计入，
+    修改配置后不会命中旧的缓存结果。"""
+    params = {k: v for k, v in resolve_params(strategy_class, strategy_params).items()
+              if k not in ('trade_start', 'recorder')}
+    ts_codes = sorted(set(ts_codes))
+    return {
+        'strategy': strategy_name,
+        'params': params,
+        'ts_codes': ts_codes,
+        'start_date': start_date,
+        'end_date': end_date,
+        'initial_capital': float(initial_capital),
+        'max_positions': int(max_positions),
+        'fee_rate': float(settings.BACKTEST_FEE_RATE),
+        'slippage': float(SLIPPAGE_PERC),
+        'engine': engine,
+        'engine_version': ENGINE_VERSION,
+        'data_version': data_version(db, ts_codes, end_date),
     }
-    
-    # 安全获取夏普比率
-    sharpe_analysis = thestrat.analyzers.sharpe_ratio.get_analysis()
-    if sharpe_analysis and sharpe_analysis.get('sharperatio') is not None:
-        metrics['sharpe_ratio'] = sharpe_analysis.get('sharperatio', 0)
-    
-    total_trades = trade_analysis.get('total', {}).get('total', 0)
-    if total_trades > 0:
-        won_trades = trade_analysis.get('won', {}).get('total', 0)
-        metrics['win_rate'] = (won_trades / total_trades) * 100 if total_trades > 0 else 0
-
-    # --- Save trades to CSV ---
-    trades_csv_path = None
-    orders_csv_path = None
-    if hasattr(thestrat, 'closed_trades') and thestrat.closed_trades:
-        import datetime
-
-        trades_df = pd.DataFrame(thestrat.closed_trades)
-        
-        # 格式化输出
-        trades_df['买卖方向'] = trades_df['direction'].apply(lambda x: '卖出(平多)' if x == 'long' else '买入(平空)')
-        
-        # 选择并重命名列
-        output_df = pd.DataFrame({
-            '交易时间': pd.to_datetime(trades_df['close_datetime']).dt.strftime('%Y-%m-%d %H:%M:%S'),
-            'ts_code': trades_df['ts_code'],
-            '开仓价格': trades_df['open_price'].round(2),
-            '数量': trades_df['size'],
-            '平仓方向': trades_df['买卖方向'],
-            '盈利': trades_df['profit_comm'].round(2)
-        })
-
-        timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M')
-        os.makedirs('output', exist_ok=True)
-        filename = os.path.join('output', f'backtest_trades_{timestamp}.csv')
-        output_df.to_csv(filename, index=False, encoding='utf-8-sig')
-        trades_csv_path = filename
-        logging.getLogger(__name__).info(f"交易记录已保存至: {filename}")
-
-    # 导出订单执行明细（包含买入与卖出）
-    if hasattr(thestrat, 'executed_orders') and thestrat.executed_orders:
-        import datetime
-        orders_df = pd.DataFrame(thestrat.executed_orders).copy()
-        orders_df['时间'] = pd.to_datetime(orders_df['datetime']).dt.strftime('%Y-%m-%d %H:%M:%S')
-        orders_df['方向'] = orders_df['side'].map({'buy': '买入', 'sell': '卖出'})
-        orders_df = orders_df[['时间', 'ts_code', '方向', 'size', 'price', 'commission']]
-        timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M')
-        filename = os.path.join('output', f'backtest_orders_{timestamp}.csv')
-        orders_df.to_csv(filename, index=False, encoding='utf-8-sig')
-        orders_csv_path = filename
-        logging.getLogger(__name__).info(f"订单执行记录已保存至: {filename}")
-
-    plot_figure = create_backtest_plot(results, ts_codes, strategy_name, start_date, end_date, db,
-                                       initial_capital=initial_capital, normalized=normalized)
+
+
+def slice_price_data(price_data: Dict[str, pd.DataFrame], ts_codes: List[str], start, end,
+                     warmup_bars: int) -> Dict[str, pd.DataFrame]:
+    """从已加载的行情中截取 [start, end] 区间，并向前保留最多 warmup_bars 根K线用于指标预热。
+    预热样本不足的标的照常参与（信号在预热完成前为 False）；区间内无K线的标的不参与。"""
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    sliced = {}
+    for ts_code in ts_codes:
+        df = price_data.get(ts_code)
+        if df is None:
+            continue
+        pos = df.index.searchsorted(start)
+        end_pos = df.index.searchsorted(end, side='right')
+        if end_pos > pos:
+            sliced[ts_code] = df.iloc[max(0, pos - warmup_bars):end_pos]
+    return sliced
+
+
+def simulate_backtest(strategy_class, price_data: Dict[str, pd.DataFrame], start_date: str, initial_capital: float,
+                      max_positions: int, strategy_params: dict | None = None,
+                      engine: str = 'backtrader',
+                      progress: Callable[[int, int], None] | None = None,
+                      recorder: RunRecorder | None = None) -> Dict[str, Any]:
+    """在已加载（含预热K线）的行情上运行一次回测；交易与指标统计从 start_date 起算。
+    progress: 可选的逐K线进度回调 progress(已完成, 总数)，回调抛出异常即中止回测。
+    recorder: 可选的事件记录器；传入时订单/成交/净值流式写盘，返回结果中的订单与成交从文件读回（DataFrame）。"""
+    trade_start = pd.Timestamp(start_date)
+    if engine == 'vectorized':
+        sim = run_vectorized(strategy_class, price_data, initial_capital, max_positions, strategy_params,
+                             trade_start=trade_start, progress=progress, recorder=recorder)
+        values, cash = sim['values'], sim['cash']
+        total_trades, won_trades = sim['total_trades'], sim['won_trades']
+        closed_trades, executed_orders = sim['closed_trades'], sim['executed_orders']
+    elif engine == 'backtrader':
+        thestrat = run_cerebro(strategy_class, price_data, initial_capital, max_positions, strategy_params,
+                               trade_start=trade_start, progress=progress, recorder=recorder)
+        with span('analyzers'):
+            values, cash = daily_values(thestrat, initial_capital), daily_cash(thestrat)
+            total_trades, won_trades = trade_counts(thestrat)
+        closed_trades = getattr(thestrat, 'closed_trades', [])
+        executed_orders = getattr(thestrat, 'executed_orders', [])
+    else:
+        raise ValueError(f"引擎 {engine} 不支持在预加载行情上运行")
+    if recorder is not None:
+        closed_trades, executed_orders = _recorded_events(recorder)
+    return _package_result(values, cash, total_trades, won_trades, closed_trades, executed_orders,
+                           trade_start, initial_capital)
+
+
+def _recorded_events(recorder: RunRecorder):
+    """关闭记录器并读回（已平仓交易, 订单）两张列式表。"""
+    with span('read_events') as sp:
+        recorder.close()
+        events = read_run(recorder.directory)
+        sp.add(rows=len(events['trades']) + len(events['orders']))
+    return events['trades'], events['orders']
+
+
+def _package_result(values: pd.Series, cash: pd.Series, total_trades: int, won_trades: int,
+                    closed_trades, executed_orders, trade_start, initial_capital: float) -> Dict[str, Any]:
+    # 净值与指标均从开始交易日起算
+    values = values.loc[trade_start:]
+    with span('metrics'):
+        metrics = compute_metrics(values, initial_capital, total_trades, won_trades,
+                                  closed_trades=closed_trades, executed_orders=executed_orders, cash=cash)
+    return {
+        'values': values,
+        'metrics': metrics,
+        'closed_trades': closed_trades,
+        'executed_orders': executed_orders,
+    }
+
+
+@timed('run_backtest')
+def run_backtest(strategy_name: str, ts_codes: List[str], start_date: str, end_date: str,
+                 initial_capital: float, max_positions: int, normalized: bool = True,
+                 strategy_params: dict | None = None, engine: str = 'backtrader',
+                 use_cache: bool = True, benchmarks: List[str] | None = None,
+                 progress: Callable[[int, int], None] | None = None) -> Dict[str, Any]:
+    """运行回测。engine: 'backtrader'（逐K线事件驱动）、'vectorized'（NumPy 组合模拟，口径一致）
+    或 'memmap'（全市场低内存模式：分批计算信号写入 float32 内存映射面板，见 backtest/memmap_panel.py）。
+    结果按请求内容与数据版本哈希保存到回测记录库；相同请求直接读取（use_cache=False 强制重算）。
+    benchmarks: 对比的指数代码列表（默认沪深300），从进程内共享的指数面板取数，返回各基准的超额指标。
+    progress: 可选的逐K线进度回调（后台任务用于上报进度与响应取消）。
+    订单与成交明细不随结果返回，可按 run_id 通过 BacktestRunStore.load 读取或生成 CSV 下载。
+    各阶段耗时记录在 utils.timing 的 'run_backtest' 明细中；peak_rss_mb 为本次运行期间采样到的峰值内存。"""
+    with RssPeakSampler() as rss:
+        result = _run_backtest(strategy_name, ts_codes, start_date, end_date, initial_capital, max_positions,
+                               normalized, strategy_params, engine, use_cache, benchmarks, progress)
+    result['peak_rss_mb'] = rss.peak_mb
+    return result
+
+
+def _run_backtest(strategy_name: str, ts_codes: List[str], start_date: str, end_date: str,
+                  initial_capital: float, max_positions: int, normalized: bool, strategy_params: dict | None,
+                  engine: str, use_cache: bool, benchmarks: List[str] | None,
+                  progress: Callable[[int, int], None] | None) -> Dict[str, Any]:
+    strategy_manager = StrategyManager(Database())
+    strategy_class = strategy_manager.get_strategy_class(strategy_name)
+    if not strategy_class:
+        raise ValueError(f"策略 '{strategy_name}' 未找到")
+
+    if engine not in BACKTEST_ENGINES:
+        raise ValueError(f"未知的回测引擎: {engine}")
+
+    db = Database()
+    current_span().set(strategy=strategy_name, engine=engine, tickers=len(ts_codes))
+    # 股票池排序后再加载：候选评分相同时按数据源顺序成交，保证同一请求结果可复现
+    with span('build_run_spec'):
+        spec = build_run_spec(db, strategy_name, strategy_class, ts_codes, start_date, end_date,
+                              initial_capital, max_positions, strategy_params, engine)
+    run_id = run_key(spec)
+    store = BacktestRunStore(db)
+    # 缓存命中时只读取净值；订单/成交明细在下载时再从列式文件读取
+    with span('load_cached'):
+        cached = store.load(run_id, events=False) if use_cache else None
+
+    if cached is not None:
+        logging.getLogger(__name__).info(f"命中回测缓存: {run_id}")
+        values, metrics = cached['values'], cached['metrics']
+        included_ts_codes, skipped_ts_codes = cached['ts_codes'], cached['skipped_ts_codes']
+        warmup = cached['warmup_bars']
+    else:
+        # 订单、成交与逐日净值边运行边写入列式文件，保存时整体移入回测记录库
+        os.makedirs(RUNS_DIR, exist_ok=True)
+        recorder = RunRecorder(tempfile.mkdtemp(prefix='tmp_', dir=RUNS_DIR))
+        try:
+            if engine == 'memmap':
+                sim = run_memmap_backtest(db, strategy_class, spec['ts_codes'], start_date, end_date,
+                                          initial_capital, max_positions, strategy_params, progress=progress,
+                                          recorder=recorder)
+                included_ts_codes, skipped_ts_codes, warmup = (sim['included_ts_codes'], sim['skipped_ts_codes'],
+                                                               sim['warmup_bars'])
+                result = _package_result(sim['values'], sim['cash'], sim['total_trades'], sim['won_trades'],
+                                         *_recorded_events(recorder), pd.Timestamp(start_date), initial_capital)
+            else:
+                # 在开始日期之前按策略参数加载恰好所需的预热K线，交易与指标统计从开始日期起算
+                warmup = required_warmup(strategy_class, strategy_params)
+                price_data, skipped_ts_codes = load_price_data(db, spec['ts_codes'], start_date, end_date,
+                                                               warmup_bars=warmup)
+                if not price_data:
+                    raise ValueError("回测区间内没有任何标的的行情数据")
+                included_ts_codes = list(price_data.keys())
+                result = simulate_backtest(strategy_class, price_data, start_date, initial_capital, max_positions,
+                                           strategy_params, engine, progress=progress, recorder=recorder)
+            with span('store.save'):
+                store.save(run_id, spec, {**result, 'recorder_dir': recorder.directory,
+                                          'included_ts_codes': included_ts_codes,
+                                          'skipped_ts_codes': skipped_ts_codes, 'warmup_bars': warmup})
+        finally:
+            shutil.rmtree(recorder.directory, ignore_errors=True)
+        values, metrics = result['values'], result['metrics']
+
+    benchmarks = list(benchmarks) if benchmarks is not None else [DEFAULT_BENCHMARK]
+    with span('benchmarks'):
+        benchmark_closes = benchmark_curves(db, benchmarks, pd.DatetimeIndex(values.index))
+    missing = [c for c in benchmarks if c not in benchmark_closes.columns]
+    if missing:
+        logging.getLogger(__name__).warning(f"以下基准指数在回测区间内无行情，已忽略: {missing}")
+    names = {}
+    if benchmark_closes.shape[1]:
+        placeholders = ','.join('?' for _ in benchmark_closes.columns)
+        names = {r['ts_code']: r['name'] for r in db.fetch_all(
+            f"SELECT ts_code, name FROM indices WHERE ts_code IN ({placeholders})", tuple(benchmark_closes.columns))
+            if r.get('name')}
+    # 保留绘图所需的原始数据，页面缩放到子区间时按原始分辨率重绘
+    plot_data = {'values': values, 'strategy_name': strategy_name, 'benchmark_closes': benchmark_closes,
+                 'initial_capital': initial_capital, 'normalized': normalized, 'benchmark_names': names}
+    with span('plot'):
+        plot_figure = create_backtest_plot(**plot_data)
+    with span('benchmark_stats'):
+        stats = benchmark_stats(values, initial_capital, benchmark_closes)
+    stats.insert(0, 'name', [names.get(c, c) for c in stats.index])
 
     return {
         'metrics': metrics,
         'plot_figure': plot_figure,
-        'trades_csv': trades_csv_path,
-        'orders_csv': orders_csv_path,
+        'plot_data': plot_data,
         'included_ts_codes': included_ts_codes,
         'skipped_ts_codes': skipped_ts_codes,
-        'min_required_bars': 241
+        'warmup_bars': warmup,
+        'run_id': run_id,
+        'cached': cached is not None,
+        'benchmark_stats': stats,
     }
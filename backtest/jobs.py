@@ -0,0 +1,249 @@
+"""
+后台回测任务队列：页面只负责提交任务（写入 backtest_jobs 表），由独立的工作进程池消费。
+
+工作进程以较低优先级运行（nice），逐K线上报进度；取消为协作式：页面置 cancel_requested，
+工作进程在下一次进度上报时发现并中止回测。结果写入回测记录库（backtest_runs），
+页面按 run_id 读取，刷新浏览器不会丢失。
+
+启动工作进程池:
+    python -m backtest.jobs [--workers 2]
+页面在检测到没有存活的工作进程池时会自动在后台启动一个（见 ensure_worker_pool）。
+"""
+import argparse
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import time
+from typing import Dict, Any, List
+
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from data.database import Database  # noqa: E402
+
+JOB_STATUSES = ('queued', 'running', 'done', 'failed', 'cancelled')
+PID_FILE = os.path.join('output', 'backtest_workers.pid')
+# 进度写库的最小间隔（秒），同时也是响应取消的最长延迟
+PROGRESS_INTERVAL = 0.5
+POLL_INTERVAL = 1.0
+
+# 由本进程启动的工作进程池（用于回收已退出的子进程，避免僵尸进程被误判为存活）
+_POOL_PROC: subprocess.Popen | None = None
+
+
+class JobCancelled(Exception):
+    """任务在运行中被取消。"""
+
+
+def _now() -> str:
+    return datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def submit_job(db: Database, request: Dict[str, Any]) -> int:
+    """提交一个回测任务；request 为 run_backtest 的关键字参数（需可 JSON 序列化）。返回 job_id。"""
+    return db.insert("INSERT INTO backtest_jobs (status, request, submitted_at, progress) VALUES ('queued', ?, ?, 0)",
+                     (json.dumps(request, ensure_ascii=False), _now()))
+
+
+def cancel_job(db: Database, job_id: int) -> None:
+    """取消任务：排队中的直接标记为已取消；运行中的由工作进程在下一次上报进度时中止。"""
+    db.execute("UPDATE backtest_jobs SET status = 'cancelled', finished_at = ? WHERE job_id = ? AND status = 'queued'",
+               (_now(), job_id))
+    db.execute("UPDATE backtest_jobs SET cancel_requested = 1 WHERE job_id = ? AND status = 'running'", (job_id,))
+
+
+def get_job(db: Database, job_id: int) -> Dict[str, Any] | None:
+    row = db.fetch_one("SELECT * FROM backtest_jobs WHERE job_id = ?", (job_id,))
+    if row:
+        row['request'] = json.loads(row['request']) if row.get('request') else {}
+    return row
+
+
+def list_jobs(db: Database, limit: int = 50) -> pd.DataFrame:
+    """按提交时间倒序列出任务。"""
+    rows = db.fetch_all("SELECT job_id, status, request, submitted_at, started_at, finished_at, progress, message, "
+                        "cancel_requested, run_id FROM backtest_jobs ORDER BY job_id DESC LIMIT ?", (limit,))
+    for row in rows:
+        request = json.loads(row.pop('request') or '{}')
+        row['strategy'] = request.get('strategy_name')
+        row['period'] = f"{request.get('start_date')}~{request.get('end_date')}"
+        row['n_codes'] = len(request.get('ts_codes') or [])
+        row['engine'] = request.get('engine', 'backtrader')
+    return pd.DataFrame(rows)
+
+
+def _pid_alive(pid: int | None) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+def requeue_orphaned_jobs(db: Database) -> int:
+    """将工作进程已退出但仍标记为运行中的任务放回队列（取消中的直接标记为已取消）。"""
+    count = 0
+    for row in db.fetch_all("SELECT job_id, worker_pid, cancel_requested FROM backtest_jobs WHERE status = 'running'"):
+        if _pid_alive(row['worker_pid']):
+            continue
+        if row['cancel_requested']:
+            db.execute("UPDATE backtest_jobs SET status = 'cancelled', finished_at = ? WHERE job_id = ?",
+                       (_now(), row['job_id']))
+        else:
+            db.execute("UPDATE backtest_jobs SET status = 'queued', worker_pid = NULL, progress = 0 WHERE job_id = ?",
+                       (row['job_id'],))
+        count += 1
+    return count
+
+
+def _claim_next(db: Database) -> Dict[str, Any] | None:
+    """原子地领取最早排队的任务（条件更新，多个工作进程竞争时只有一个成功）。"""
+    while True:
+        row = db.fetch_one("SELECT job_id FROM backtest_jobs WHERE status = 'queued' ORDER BY job_id LIMIT 1")
+        if not row:
+            return None
+        claimed = db.execute("UPDATE backtest_jobs SET status = 'running', started_at = ?, worker_pid = ?, "
+                             "message = NULL WHERE job_id = ? AND status = 'queued'",
+                             (_now(), os.getpid(), row['job_id']))
+        if claimed:
+            return get_job(db, row['job_id'])
+
+
+def _progress_reporter(db: Database, job_id: int):
+    """生成逐K线进度回调：按 PROGRESS_INTERVAL 节流写库，并检查是否被请求取消。"""
+    last = [0.0]
+
+    def report(done: int, total: int) -> None:
+        now = time.monotonic()
+        if now - last[0] < PROGRESS_INTERVAL and done < total:
+            return
+        last[0] = now
+        db.execute("UPDATE backtest_jobs SET progress = ?, message = ? WHERE job_id = ?",
+                   (done / total if total else 0.0, f"{done}/{total} 根K线", job_id))
+        row = db.fetch_one("SELECT cancel_requested FROM backtest_jobs WHERE job_id = ?", (job_id,))
+        if row and row['cancel_requested']:
+            raise JobCancelled()
+
+    return report
+
+
+def run_job(db: Database, job: Dict[str, Any]) -> None:
+    """在当前进程中执行一个已领取的任务，并写回最终状态。"""
+    from backtest.engine import run_backtest
+
+    job_id = job['job_id']
+    logger = logging.getLogger(__name__)
+    try:
+        result = run_backtest(**job['request'], progress=_progress_reporter(db, job_id))
+    except JobCancelled:
+        db.execute("UPDATE backtest_jobs SET status = 'cancelled', finished_at = ?, message = '已取消' "
+                   "WHERE job_id = ?", (_now(), job_id))
+        logger.info(f"回测任务 {job_id} 已取消")
+        return
+    except Exception as e:
+        logger.exception(f"回测任务 {job_id} 失败: {e}")
+        db.execute("UPDATE backtest_jobs SET status = 'failed', finished_at = ?, message = ? WHERE job_id = ?",
+                   (_now(), str(e), job_id))
+        return
+    db.execute("UPDATE backtest_jobs SET status = 'done', finished_at = ?, progress = 1, run_id = ?, message = ? "
+               "WHERE job_id = ?",
+               (_now(), result['run_id'], '读取已有结果' if result.get('cached') else '完成', job_id))
+    logger.info(f"回测任务 {job_id} 完成: {result['run_id']}")
+
+
+def worker_loop(niceness: int = 10) -> None:
+    """工作进程主循环：降低调度优先级，轮询并执行排队任务。"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    try:
+        os.nice(niceness)
+    except (AttributeError, OSError):
+        pass
+    db = Database()
+    parent = os.getppid()
+    while os.getppid() == parent:  # 进程池主进程退出后不再领取新任务
+        job = _claim_next(db)
+        if job is None:
+            time.sleep(POLL_INTERVAL)
+            continue
+        run_job(db, job)
+
+
+def worker_pool_alive() -> bool:
+    """PID 文件记录的工作进程池是否仍在运行。"""
+    if _POOL_PROC is not None and _POOL_PROC.poll() is not None:
+        return False
+    try:
+        with open(PID_FILE, 'r') as f:
+            return _pid_alive(int(f.read().strip() or 0))
+    except (OSError, ValueError):
+        return False
+
+
+def ensure_worker_pool(max_workers: int = 2) -> bool:
+    """没有存活的工作进程池时在后台启动一个（独立会话，页面进程退出不受影响）。返回是否新启动。"""
+    global _POOL_PROC
+    if worker_pool_alive():
+        return False
+    os.makedirs(os.path.dirname(PID_FILE), exist_ok=True)
+    # 与页面进程相同的工作目录（回测结果文件等相对路径一致），项目根目录加入 PYTHONPATH
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get('PYTHONPATH')])))
+    with open(os.path.join('output', 'backtest_workers.log'), 'a') as log:
+        _POOL_PROC = subprocess.Popen([sys.executable, '-m', 'backtest.jobs', '--workers', str(max_workers)],
+                                      stdout=log, stderr=log, env=env, start_new_session=True)
+    with open(PID_FILE, 'w') as f:
+        f.write(str(_POOL_PROC.pid))
+    logging.getLogger(__name__).info(f"已启动回测工作进程池: pid={_POOL_PROC.pid}, workers={max_workers}")
+    return True
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='后台回测工作进程池')
+    parser.add_argument('--workers', type=int, default=2, help='工作进程数')
+    parser.add_argument('--nice', type=int, default=10, help='工作进程的 nice 值（越大优先级越低）')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    requeued = requeue_orphaned_jobs(Database())
+    if requeued:
+        logging.getLogger(__name__).info(f"已重新排队 {requeued} 个中断的任务")
+    os.makedirs(os.path.dirname(PID_FILE), exist_ok=True)
+    with open(PID_FILE, 'w') as f:
+        f.write(str(os.getpid()))
+
+    # 收到 SIGTERM 时正常退出，由 finally 结束工作进程
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    workers: List[multiprocessing.Process] = []
+    for _ in range(max(1, args.workers)):
+        proc = multiprocessing.Process(target=worker_loop, args=(args.nice,), daemon=True)
+        proc.start()
+        workers.append(proc)
+    try:
+        while True:
+            # 异常退出的工作进程：将其任务重新排队并补起新的进程
+            for k, proc in enumerate(workers):
+                if not proc.is_alive():
+                    requeue_orphaned_jobs(Database())
+                    workers[k] = multiprocessing.Process(target=worker_loop, args=(args.nice,), daemon=True)
+                    workers[k].start()
+            time.sleep(5)
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        for proc in workers:
+            proc.terminate()
+        for proc in workers:
+            proc.join(timeout=5)
+        requeue_orphaned_jobs(Database())
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,210 @@
+"""
+低内存全市场回测：行情与信号按标的分批读取、计算，写入磁盘上的 float32 内存映射面板（日期 × 标的），
+随后由向量化撮合器逐日读取。任一时刻常驻内存的只有一批标的的 DataFrame 与当日所在的面板行，
+全市场（约 5000 只、10 年）的面板文件约 1.5 GB，由操作系统按需换入换出。
+
+注意：价格以 float32 存储，成交价与逐日净值相对 float64 的向量化引擎可能有 1e-7 量级的相对差异。
+"""
+import logging
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+import pandas as pd
+from typing import Dict, Any, List, Callable
+from config.settings import get_settings
+from data.database import Database
+from strategies.base import SCORE_COLUMNS, build_signals, required_warmup
+from backtest.vectorized import simulate
+from utils.timing import span
+import backtrader as bt
+
+settings = get_settings()
+
+PANEL_DIR = os.path.join('output', 'panels')
+_FLOAT_FIELDS = ('open', 'high', 'low', 'close', 'close_ff')
+_BOOL_FIELDS = ('has_bar', 'entry', 'exit')
+
+
+def peak_rss_mb() -> float:
+    """当前进程的峰值常驻内存（MB）。"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def current_rss_mb() -> float | None:
+    """当前进程的常驻内存（MB），读取 /proc/self/statm；不支持的平台返回 None。"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+class RssPeakSampler:
+    """
+    统计一段代码运行期间的峰值常驻内存（MB）：后台线程每隔 interval 秒采样当前 RSS 取最大值。
+    与 peak_rss_mb（进程生命周期的最高水位）不同，此前的回测或页面操作留下的高水位不计入本次；
+    短于采样间隔的瞬时峰值可能漏采，同一进程内并发的其它任务也会计入。
+    无法读取当前 RSS 的平台（如 macOS）退化为 peak_rss_mb。
+    """
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self) -> None:
+        rss = current_rss_mb()
+        if rss is not None:
+            self.peak_mb = max(self.peak_mb, rss)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self) -> 'RssPeakSampler':
+        if current_rss_mb() is not None:
+            self._sample()
+            self._thread = threading.Thread(target=self._run, name='rss-peak-sampler', daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        if self._thread is None:
+            self.peak_mb = peak_rss_mb()
+        else:
+            self._stop.set()
+            self._thread.join()
+            self._sample()
+        return False
+
+
+def trading_calendar(db: Database, ts_codes: List[str], start_date: str, end_date: str) -> pd.DatetimeIndex:
+    """区间内股票池出现过的交易日（面板的行）；股票池很大时直接取全市场交易日（两者基本一致）。"""
+    if len(ts_codes) <= 900:
+        placeholders = ','.join('?' for _ in ts_codes)
+        rows = db.fetch_all(f"SELECT DISTINCT date FROM daily_price WHERE ts_code IN ({placeholders}) "
+                            f"AND date BETWEEN ? AND ? ORDER BY date", tuple(ts_codes) + (start_date, end_date))
+    else:
+        rows = db.fetch_all("SELECT DISTINCT date FROM daily_price WHERE date BETWEEN ? AND ? ORDER BY date",
+                            (start_date, end_date))
+    return pd.DatetimeIndex(pd.to_datetime([r['date'] for r in rows]))
+
+
+def chunk_size_for_budget(n_dates: int, warmup_bars: int, memory_budget_mb: float) -> int:
+    """按内存预算估算每批可同时处理的标的数。
+    每只标的约 (K线数 × (6 列行情 + 6 列信号) × 8 字节)，pandas 中间结果按 4 倍放大估计；预算的一半留给撮合与面板换页。"""
+    per_ticker = max(1, n_dates + warmup_bars) * 12 * 8 * 4
+    return max(1, int(memory_budget_mb * 1024 * 1024 / 2 // per_ticker))
+
+
+def _open_memmap(directory: str, name: str, dtype, shape, mode: str = 'w+') -> np.memmap:
+    return np.memmap(os.path.join(directory, f'{name}.dat'), dtype=dtype, mode=mode, shape=shape)
+
+
+def build_memmap_panel(db: Database, strategy_class, ts_codes: List[str], start_date: str, end_date: str,
+                       strategy_params: dict | None, directory: str, memory_budget_mb: float) -> Dict[str, Any]:
+    """
+    分批读取行情、计算信号并写入 directory 下的内存映射文件，返回与 build_panel 结构一致的面板
+    （数组为只读 memmap）。面板从 start_date 开始：预热K线只参与信号计算，停牌首日的估值价取预热期最后收盘价。
+    """
+    # 仅用于避免循环导入：engine 依赖本模块
+    from backtest.engine import load_price_data
+
+    logger = logging.getLogger(__name__)
+    dates = trading_calendar(db, ts_codes, start_date, end_date)
+    T, N = len(dates), len(ts_codes)
+    warmup = required_warmup(strategy_class, strategy_params)
+    chunk = chunk_size_for_budget(T, warmup, memory_budget_mb)
+    arrays = {name: _open_memmap(directory, name, np.float32, (T, N)) for name in _FLOAT_FIELDS}
+    arrays.update({name: _open_memmap(directory, name, np.bool_, (T, N)) for name in _BOOL_FIELDS})
+    scores = [_open_memmap(directory, col, np.float32, (T, N)) for col in SCORE_COLUMNS]
+
+    included = np.zeros(N, dtype=bool)
+    for lo in range(0, N, chunk):
+        codes = ts_codes[lo:lo + chunk]
+        price_data, _ = load_price_data(db, codes, start_date, end_date, warmup_bars=warmup)
+        # 先在内存中拼好本批的 T × chunk 块，再整块写入映射文件（避免逐列跨行写）
+        block = {name: np.full((T, len(codes)), np.nan, dtype=np.float32) for name in _FLOAT_FIELDS}
+        block.update({name: np.zeros((T, len(codes)), dtype=bool) for name in _BOOL_FIELDS})
+        score_block = [np.full((T, len(codes)), np.nan, dtype=np.float32) for _ in SCORE_COLUMNS]
+        for j, code in enumerate(codes):
+            df = price_data.pop(code, None)
+            if df is None:
+                continue
+            included[lo + j] = True
+            sig = build_signals(strategy_class, df, strategy_params)
+            bars = df.reindex(dates)
+            for name in ('open', 'high', 'low', 'close'):
+                block[name][:, j] = bars[name].to_numpy(dtype=np.float32)
+            block['has_bar'][:, j] = bars['close'].notna().to_numpy()
+            # 停牌日沿用上一根K线（含预热期）的收盘价与信号，与 build_panel 一致
+            block['close_ff'][:, j] = df['close'].reindex(dates, method='ffill').to_numpy(dtype=np.float32)
+            ffilled = sig.reindex(dates, method='ffill')
+            block['entry'][:, j] = ffilled['entry'].fillna(False).to_numpy(dtype=bool)
+            block['exit'][:, j] = ffilled['exit'].fillna(False).to_numpy(dtype=bool)
+            for col, arr in zip(SCORE_COLUMNS, score_block):
+                arr[:, j] = ffilled[col].to_numpy(dtype=np.float32)
+        for name, arr in block.items():
+            arrays[name][:, lo:lo + len(codes)] = arr
+        for target, arr in zip(scores, score_block):
+            target[:, lo:lo + len(codes)] = arr
+        del block, score_block, price_data
+        logger.info(f"内存映射面板：已处理 {min(lo + chunk, N)}/{N} 只标的，进程峰值内存 {peak_rss_mb():.0f} MB")
+
+    for arr in list(arrays.values()) + scores:
+        arr.flush()
+    # 以只读方式重新映射，撮合阶段只有当日所在的行被换入内存
+    panel = {name: _open_memmap(directory, name, arrays[name].dtype, (T, N), mode='r') for name in arrays}
+    panel['scores'] = [_open_memmap(directory, col, np.float32, (T, N), mode='r') for col in SCORE_COLUMNS]
+    panel.update({'codes': list(ts_codes), 'dates': dates, 'included': included, 'warmup_bars': warmup})
+    return panel
+
+
+def run_memmap_backtest(db: Database, strategy_class, ts_codes: List[str], start_date: str, end_date: str,
+                        initial_capital: float, max_positions: int, strategy_params: dict | None = None,
+                        memory_budget_mb: float | None = None,
+                        progress: Callable[[int, int], None] | None = None, recorder=None) -> Dict[str, Any]:
+    """
+    以内存映射面板运行向量化回测。返回 simulate 的结果，外加
+    included_ts_codes / skipped_ts_codes / warmup_bars / peak_rss_mb（本次运行期间的峰值内存）/ elapsed。
+    面板文件在回测结束后删除。
+    全市场长周期回测建议传入 recorder（backtest.columnar.RunRecorder），订单与成交直接写盘。
+    """
+    budget = memory_budget_mb or settings.BACKTEST_MEMORY_BUDGET_MB
+    os.makedirs(PANEL_DIR, exist_ok=True)
+    directory = tempfile.mkdtemp(prefix='panel_', dir=PANEL_DIR)
+    started = time.perf_counter()
+    try:
+        with RssPeakSampler() as rss:
+            with span('build_memmap_panel', tickers=len(ts_codes)):
+                panel = build_memmap_panel(db, strategy_class, list(ts_codes), start_date, end_date,
+                                           strategy_params, directory, budget)
+            if not panel['included'].any():
+                raise ValueError("回测区间内没有任何标的的行情数据")
+            with span('simulate', days=len(panel['dates'])):
+                result = simulate(panel, initial_capital, max_positions,
+                                  buy_on_close=(strategy_class.buy_exectype == bt.Order.Close),
+                                  trade_start=pd.Timestamp(start_date), progress=progress, recorder=recorder)
+            included = panel['included']
+            result.update({
+                'included_ts_codes': [c for c, ok in zip(panel['codes'], included) if ok],
+                'skipped_ts_codes': [c for c, ok in zip(panel['codes'], included) if not ok],
+                'warmup_bars': panel['warmup_bars'],
+            })
+            del panel
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    result['peak_rss_mb'] = rss.peak_mb
+    result['elapsed'] = time.perf_counter() - started
+    logging.getLogger(__name__).info(f"低内存回测完成：{len(result['included_ts_codes'])} 只标的，"
+                                     f"耗时 {result['elapsed']:.1f}s，峰值内存 {result['peak_rss_mb']:.0f} MB")
+    return result
@@ -0,0 +1,108 @@
+import math
+import numpy as np
+import pandas as pd
+from typing import Dict, Any, List
+
+# 与 backtrader 分析器默认口径保持一致
+TRADING_DAYS_PER_YEAR = 252.0
+RISK_FREE_RATE = 0.01
+
+
+def values_from_returns(returns: pd.Series, start_value: float) -> pd.Series:
+    """由日收益率序列（如 TimeReturn 分析器结果）还原组合逐日总资产。"""
+    if returns is None or returns.empty:
+        return pd.Series(dtype=float)
+    values = (1 + returns.astype(float)).cumprod() * float(start_value)
+    values.index = pd.to_datetime(values.index)
+    return values
+
+
+def compute_metrics(values: pd.Series, start_value: float,
+                    total_trades: int = 0, won_trades: int = 0,
+                    closed_trades: List[Dict[str, Any]] | pd.DataFrame | None = None,
+                    executed_orders: List[Dict[str, Any]] | pd.DataFrame | None = None,
+                    cash: pd.Series | None = None) -> Dict[str, float]:
+    """
+    基于逐日总资产序列计算回测指标，口径与 backtrader 默认分析器一致：
+    - total_return: 对数总收益（Returns.rtot）* 100
+    - annual_return: 按 252 个交易日年化（Returns.rnorm）* 100
+    - sharpe_ratio: 年度收益、无风险利率 1%、总体标准差（SharpeRatio 默认参数）；无法计算时为 0
+    - max_drawdown: 以起始资金为初始高点的最大回撤（DrawDown.max.drawdown，百分比）
+    - win_rate: 盈利交易数 / 总交易数 * 100
+    以及运行后按整段序列计算的扩展指标：
+    - sortino_ratio: 日超额收益均值 / 下行标准差，按 sqrt(252) 年化
+    - calmar_ratio: 年化收益 / 最大回撤
+    - max_drawdown_duration: 最长回撤持续期（从前高到再创新高的交易日数，未修复时计到最后一日）
+    - profit_factor: 盈利交易总盈利 / 亏损交易总亏损（需 closed_trades；无亏损时为 inf）
+    - turnover: 年化换手率（成交额 / 平均总资产，按 252 个交易日年化；需 executed_orders）
+    - exposure: 平均持仓占比（(总资产 - 现金) / 总资产 的逐日均值 * 100；需 cash）
+    closed_trades / executed_orders 可为记录列表或列式 DataFrame（见 backtest.columnar）。
+    """
+    metrics = {
+        'total_return': 0.0,
+        'annual_return': 0.0,
+        'sharpe_ratio': 0,
+        'max_drawdown': 0.0,
+        'total_trades': int(total_trades),
+        'win_rate': (won_trades / total_trades) * 100 if total_trades > 0 else 0,
+        'sortino_ratio': 0.0,
+        'calmar_ratio': 0.0,
+        'max_drawdown_duration': 0,
+    }
+    if closed_trades is not None:
+        metrics['profit_factor'] = profit_factor(closed_trades)
+    if values is None or values.empty or not start_value:
+        if executed_orders is not None:
+            metrics['turnover'] = 0.0
+        if cash is not None:
+            metrics['exposure'] = 0.0
+        return metrics
+
+    v = values.astype(float).to_numpy()
+    ratio = v[-1] / float(start_value)
+    rtot = math.log(ratio) if ratio > 0 else float('-inf')
+    metrics['total_return'] = rtot * 100
+    ravg = rtot / len(v)
+    metrics['annual_return'] = (math.expm1(ravg * TRADING_DAYS_PER_YEAR) if ravg > float('-inf') else ravg) * 100
+
+    curve = np.concatenate(([float(start_value)], v))
+    peaks = np.maximum.accumulate(curve)
+    metrics['max_drawdown'] = float(np.max(100.0 * (peaks[1:] - v) / peaks[1:]))
+    # 回撤持续期：距最近一次创新高（含起始资金）的交易日数
+    pos = np.arange(len(curve))
+    last_peak = np.maximum.accumulate(np.where(curve >= peaks, pos, 0))
+    metrics['max_drawdown_duration'] = int(np.max(pos - last_peak))
+
+    # 年度收益：每年最后一日资产相对上一年末（首年相对起始资金）
+    year_end = values.groupby(pd.to_datetime(values.index).year).last().astype(float).to_numpy()
+    yearly = year_end / np.concatenate(([float(start_value)], year_end[:-1])) - 1.0
+    excess = yearly - RISK_FREE_RATE
+    std = float(np.sqrt(np.mean((excess - excess.mean()) ** 2)))
+    if std > 0:
+        metrics['sharpe_ratio'] = float(excess.mean() / std)
+
+    daily_excess = curve[1:] / curve[:-1] - 1.0 - ((1 + RISK_FREE_RATE) ** (1 / TRADING_DAYS_PER_YEAR) - 1)
+    downside = float(np.sqrt(np.mean(np.minimum(daily_excess, 0.0) ** 2)))
+    if downside > 0:
+        metrics['sortino_ratio'] = float(daily_excess.mean() / downside * math.sqrt(TRADING_DAYS_PER_YEAR))
+    if metrics['max_drawdown'] > 0:
+        metrics['calmar_ratio'] = float(metrics['annual_return'] / metrics['max_drawdown'])
+
+    if executed_orders is not None:
+        orders = pd.DataFrame(executed_orders, columns=['size', 'price'])
+        traded = float((orders['size'].astype(float) * orders['price'].astype(float)).abs().sum())
+        metrics['turnover'] = float(traded / v.mean() * TRADING_DAYS_PER_YEAR / len(v))
+    if cash is not None:
+        c = cash.reindex(values.index).ffill().fillna(float(start_value)).astype(float).to_numpy()
+        metrics['exposure'] = float(np.mean(np.where(v > 0, (v - c) / v, 0.0)) * 100)
+    return metrics
+
+
+def profit_factor(closed_trades: List[Dict[str, Any]] | pd.DataFrame) -> float:
+    """盈利因子：盈利交易的净盈利之和 / 亏损交易的净亏损之和（无交易为 0，无亏损为 inf）。"""
+    pnl = pd.DataFrame(closed_trades, columns=['profit_comm'])['profit_comm'].to_numpy(dtype=float)
+    gross_profit = float(pnl[pnl > 0].sum())
+    gross_loss = float(-pnl[pnl < 0].sum())
+    if gross_loss > 0:
+        return gross_profit / gross_loss
+    return float('inf') if gross_profit > 0 else 0.0
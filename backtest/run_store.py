@@ -0,0 +1,154 @@
+import datetime
+import hashlib
+import json
+import logging
+import os
+import shutil
+import pandas as pd
+from typing import Dict, Any, List
+from data.database import Database
+from backtest.columnar import ORDER_SCHEMA, TRADE_SCHEMA, write_columnar, read_columnar
+
+# 回测结果目录：每次运行一个子目录，净值、订单、成交各为一个列式文件（见 backtest.columnar）
+RUNS_DIR = os.path.join('output', 'runs')
+
+
+def data_version(db: Database, ts_codes: List[str], end_date: str) -> str:
+    """
+    行情数据版本：按标的汇总截至 end_date 的K线数、最后日期与开高低收、成交量合计，取哈希。
+    补数、复权修订等任何影响回测输入（开盘价成交、最高/最低价滑点上限、收盘价信号）的数据变化都会改变版本号。
+    """
+    if not ts_codes:
+        return ''
+    placeholders = ','.join('?' for _ in ts_codes)
+    rows = db.fetch_all(
+        f"SELECT ts_code, COUNT(*) AS n, MAX(date) AS last_date, TOTAL(open) AS s_open, TOTAL(high) AS s_high, "
+        f"TOTAL(low) AS s_low, TOTAL(close) AS s_close, TOTAL(volume) AS s_vol "
+        f"FROM daily_price WHERE ts_code IN ({placeholders}) AND date <= ? GROUP BY ts_code ORDER BY ts_code",
+        tuple(ts_codes) + (end_date,))
+    digest = hashlib.sha256()
+    for r in rows:
+        digest.update(f"{r['ts_code']}|{r['n']}|{r['last_date']}|{r['s_open']:.6f}|{r['s_high']:.6f}|"
+                      f"{r['s_low']:.6f}|{r['s_close']:.6f}|{r['s_vol']:.2f};".encode())
+    return digest.hexdigest()[:16]
+
+
+def run_key(spec: Dict[str, Any]) -> str:
+    """回测请求（策略、参数、股票池、区间、资金、引擎与数据版本）的内容哈希。"""
+    payload = json.dumps(spec, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:20]
+
+
+class BacktestRunStore:
+    """按内容哈希保存/读取回测结果，相同请求直接复用。"""
+
+    def __init__(self, db: Database, runs_dir: str = RUNS_DIR):
+        self.db = db
+        self.runs_dir = runs_dir
+
+    def get(self, run_id: str) -> Dict[str, Any] | None:
+        """读取一次回测的元数据与指标；结果目录丢失（或为旧版本的单文件结果）时视为不存在。"""
+        row = self.db.fetch_one("SELECT * FROM backtest_runs WHERE run_id = ?", (run_id,))
+        if not row:
+            return None
+        if not os.path.isdir(row['path']):
+            self._remove_path(row['path'])
+            self.db.execute("DELETE FROM backtest_runs WHERE run_id = ?", (run_id,))
+            return None
+        return self._decode(row)
+
+    def load(self, run_id: str, events: bool = True) -> Dict[str, Any] | None:
+        """读取完整结果：元数据 + 逐日净值 + 订单 + 已平仓交易（events=False 时只读净值，订单/成交为空表）。"""
+        run = self.get(run_id)
+        if run is None:
+            return None
+        equity = read_columnar(os.path.join(run['path'], 'equity'), (('date', 'datetime'), ('value', 'float')))
+        # 流式记录的净值含预热期，统一从开始交易日起返回
+        values = pd.Series(equity['value'].to_numpy(), index=pd.DatetimeIndex(equity['date']))
+        run['values'] = values.loc[pd.Timestamp(run['start_date']):]
+        if events:
+            run['executed_orders'] = read_columnar(os.path.join(run['path'], 'orders'), ORDER_SCHEMA)
+            run['closed_trades'] = read_columnar(os.path.join(run['path'], 'trades'), TRADE_SCHEMA)
+        else:
+            run['executed_orders'] = pd.DataFrame(columns=[name for name, _ in ORDER_SCHEMA])
+            run['closed_trades'] = pd.DataFrame(columns=[name for name, _ in TRADE_SCHEMA])
+        return run
+
+    def save(self, run_id: str, spec: Dict[str, Any], result: Dict[str, Any]) -> str:
+        """
+        保存一次回测，返回结果目录。result 需包含 values/metrics；
+        若含 recorder_dir（RunRecorder 已写好的事件目录）则整体移入，否则将 values/executed_orders/closed_trades
+        （记录列表或 DataFrame）写成同样的列式文件。
+        """
+        os.makedirs(self.runs_dir, exist_ok=True)
+        path = os.path.join(self.runs_dir, run_id)
+        # 先写临时目录再替换，避免中断留下不完整的结果
+        tmp_path = os.path.join(self.runs_dir, f'{run_id}.tmp')
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        if result.get('recorder_dir'):
+            os.replace(result['recorder_dir'], tmp_path)
+        else:
+            values = result['values']
+            write_columnar(os.path.join(tmp_path, 'equity'), (('date', 'datetime'), ('value', 'float')),
+                           ({'date': d, 'value': v} for d, v in values.items()))
+            for name, schema, key in (('orders', ORDER_SCHEMA, 'executed_orders'),
+                                      ('trades', TRADE_SCHEMA, 'closed_trades')):
+                records = result.get(key)
+                if isinstance(records, pd.DataFrame):
+                    records = records.to_dict('records')
+                write_columnar(os.path.join(tmp_path, name), schema, records or [])
+        self._remove_path(path)
+        os.replace(tmp_path, path)
+
+        self.db.execute(
+            "INSERT OR REPLACE INTO backtest_runs (run_id, created_at, strategy, params, engine, start_date, end_date, "
+            "initial_capital, max_positions, ts_codes, skipped_ts_codes, warmup_bars, metrics, path) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (run_id, datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), spec['strategy'],
+             json.dumps(spec.get('params') or {}, ensure_ascii=False, default=str), spec['engine'],
+             spec['start_date'], spec['end_date'], float(spec['initial_capital']), int(spec['max_positions']),
+             json.dumps(result.get('included_ts_codes') or []), json.dumps(result.get('skipped_ts_codes') or []),
+             int(result.get('warmup_bars') or 0), json.dumps(result['metrics'], default=float), path))
+        logging.getLogger(__name__).info(f"回测结果已保存: {run_id} -> {path}")
+        return path
+
+    def list_runs(self, limit: int = 200) -> pd.DataFrame:
+        """按时间倒序列出历史回测（指标展开为列）。"""
+        rows = self.db.fetch_all("SELECT * FROM backtest_runs ORDER BY created_at DESC LIMIT ?", (limit,))
+        records = []
+        for row in rows:
+            run = self._decode(row)
+            records.append({
+                'run_id': run['run_id'],
+                'created_at': run['created_at'],
+                'strategy': run['strategy'],
+                'engine': run['engine'],
+                'start_date': run['start_date'],
+                'end_date': run['end_date'],
+                'n_codes': len(run['ts_codes']),
+                'initial_capital': run['initial_capital'],
+                'max_positions': run['max_positions'],
+                'params': json.dumps(run['params'], ensure_ascii=False),
+                **run['metrics'],
+            })
+        return pd.DataFrame(records)
+
+    def delete(self, run_id: str) -> None:
+        row = self.db.fetch_one("SELECT path FROM backtest_runs WHERE run_id = ?", (run_id,))
+        if row:
+            self._remove_path(row['path'])
+        self.db.execute("DELETE FROM backtest_runs WHERE run_id = ?", (run_id,))
+
+    @staticmethod
+    def _remove_path(path: str) -> None:
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.exists(path):
+            os.remove(path)
+
+    @staticmethod
+    def _decode(row: Dict[str, Any]) -> Dict[str, Any]:
+        run = dict(row)
+        for key in ('params', 'ts_codes', 'skipped_ts_codes', 'metrics'):
+            run[key] = json.loads(run[key]) if run.get(key) else ({} if key in ('params', 'metrics') else [])
+        return run
@@ -0,0 +1,231 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, Any, List, Callable
+from config.settings import get_settings
+from strategies.base import SCORE_COLUMNS, build_signals
+from utils.timing import span
+import backtrader as bt
+
+settings = get_settings()
+
+# 与 Backtrader 引擎中 broker.set_slippage_perc 保持一致
+SLIPPAGE_PERC = 0.0001
+
+
+def build_panel(price_data: Dict[str, pd.DataFrame], signals: Dict[str, pd.DataFrame]) -> Dict[str, Any]:
+    """
+    将逐标的行情与信号对齐为 日期 × 标的 的二维数组。
+    停牌（无K线）的日期沿用上一根K线的收盘价与信号，与 Backtrader 多数据源的推进方式一致。
+    """
+    codes = list(price_data.keys())
+    prices = pd.concat({code: df[['open', 'high', 'low', 'close']] for code, df in price_data.items()}, axis=1)
+    prices = prices.sort_index()
+    dates = prices.index
+
+    def field(frame_map, col):
+        return pd.concat({code: frame_map[code][col] for code in codes}, axis=1).reindex(dates)
+
+    close = field(price_data, 'close')
+    has_bar = close.notna().to_numpy()
+    sig = {col: field(signals, col).ffill() for col in ['entry', 'exit']}
+    scores = [field(signals, col).ffill().to_numpy(dtype=float) for col in SCORE_COLUMNS]
+    return {
+        'codes': codes,
+        'dates': dates,
+        'open': field(price_data, 'open').to_numpy(dtype=float),
+        'high': field(price_data, 'high').to_numpy(dtype=float),
+        'low': field(price_data, 'low').to_numpy(dtype=float),
+        'close': close.to_numpy(dtype=float),
+        'close_ff': close.ffill().to_numpy(dtype=float),
+        'has_bar': has_bar,
+        'entry': sig['entry'].fillna(False).to_numpy(dtype=bool),
+        'exit': sig['exit'].fillna(False).to_numpy(dtype=bool),
+        'scores': scores,
+    }
+
+
+def simulate(panel: Dict[str, Any], initial_capital: float, max_positions: int, buy_on_close: bool,
+             trade_start=None, fee_rate: float | None = None,
+             progress: Callable[[int, int], None] | None = None, recorder=None) -> Dict[str, Any]:
+    """
+    逐日推进的纯多头组合撮合，语义与 Backtrader 引擎一致（面板数组可为 float32 内存映射，逐日按行读取）：
+    - 当日收盘产生订单，下一根K线撮合：市价单按开盘价（含滑点，不超出最高/最低价），
+      收盘单按下一根K线收盘价；停牌标的的订单顺延；
+    - 订单提交时按创建价做资金预检（卖出回笼资金计入），成交时资金不足则作废；
+    - 买入数量按 RemainingCashSizer：剩余现金 / (最大持仓数 - 当前持仓数) / 收盘价 取整；
+    - 标的存在未完结订单（如停牌顺延）时不再重复下单；
+    - trade_start 之前的K线仅用于预热，不产生订单；指标预热由信号本身体现（预热期内 entry/exit 均为 False）。
+    progress: 可选的逐日进度回调 progress(已完成, 总数)，回调抛出异常即中止模拟。
+    recorder: 可选的 backtest.columnar.RunRecorder；传入时订单/成交/逐日净值追加写盘，返回的订单与成交列表为空。
+    """
+    fee = settings.BACKTEST_FEE_RATE if fee_rate is None else fee_rate
+    codes, dates = panel['codes'], panel['dates']
+    open_, high, low, close = panel['open'], panel['high'], panel['low'], panel['close']
+    close_ff, has_bar, entry, exit_ = panel['close_ff'], panel['has_bar'], panel['entry'], panel['exit']
+    scores = panel['scores']
+    T, N = close.shape
+
+    ready = np.ones(T, dtype=bool) if trade_start is None else np.asarray(dates >= pd.Timestamp(trade_start))
+
+    cash = float(initial_capital)
+    size = np.zeros(N)
+    avg_price = np.zeros(N)
+    open_order = np.zeros(N, dtype=bool)
+    last_bar = np.full(N, -1)
+    open_trades: Dict[int, Dict[str, Any]] = {}
+    submitted: List[Dict[str, Any]] = []
+    pending: List[Dict[str, Any]] = []
+    executed_orders: List[Dict[str, Any]] = []
+    closed_trades: List[Dict[str, Any]] = []
+    total_trades = 0
+    won_trades = 0
+    values = np.empty(T)
+    cash_series = np.empty(T)
+    record_order = recorder.record_order if recorder is not None else executed_orders.append
+    record_trade = recorder.record_trade if recorder is not None else closed_trades.append
+
+    for t in range(T):
+        if progress is not None:
+            progress(t + 1, T)
+        dt = dates[t].to_pydatetime()
+
+        # 1) 上一交易日提交的订单：按创建价预检资金
+        if submitted:
+            check_cash = cash
+            for o in submitted:
+                notional = o['size'] * o['created_price']
+                if o['side'] == 'buy':
+                    check_cash -= notional * (1 + fee)
+                else:
+                    check_cash += notional * (1 - fee)
+                if check_cash >= 0.0:
+                    pending.append(o)
+                else:
+                    open_order[o['i']] = False
+            submitted = []
+
+        # 2) 撮合挂单
+        still_pending = []
+        for o in pending:
+            i = o['i']
+            if not has_bar[t, i]:
+                if not o['market']:
+                    o['annotated'] = float(close_ff[t, i])
+                still_pending.append(o)
+                continue
+            open_order[i] = False
+            if o['market']:
+                if o['side'] == 'buy':
+                    price = min(float(open_[t, i]) * (1 + SLIPPAGE_PERC), float(high[t, i]))
+                else:
+                    price = max(float(open_[t, i]) * (1 - SLIPPAGE_PERC), float(low[t, i]))
+            elif o.get('annotated'):
+                # 停牌顺延的收盘单：按停牌前最后一根K线的收盘价与日期成交（同 Backtrader ago=-1）
+                price = o['annotated']
+            else:
+                price = float(close[t, i])
+            fill_dt = dates[last_bar[i]].to_pydatetime() if o.get('annotated') else dt
+
+            if o['side'] == 'buy':
+                qty = o['size']
+                comm = qty * price * fee
+                if cash - qty * price - comm < 0.0:
+                    continue  # 资金不足，订单作废
+                cash -= qty * price + comm
+                if size[i] == 0:
+                    total_trades += 1
+                    open_trades[i] = {'open_datetime': fill_dt, 'pnl': 0.0, 'commission': 0.0}
+                avg_price[i] = (size[i] * avg_price[i] + qty * price) / (size[i] + qty)
+                size[i] += qty
+                open_trades[i]['commission'] += comm
+                value = qty * price
+            else:
+                qty = min(o['size'], size[i])
+                if qty <= 0:
+                    continue
+                comm = qty * price * fee
+                pnl = qty * (price - avg_price[i])
+                value = qty * avg_price[i]
+                cash += qty * price - comm
+                size[i] -= qty
+                trade = open_trades[i]
+                trade['pnl'] += pnl
+                trade['commission'] += comm
+                if size[i] == 0:
+                    profit_comm = trade['pnl'] - trade['commission']
+                    won_trades += int(profit_comm >= 0.0)
+                    record_trade({
+                        'ts_code': codes[i],
+                        'open_datetime': trade['open_datetime'],
+                        'close_datetime': fill_dt,
+                        'direction': 'long',
+                        'size': 0,
+                        'open_price': avg_price[i],
+                        'profit': trade['pnl'],
+                        'profit_comm': profit_comm,
+                    })
+                    del open_trades[i]
+                qty = -qty
+            record_order({
+                'ts_code': codes[i],
+                'datetime': fill_dt,
+                'side': o['side'],
+                'size': qty,
+                'price': price,
+                'value': value,
+                'commission': comm,
+            })
+        pending = still_pending
+        last_bar[has_bar[t]] = t
+
+        values[t] = cash + float(np.dot(size, np.nan_to_num(close_ff[t])))
+        cash_series[t] = cash
+        if recorder is not None:
+            recorder.record_equity(dt, values[t], cash)
+
+        # 3) 收盘后生成订单
+        if not ready[t]:
+            continue
+        held = np.flatnonzero(size != 0)
+        for i in held:
+            if exit_[t, i] and not open_order[i]:
+                submitted.append({'i': i, 'side': 'sell', 'size': size[i], 'market': True,
+                                  'created_price': float(close_ff[t, i])})
+                open_order[i] = True
+
+        slots = max_positions - len(held)
+        if slots <= 0:
+            continue
+        candidates = np.flatnonzero(entry[t] & (size == 0) & ~open_order)
+        if candidates.size == 0:
+            continue
+        ranked = sorted(candidates, key=lambda i: tuple(s[t, i] for s in scores), reverse=True)
+        for i in ranked[:slots]:
+            qty = int(cash / slots / float(close_ff[t, i]))
+            if qty > 0:
+                submitted.append({'i': i, 'side': 'buy', 'size': qty, 'market': not buy_on_close,
+                                  'created_price': float(close_ff[t, i])})
+                open_order[i] = True
+
+    return {
+        'values': pd.Series(values, index=dates),
+        'cash': pd.Series(cash_series, index=dates),
+        'closed_trades': closed_trades,
+        'executed_orders': executed_orders,
+        'total_trades': total_trades,
+        'won_trades': won_trades,
+    }
+
+
+def run_vectorized(strategy_class, price_data: Dict[str, pd.DataFrame], initial_capital: float,
+                   max_positions: int, strategy_params: dict | None = None, trade_start=None,
+                   progress: Callable[[int, int], None] | None = None, recorder=None) -> Dict[str, Any]:
+    """用策略模块的 compute_signals 预先计算全部信号，再以 NumPy 组合模拟器运行回测。"""
+    with span('indicators', tickers=len(price_data)):
+        signals = {code: build_signals(strategy_class, df, strategy_params) for code, df in price_data.items()}
+    with span('build_panel'):
+        panel = build_panel(price_data, signals)
+    with span('simulate', days=len(panel['dates'])):
+        return simulate(panel, initial_capital, max_positions,
+                        buy_on_close=(strategy_class.buy_exectype == bt.Order.Close),
+                        trade_start=trade_start, progress=progress, recorder=recorder)
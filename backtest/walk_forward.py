@@ -0,0 +1,175 @@
+import itertools
+import json
+import logging
+import math
+import os
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, List
+from data.database import Database
+from strategies.manager import StrategyManager
+from strategies.base import required_warmup, build_signals
+from backtest.engine import load_price_data, run_cerebro, daily_values, trade_counts, slice_price_data
+from backtest.metrics import compute_metrics, values_from_returns
+
+# 工作进程内共享的行情数据（每个进程只接收一次，所有窗口复用）及按参数组缓存的信号
+_WORKER_STATE: Dict[str, Any] = {}
+
+# 可用作优化目标的窗口指标及其方向（'max' 越大越好，'min' 越小越好）
+OBJECTIVES = {
+    'total_return': 'max',
+    'annual_return': 'max',
+    'sharpe_ratio': 'max',
+    'sortino_ratio': 'max',
+    'calmar_ratio': 'max',
+    'win_rate': 'max',
+    'max_drawdown': 'min',
+    'max_drawdown_duration': 'min',
+}
+
+
+def generate_windows(dates: pd.DatetimeIndex, train_bars: int, test_bars: int,
+                     warmup_bars: int = 240, step_bars: int | None = None) -> List[Dict[str, pd.Timestamp]]:
+    """
+    在交易日序列上生成滚动的样本内/样本外窗口。
+    前 warmup_bars 个交易日仅用于指标预热；每个窗口的样本外区间紧接样本内区间，
+    窗口按 step_bars（默认等于 test_bars）向前滚动。
+    """
+    step = step_bars or test_bars
+    windows = []
+    i = warmup_bars
+    while i + train_bars + test_bars <= len(dates):
+        windows.append({
+            'train_start': dates[i],
+            'train_end': dates[i + train_bars - 1],
+            'test_start': dates[i + train_bars],
+            'test_end': dates[i + train_bars + test_bars - 1],
+        })
+        i += step
+    return windows
+
+
+def expand_param_grid(param_grid: Dict[str, list] | None) -> List[dict]:
+    """将 {参数名: [候选值...]} 展开为参数组合列表。"""
+    if not param_grid:
+        return [{}]
+    keys = list(param_grid.keys())
+    return [dict(zip(keys, values)) for values in itertools.product(*(param_grid[k] for k in keys))]
+
+
+def _init_worker(strategy_class, price_data, initial_capital, max_positions, warmup_bars):
+    _WORKER_STATE.update({
+        'strategy_class': strategy_class,
+        'price_data': price_data,
+        'initial_capital': initial_capital,
+        'max_positions': max_positions,
+        'warmup_bars': warmup_bars,
+    })
+
+
+def _signals_for(params: dict) -> Dict[str, pd.DataFrame]:
+    """
+    一组参数在完整行情（含预热K线）上的信号：每个工作进程对每组参数只计算一次，各窗口按日期截取复用。
+    指标在完整历史上连续计算，窗口开始处的 EMA 等递推指标与只用 warmup_bars 根K线预热时略有差异（预热更充分）。
+    """
+    st = _WORKER_STATE
+    key = json.dumps(params, sort_keys=True, default=str)
+    cache = st.setdefault('signals', {})
+    if key not in cache:
+        cache[key] = {code: build_signals(st['strategy_class'], df, params) for code, df in st['price_data'].items()}
+    return cache[key]
+
+
+def _evaluate(task: Dict[str, Any]) -> Dict[str, Any]:
+    """在单个窗口上用一组参数运行回测，返回窗口内的指标与逐日收益。"""
+    st = _WORKER_STATE
+    panel = slice_price_data(st['price_data'], list(st['price_data']), task['start'], task['end'], st['warmup_bars'])
+    result = {**task, 'metrics': compute_metrics(pd.Series(dtype=float), st['initial_capital']),
+              'returns': pd.Series(dtype=float), 'won_trades': 0}
+    if not panel:
+        return result
+
+    thestrat = run_cerebro(st['strategy_class'], panel, st['initial_capital'], st['max_positions'],
+                           task['params'], trade_start=task['start'], signals=_signals_for(task['params']))
+    values = daily_values(thestrat, st['initial_capital'])
+    values = values.loc[task['start']:task['end']]
+    if values.empty:
+        return result
+    total_trades, result['won_trades'] = trade_counts(thestrat)
+    result['metrics'] = compute_metrics(values, st['initial_capital'], total_trades, result['won_trades'])
+    result['returns'] = values.pct_change().fillna(values.iloc[0] / st['initial_capital'] - 1)
+    return result
+
+
+def run_walk_forward(strategy_name: str, ts_codes: List[str], start_date: str, end_date: str,
+                     param_grid: Dict[str, list], initial_capital: float, max_positions: int,
+                     train_bars: int = 250, test_bars: int = 60, warmup_bars: int | None = None,
+                     objective: str = 'total_return', max_workers: int | None = None) -> Dict[str, Any]:
+    """
+    滚动样本内优化 + 样本外检验。
+    - 行情只从 SQLite 读取一次（含 start_date 之前的预热K线），通过进程池初始化参数分发给各工作进程，所有窗口共享；
+    - 信号按 (参数组, 标的) 在完整区间上只计算一次（见 _signals_for），各窗口截取后复用；
+    - warmup_bars 默认取参数网格中各组参数所需预热K线数的最大值；
+    - 样本内：对每个窗口并行评估参数网格中的所有组合，按 objective 指标（方向见 OBJECTIVES）选出最优参数，
+      指标为 NaN 的参数组视为最差；
+    - 样本外：将最优参数应用于紧随其后的检验窗口，并行运行；
+    - 各检验窗口的逐日收益按时间顺序拼接成样本外净值曲线。
+    """
+    if objective not in OBJECTIVES:
+        raise ValueError(f"不支持的优化目标 '{objective}'，可选: {', '.join(OBJECTIVES)}")
+    strategy_class = StrategyManager(Database()).get_strategy_class(strategy_name)
+    if not strategy_class:
+        raise ValueError(f"策略 '{strategy_name}' 未找到")
+
+    param_sets = expand_param_grid(param_grid)
+    if warmup_bars is None:
+        warmup_bars = max(required_warmup(strategy_class, params) for params in param_sets)
+
+    price_data, skipped_ts_codes = load_price_data(Database(), ts_codes, start_date, end_date, warmup_bars=warmup_bars)
+    if not price_data:
+        raise ValueError("回测区间内没有任何标的的行情数据")
+    dates = pd.DatetimeIndex(sorted(set().union(*(df.index for df in price_data.values()))))
+    windows = generate_windows(dates[dates >= pd.Timestamp(start_date)], train_bars, test_bars, warmup_bars=0)
+    if not windows:
+        raise ValueError("回测区间过短，无法生成样本内/样本外窗口")
+
+    logger = logging.getLogger(__name__)
+    logger.info(f"Walk-forward: {len(windows)} 个窗口 × {len(param_sets)} 组参数，标的 {len(price_data)} 只")
+
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(), initializer=_init_worker,
+                             initargs=(strategy_class, price_data, initial_capital, max_positions, warmup_bars)) as pool:
+        train_tasks = [{'window': i, 'params': params, 'start': w['train_start'], 'end': w['train_end']}
+                       for i, w in enumerate(windows) for params in param_sets]
+        best: Dict[int, Dict[str, Any]] = {}
+        sign = 1.0 if OBJECTIVES[objective] == 'max' else -1.0
+        for res in pool.map(_evaluate, train_tasks):
+            score = float(res['metrics'][objective])
+            # 统一按“越大越好”比较
+            rank = -math.inf if math.isnan(score) else sign * score
+            if res['window'] not in best or rank > best[res['window']]['rank']:
+                best[res['window']] = {'rank': rank, 'score': score, 'params': res['params'], 'metrics': res['metrics']}
+
+        test_tasks = [{'window': i, 'params': best[i]['params'], 'start': w['test_start'], 'end': w['test_end']}
+                      for i, w in enumerate(windows)]
+        test_results = list(pool.map(_evaluate, test_tasks))
+
+    window_reports = []
+    for w, res in zip(windows, test_results):
+        window_reports.append({
+            **{k: v.strftime('%Y-%m-%d') for k, v in w.items()},
+            'best_params': best[res['window']]['params'],
+            'train_metrics': best[res['window']]['metrics'],
+            'test_metrics': res['metrics'],
+        })
+
+    oos_returns = [res['returns'] for res in test_results if not res['returns'].empty]
+    equity_curve = values_from_returns(pd.concat(oos_returns) if oos_returns else pd.Series(dtype=float), initial_capital)
+    return {
+        'windows': window_reports,
+        'equity_curve': equity_curve,
+        'metrics': compute_metrics(equity_curve, initial_capital,
+                                   sum(r['metrics']['total_trades'] for r in test_results),
+                                   sum(r['won_trades'] for r in test_results)),
+        'included_ts_codes': list(price_data.keys()),
+        'skipped_ts_codes': skipped_ts_codes,
+    }
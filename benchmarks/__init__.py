@@ -0,0 +1 @@
+"""合成行情生成器与端到端性能基准（见 suite.py）。"""
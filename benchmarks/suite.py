@@ -0,0 +1,242 @@
+"""
+端到端性能基准：在合成行情（benchmarks/synthetic.py）上计时各主要流程，结果与基线 JSON 对比。
+
+计时的流程：
+- ingest: 行情批量写入（upsert_prices，与 DataFetcher 相同的 INSERT OR REPLACE 并维护 latest_quote）
+- screening[<策略>]: StrategyManager.run_screening 全股票池选股
+- backtest[<引擎>]: run_backtest 全股票池回测（backtrader 仅在小规模下运行）
+- rebuild_snapshots: PortfolioManager.rebuild_snapshots
+- compare_indices: 两个合成指数的比值分析
+- risk: RiskAnalyzer.analyze_portfolio_risk
+
+每个规模在独立的子进程中运行（独立的临时数据库，峰值内存互不影响）。记录耗时、吞吐（行/秒、标的/秒）
+与阶段结束时的进程峰值内存（ru_maxrss 只增不减，各阶段按上表顺序执行）。
+
+用法:
+    python -m benchmarks.suite --scales 100 1000 5000 --days 1250
+    python -m benchmarks.suite --scales 100 --save-baseline benchmarks/baselines/default.json
+    python -m benchmarks.suite --scales 100 --compare benchmarks/baselines/default.json [--tolerance 0.25]
+对比基线时，耗时或峰值内存超出基线 (1 + tolerance) 倍的阶段记为回退，退出码为 1。
+
+基线只对生成它的机器与代码版本有意义：结果中记录了机器信息与 git 提交（machine / commit），对比时两者不一致会给出警告。
+改动了被计时流程性能的提交之后，应在同一台机器上用 --save-baseline 重新生成基线。
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import queue as queue_module
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, Any, List
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+DEFAULT_SCALES = (100, 1000, 5000)
+DEFAULT_DAYS = 1250
+# backtrader 逐K线事件驱动，超过该规模时只跑向量化引擎
+BACKTRADER_MAX_TICKERS = 100
+# 小于该耗时（秒）的阶段不参与回退判断（计时噪声占比过大）
+MIN_COMPARABLE_SECONDS = 0.05
+# 等待子进程结果时检查其是否仍存活的间隔（秒）
+WORKER_POLL_SECONDS = 1.0
+
+
+def _peak_rss_mb() -> float:
+    from backtest.memmap_panel import peak_rss_mb
+    return round(peak_rss_mb(), 1)
+
+
+def _timed(results: Dict[str, Dict[str, Any]], stage: str, fn, items: int | None = None, unit: str = '') -> Any:
+    started = time.perf_counter()
+    value = fn()
+    elapsed = time.perf_counter() - started
+    entry = {'seconds': round(elapsed, 4), 'peak_rss_mb': _peak_rss_mb()}
+    if items:
+        entry['throughput'] = round(items / elapsed, 1) if elapsed > 0 else None
+        entry['unit'] = unit
+    results[stage] = entry
+    logging.getLogger(__name__).info(f"{stage}: {elapsed:.3f}s" + (f"，{entry['throughput']} {unit}" if items else ''))
+    return value
+
+
+def _git_commit() -> str | None:
+    """当前代码的 git 提交（有未提交改动时加 -dirty）；不在 git 仓库中时为 None。"""
+    try:
+        out = subprocess.run(['git', 'describe', '--always', '--dirty', '--exclude', '*'], capture_output=True,
+                             text=True, timeout=10, cwd=os.path.dirname(os.path.abspath(__file__)))
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def run_scale(n_tickers: int, n_days: int, seed: int = 0) -> Dict[str, Any]:
+    """在当前进程中以一个全新的临时数据库运行一个规模的全部基准。调用前需已设置 DB_PATH 环境变量。"""
+    from data.database import Database
+    from benchmarks.synthetic import generate_market, generate_trades
+    from strategies.manager import StrategyManager
+    from backtest.engine import run_backtest
+    from portfolio.manager import PortfolioManager
+    from analysis.market_comparison import compare_indices
+    from risk.analyzer import RiskAnalyzer
+
+    db = Database()
+    results: Dict[str, Dict[str, Any]] = {}
+    market = generate_market(db, n_tickers, n_days, seed=seed)
+    # 只计批量写入部分，不含合成行情的生成
+    results['ingest'] = {'seconds': round(market['write_seconds'], 4), 'peak_rss_mb': _peak_rss_mb(),
+                         'throughput': round(market['rows'] / market['write_seconds'], 1), 'unit': 'rows/s',
+                         'rows': market['rows']}
+    codes, dates = market['ts_codes'], market['dates']
+    start, end = dates[0].strftime('%Y%m%d'), dates[-1].strftime('%Y%m%d')
+
+    manager = StrategyManager(db)
+    for name in sorted(manager.strategies):
+        _timed(results, f'screening[{name}]', lambda: manager.run_screening(name, codes), n_tickers, 'tickers/s')
+
+    # 回测区间取后 60% 的交易日，之前的K线用作预热
+    bt_start = dates[int(len(dates) * 0.4)].strftime('%Y%m%d')
+    strategy = 'SMA20_120_VolStop30Strategy' if 'SMA20_120_VolStop30Strategy' in manager.strategies \
+        else sorted(manager.strategies)[0]
+    engines = ['vectorized'] + (['backtrader'] if n_tickers <= BACKTRADER_MAX_TICKERS else [])
+    bars = len(dates[int(len(dates) * 0.4):]) * n_tickers
+    for engine in engines:
+        _timed(results, f'backtest[{engine}]',
+               lambda: run_backtest(strategy, codes, bt_start, end, 1_000_000, 10, engine=engine, use_cache=False),
+               bars, 'bars/s')
+
+    generate_trades(db, codes, n_trades=max(200, n_tickers // 5), seed=seed)
+    pm = PortfolioManager(db)
+    _timed(results, 'rebuild_snapshots', lambda: pm.rebuild_snapshots(start, end), len(dates), 'days/s')
+    index_codes = market['index_codes']
+    _timed(results, 'compare_indices', lambda: compare_indices(db, index_codes[0], index_codes[1], start, end))
+    _timed(results, 'risk', lambda: RiskAnalyzer(pm).analyze_portfolio_risk())
+    db.close()
+    return {'n_tickers': n_tickers, 'n_days': n_days, 'stages': results, 'peak_rss_mb': _peak_rss_mb()}
+
+
+def _scale_worker(n_tickers: int, n_days: int, seed: int, workdir: str, queue) -> None:
+    # 必须在导入项目模块之前设置：Database 的默认路径在导入时确定
+    os.environ['DB_PATH'] = os.path.join(workdir, 'bench.db')
+    os.chdir(workdir)  # 回测记录等输出文件写入临时目录
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger(__name__).setLevel(logging.INFO)
+    try:
+        queue.put(run_scale(n_tickers, n_days, seed))
+    except Exception as e:
+        logging.getLogger(__name__).exception(f"规模 {n_tickers} 的基准运行失败: {e}")
+        queue.put({'n_tickers': n_tickers, 'n_days': n_days, 'error': str(e)})
+
+
+def _wait_result(proc, queue) -> Dict[str, Any]:
+    """等待子进程的结果；子进程未返回结果就退出（崩溃、被 OOM 终止）时返回错误记录，而不是一直阻塞。"""
+    while True:
+        try:
+            return queue.get(timeout=WORKER_POLL_SECONDS)
+        except queue_module.Empty:
+            if not proc.is_alive():
+                break
+    try:
+        # 子进程退出前刚写入的结果可能尚未到达
+        return queue.get(timeout=WORKER_POLL_SECONDS)
+    except queue_module.Empty:
+        proc.join()
+        return {'error': f'exit code {proc.exitcode}'}
+
+
+def run_suite(scales: List[int], n_days: int = DEFAULT_DAYS, seed: int = 0) -> Dict[str, Any]:
+    """依次在独立子进程中运行各规模的基准，返回可直接保存为基线的结果。"""
+    ctx = multiprocessing.get_context('spawn')
+    report = {
+        'created_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'machine': {'python': platform.python_version(), 'platform': platform.platform(),
+                    'cpu_count': os.cpu_count()},
+        'commit': _git_commit(),
+        'seed': seed,
+        'scales': {},
+    }
+    for n in scales:
+        workdir = tempfile.mkdtemp(prefix=f'bench_{n}_')
+        try:
+            queue = ctx.Queue()
+            proc = ctx.Process(target=_scale_worker, args=(n, n_days, seed, workdir, queue))
+            proc.start()
+            result = _wait_result(proc, queue)
+            proc.join()
+            if 'error' in result:
+                result = {'n_tickers': n, 'n_days': n_days, **result}
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        report['scales'][str(n)] = result
+    return report
+
+
+def compare_to_baseline(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = 0.25) -> List[Dict[str, Any]]:
+    """逐规模、逐阶段对比耗时与峰值内存，返回全部对比行（regression=True 表示超出容忍度）。"""
+    rows = []
+    for scale, current in report['scales'].items():
+        base = baseline.get('scales', {}).get(scale)
+        if not base or 'stages' not in base or 'stages' not in current:
+            continue
+        for stage, now in current['stages'].items():
+            ref = base['stages'].get(stage)
+            if not ref:
+                continue
+            for metric in ('seconds', 'peak_rss_mb'):
+                if not ref.get(metric):
+                    continue
+                ratio = now[metric] / ref[metric]
+                comparable = metric != 'seconds' or max(now[metric], ref[metric]) >= MIN_COMPARABLE_SECONDS
+                rows.append({'scale': scale, 'stage': stage, 'metric': metric, 'baseline': ref[metric],
+                             'current': now[metric], 'ratio': round(ratio, 3),
+                             'regression': comparable and ratio > 1 + tolerance})
+    return rows
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='合成行情上的端到端性能基准')
+    parser.add_argument('--scales', type=int, nargs='+', default=list(DEFAULT_SCALES), help='股票数量（可多个）')
+    parser.add_argument('--days', type=int, default=DEFAULT_DAYS, help='交易日数')
+    parser.add_argument('--seed', type=int, default=0, help='合成行情的随机种子')
+    parser.add_argument('--output', default=os.path.join('output', 'benchmark_latest.json'), help='本次结果 JSON 路径')
+    parser.add_argument('--save-baseline', help='将本次结果另存为基线 JSON')
+    parser.add_argument('--compare', help='与该基线 JSON 对比')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='允许的相对回退幅度（默认 25%%）')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    logger = logging.getLogger(__name__)
+    report = run_suite(args.scales, args.days, args.seed)
+    for path in filter(None, [args.output, args.save_baseline]):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        logger.info(f"基准结果已保存至: {path}")
+
+    failed = any('error' in r for r in report['scales'].values())
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('machine') != report['machine']:
+            logger.warning(f"基线生成于不同的机器（{baseline.get('machine')}），对比结果仅供参考")
+        if baseline.get('commit') != report['commit']:
+            logger.warning(f"基线对应提交 {baseline.get('commit')}，当前为 {report['commit']}")
+        rows = compare_to_baseline(report, baseline, args.tolerance)
+        for row in rows:
+            flag = '回退' if row['regression'] else 'ok'
+            logger.info(f"[{flag}] {row['scale']:>5} {row['stage']:<40} {row['metric']:<12} "
+                        f"{row['baseline']} -> {row['current']} (x{row['ratio']})")
+        regressions = [r for r in rows if r['regression']]
+        if regressions:
+            logger.warning(f"共 {len(regressions)} 项超出基线 {args.tolerance:.0%}")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
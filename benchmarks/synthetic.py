@@ -0,0 +1,174 @@
+"""
+可复现的合成行情：N 只股票 × M 个交易日的日线 OHLCV，写入给定的 Database。
+
+为贴近真实数据，生成的行情包含：
+- 上市日期不一（部分股票在区间中途上市，之前没有K线）
+- 零散缺失的K线（数据源漏数）
+- 连续多日停牌（停牌期间没有K线，复牌后价格跳空）
+- 公司行为：送转/拆股（价格按比例跳变、成交量反向放大，模拟未复权数据）与现金分红（除息日价格下移）
+同一 seed 生成的数据完全一致，便于基准测试结果横向比较。
+"""
+import datetime
+import time
+import numpy as np
+import pandas as pd
+from typing import Dict, Any, List
+from data.database import Database
+from data.quotes import upsert_prices
+
+SYNTHETIC_INDICES = {'000300.SH': '合成沪深300', '000905.SH': '合成中证500', '399006.SZ': '合成创业板指'}
+INDUSTRIES = ('银行', '医药', '电子', '计算机', '机械', '化工', '食品饮料', '有色金属')
+
+
+def trading_days(n_days: int, end_date: str | None = None) -> pd.DatetimeIndex:
+    """以 end_date（默认今天）为最后一天、向前 n_days 个工作日的交易日历。"""
+    end = pd.Timestamp(end_date) if end_date else pd.Timestamp(datetime.date.today())
+    return pd.bdate_range(end=end, periods=n_days)
+
+
+def ticker_codes(n_tickers: int) -> List[str]:
+    """合成股票代码：沪市 600000 起、深市 000001 起交替编号。"""
+    return [f"{600000 + i // 2:06d}.SH" if i % 2 == 0 else f"{1 + i // 2:06d}.SZ" for i in range(n_tickers)]
+
+
+def simulate_ticker(rng: np.random.Generator, dates: pd.DatetimeIndex, gap_rate: float = 0.002,
+                    suspension_rate: float = 0.001, action_rate: float = 0.0008) -> pd.DataFrame:
+    """
+    生成单只股票的日线（索引为日期，列 open/high/low/close/volume/turnover），
+    已剔除上市前、缺失与停牌的K线。
+    """
+    n = len(dates)
+    # 带缓慢周期漂移的对数收益，使均线策略有足够的交叉信号
+    drift = 0.0003 + 0.004 * np.sin(np.arange(n) / rng.uniform(20, 80) + rng.uniform(0, 2 * np.pi))
+    returns = rng.normal(drift, rng.uniform(0.012, 0.03), n)
+
+    # 公司行为：送转/拆股按比例下调此后的价格，现金分红在除息日下移价格
+    price_factor = np.ones(n)
+    volume_factor = np.ones(n)
+    for t in np.flatnonzero(rng.random(n) < action_rate):
+        if rng.random() < 0.5:
+            ratio = rng.choice([1.3, 1.5, 2.0])
+            price_factor[t:] /= ratio
+            volume_factor[t:] *= ratio
+        else:
+            returns[t] += np.log(1 - rng.uniform(0.005, 0.03))
+
+    close = rng.uniform(3, 80) * np.exp(np.cumsum(returns)) * price_factor
+    open_ = close * np.exp(rng.normal(0, 0.006, n))
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.008, n)))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.008, n)))
+    volume = rng.lognormal(np.log(rng.uniform(2e4, 5e5)), 0.5, n) * volume_factor
+    # 放量日：与价格周期相关的成交量脉冲
+    volume *= 1 + (np.sin(np.arange(n) / 7 + rng.uniform(0, 7)) > 0.85)
+    turnover = volume * close / 10.0
+
+    keep = np.ones(n, dtype=bool)
+    # 约 15% 的股票在区间内上市
+    if rng.random() < 0.15:
+        keep[:int(rng.integers(1, max(2, n // 2)))] = False
+    keep &= rng.random(n) >= gap_rate
+    for t in np.flatnonzero(rng.random(n) < suspension_rate):
+        keep[t:t + int(rng.integers(3, 30))] = False
+
+    df = pd.DataFrame({'open': open_, 'high': high, 'low': low, 'close': close,
+                       'volume': volume.round(), 'turnover': turnover}, index=dates)
+    return df[keep].round({'open': 2, 'high': 2, 'low': 2, 'close': 2, 'turnover': 2})
+
+
+def _price_rows(ts_code: str, df: pd.DataFrame) -> List[tuple]:
+    dates = df.index.strftime('%Y%m%d')
+    return list(zip([ts_code] * len(df), dates, df['open'], df['high'], df['low'], df['close'],
+                    df['volume'].astype(int).tolist(), df['turnover']))
+
+
+def generate_market(db: Database, n_tickers: int, n_days: int, seed: int = 0, end_date: str | None = None,
+                    batch_tickers: int = 200) -> Dict[str, Any]:
+    """
+    生成并写入 n_tickers 只股票与若干指数的合成行情（stocks / watchlist / indices / index_watchlist /
+    daily_price / index_daily_price）。行情按 batch_tickers 只股票一批经 upsert_prices 批量写入
+    （同时维护 latest_quote），与真实入库路径一致。返回 {'ts_codes', 'index_codes', 'dates', 'rows', 'write_seconds'}，
+    write_seconds 为行情批量写入（不含生成）的累计耗时。
+    """
+    rng = np.random.default_rng(seed)
+    dates = trading_days(n_days, end_date)
+    codes = ticker_codes(n_tickers)
+    list_date = dates[0].strftime('%Y%m%d')
+    db.executemany("INSERT OR REPLACE INTO stocks (ts_code, symbol, name, industry, list_date, region) "
+                   "VALUES (?, ?, ?, ?, ?, ?)",
+                   [(c, c[:6], f"合成{c[:6]}", INDUSTRIES[k % len(INDUSTRIES)], list_date, '合成')
+                    for k, c in enumerate(codes)])
+    db.executemany("INSERT OR REPLACE INTO watchlist (ts_code, name, add_date, in_pool) VALUES (?, ?, ?, 1)",
+                   [(c, f"合成{c[:6]}", list_date) for c in codes])
+
+    rows, write_seconds = 0, 0.0
+    for lo in range(0, n_tickers, batch_tickers):
+        batch = []
+        for code in codes[lo:lo + batch_tickers]:
+            batch.extend(_price_rows(code, simulate_ticker(rng, dates)))
+        started = time.perf_counter()
+        upsert_prices(db, 'daily_price', batch)
+        write_seconds += time.perf_counter() - started
+        rows += len(batch)
+
+    index_rows = []
+    for k, code in enumerate(SYNTHETIC_INDICES):
+        level = 1000 * (k + 1) * np.exp(np.cumsum(rng.normal(0.0002, 0.011, n_days)))
+        index_rows.extend((code, d.strftime('%Y%m%d'), c, c, c, c, 0, 0.0) for d, c in zip(dates, level.round(2)))
+    db.executemany("INSERT OR REPLACE INTO indices (ts_code, name) VALUES (?, ?)", list(SYNTHETIC_INDICES.items()))
+    db.executemany("INSERT OR REPLACE INTO index_watchlist (ts_code, name, add_date, in_pool) VALUES (?, ?, ?, 1)",
+                   [(c, name, list_date) for c, name in SYNTHETIC_INDICES.items()])
+    upsert_prices(db, 'index_daily_price', index_rows)
+    return {'ts_codes': codes, 'index_codes': list(SYNTHETIC_INDICES), 'dates': dates, 'rows': rows,
+            'write_seconds': write_seconds}
+
+
+def generate_trades(db: Database, ts_codes: List[str], portfolio_name: str = 'default', n_trades: int = 200,
+                    initial_cash: float = 1_000_000.0, seed: int = 0) -> int:
+    """
+    为组合生成一段可执行的交易流水（先买后卖、数量为 100 股整数倍、价格取当日收盘价），
+    并写入 trades 与 portfolio（期末持仓与初始现金）。返回写入的交易笔数。
+    """
+    rng = np.random.default_rng(seed)
+    picks = list(rng.choice(ts_codes, size=min(len(ts_codes), max(1, n_trades // 4)), replace=False))
+    placeholders = ','.join('?' for _ in picks)
+    prices = pd.DataFrame(db.fetch_all(f"SELECT ts_code, date, close FROM daily_price WHERE ts_code IN "
+                                       f"({placeholders}) ORDER BY date", tuple(picks)))
+    by_code = {code: g for code, g in prices.groupby('ts_code')}
+
+    events = []
+    for _ in range(n_trades // 2):
+        bars = by_code.get(picks[int(rng.integers(len(picks)))])
+        if bars is None or len(bars) < 3:
+            continue
+        i, j = sorted(rng.choice(len(bars), size=2, replace=False))
+        qty = float(100 * rng.integers(1, 20))
+        buy, sell = bars.iloc[i], bars.iloc[j]
+        events.append((buy['date'], buy['ts_code'], 'buy', float(buy['close']), qty))
+        if rng.random() < 0.8:  # 约两成买入持有至期末
+            events.append((sell['date'], sell['ts_code'], 'sell', float(sell['close']), qty))
+    events.sort()
+
+    positions, rows = {}, []
+    for date, code, side, price, qty in events:
+        fee = round(price * qty * 0.0003, 2)
+        if side == 'buy':
+            held = positions.get(code, {'qty': 0.0, 'cost': 0.0})
+            new_qty = held['qty'] + qty
+            positions[code] = {'qty': new_qty, 'cost': (held['qty'] * held['cost'] + price * qty) / new_qty}
+        else:
+            positions[code]['qty'] -= qty
+            if positions[code]['qty'] == 0:
+                del positions[code]
+        rows.append((date, portfolio_name, code, side, price, qty, fee))
+
+    db.execute("DELETE FROM trades WHERE portfolio_name = ?", (portfolio_name,))
+    db.execute("DELETE FROM portfolio WHERE portfolio_name = ?", (portfolio_name,))
+    db.executemany("INSERT INTO trades (date, portfolio_name, ts_code, side, price, qty, fee) "
+                   "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    # 与 PortfolioManager 一致：CASH 行为期末现金（初始现金加全部交易现金流），期末持仓按加权成本写入
+    cash = initial_cash + sum((price * qty if side == 'sell' else -price * qty) - fee
+                              for _, _, _, side, price, qty, fee in rows)
+    holdings = [(portfolio_name, code, p['qty'], p['cost']) for code, p in positions.items()]
+    db.executemany("INSERT INTO portfolio (portfolio_name, ts_code, qty, cost) VALUES (?, ?, ?, ?)",
+                   holdings + [(portfolio_name, 'CASH', 1, cash)])
+    return len(rows)
@@ -1,6 +1,6 @@
 import os
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Optional, Dict
 
 from functools import lru_cache
 
@@ -15,6 +15,13 @@ class Settings(BaseSettings):
 
     # 数据库配置
     DB_PATH: str = os.path.join(os.path.dirname(__file__), "../data/wayssystem.db")
+    DB_QUERY_STATS: bool = False  # 记录每条 SQL 的调用次数/耗时（data/query_stats.py），默认关闭
+    DB_SLOW_QUERY_MS: float = 200.0  # 超过该耗时的语句连同查询计划写入慢查询日志
+
+    # 结构化事件日志（utils/events.py）
+    EVENT_LOG_LEVEL: str = "INFO"  # 低于该级别的事件不记录；设为 DEBUG 可记录每笔策略下单
+    EVENT_LOG_PATH: str = os.path.join("output", "events.jsonl")
+    EVENT_SAMPLE_RATES: Dict[str, float] = {}  # 按事件类型的采样比例，如 {"order_created": 0.1}
 
     # 投资组合和回测配置
     PORTFOLIO_INITIAL_CAPITAL: float = 1000000.0 # 模拟盘初始资金100万
@@ -22,6 +29,7 @@ class Settings(BaseSettings):
     BACKTEST_FEE_RATE: float = 0.0003  # 手续费率0.03%
     BACKTEST_START_DATE: str = "2024-01-01"
     BACKTEST_END_DATE: Optional[str] = None  # 默认到最新交易日
+    BACKTEST_MEMORY_BUDGET_MB: int = 4096  # 低内存（内存映射）回测模式的内存预算
 
     # 策略配置
     STRATEGY_A_STOP_LOSS_RATE: float = 0.93  # 策略A止损率
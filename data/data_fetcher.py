@@ -3,7 +3,10 @@ import pandas as pd
 from datetime import datetime, timedelta
 from typing import List, Optional
 from .database import Database
+from .quotes import PRICE_TABLES, upsert_prices, refresh_latest_quotes
 from config.settings import get_settings
+from utils.timing import timed, span, current_span
+from portfolio.manager import refresh_snapshots_for_prices
 import warnings
 import logging
 
@@ -20,6 +23,8 @@ class DataFetcher:
 
     def __init__(self, db: Database):
         self.db = db
+        # 本轮更新中每只股票写入的最早行情日期，用于增量维护组合净值快照
+        self.price_changes = {}
 
     def update_all_stock_basics(self) -> int:
         """获取全市场股票基础信息"""
@@ -75,7 +80,9 @@ class DataFetcher:
 
         logging.getLogger(__name__).info(f"准备更新 {ts_code} 从 {start_date} 到 {end_date} 的 {table_name} 数据...")
         try:
-            df = fetch_func(ts_code=ts_code, start_date=start_date, end_date=end_date, **kwargs)
+            with span(f'fetch_api[{table_name}]') as api:
+                df = fetch_func(ts_code=ts_code, start_date=start_date, end_date=end_date, **kwargs)
+                api.add(rows=0 if df is None else len(df))
             if df is None or df.empty:
                 logging.getLogger(__name__).info(f"在指定时间段内未获取到 {ts_code} 的新数据")
                 return 0
@@ -100,14 +107,23 @@ class DataFetcher:
             else:
                 return 0
 
-            data_to_insert = [tuple(row) for row in df.itertuples(index=False)]
-            self.db.executemany(insert_query, data_to_insert)
+            with span(f'upsert[{table_name}]', rows=len(df)):
+                data_to_insert = [tuple(row) for row in df.itertuples(index=False)]
+                if table_name in PRICE_TABLES:
+                    # 行情与 latest_quote 在同一事务中更新
+                    upsert_prices(self.db, table_name, data_to_insert)
+                else:
+                    self.db.executemany(insert_query, data_to_insert)
+            if table_name == 'daily_price':
+                first = df['date'].min()
+                self.price_changes[ts_code] = min(self.price_changes.get(ts_code, first), first)
             logging.getLogger(__name__).info(f"成功更新 {ts_code} 的 {len(df)} 条 {table_name} 数据")
             return len(df)
         except Exception as e:
             logging.getLogger(__name__).exception(f"获取 {ts_code} 数据失败: {e}")
             return 0
 
+    @timed('update_watchlist_data')
     def update_watchlist_data(self, force_start_date: Optional[str] = None) -> int:
         """更新自选股列表中的股票行情和基本面数据"""
         logging.getLogger(__name__).info("开始更新自选股数据...")
@@ -117,11 +133,14 @@ class DataFetcher:
             return 0
 
         stock_codes = [stock['ts_code'] for stock in watchlist]
+        current_span().set(tickers=len(stock_codes))
         
         if force_start_date:
             logging.getLogger(__name__).warning(f"--- 强制刷新模式：将从 {force_start_date} 开始为自选股列表重新下载所有数据 ---")
             placeholders = ','.join('?' for _ in stock_codes)
-            self.db.execute(f"DELETE FROM daily_price WHERE ts_code IN ({placeholders})", tuple(stock_codes))
+            with self.db.transaction():
+                self.db.execute(f"DELETE FROM daily_price WHERE ts_code IN ({placeholders})", tuple(stock_codes))
+                refresh_latest_quotes(self.db, 'daily_price', stock_codes)
             self.db.execute(f"DELETE FROM fundamentals WHERE ts_code IN ({placeholders})", tuple(stock_codes))
             logging.getLogger(__name__).info("已删除旧的行情和基本面数据。")
 
@@ -129,10 +148,16 @@ class DataFetcher:
             logging.getLogger(__name__).info(f"正在处理自选股 {i+1}/{len(stock_codes)}: {ts_code}")
             self._fetch_data_incrementally(ts_code, 'daily_price', 'date', ts.pro_bar, adj='qfq', start_date=force_start_date)
             self._fetch_data_incrementally(ts_code, 'fundamentals', 'report_date', pro.daily_basic, fields='ts_code,trade_date,pe_ttm,pb,total_mv', start_date=force_start_date)
-        
+
+        with span('refresh_snapshots'):
+            refreshed = refresh_snapshots_for_prices(self.db, self.price_changes)
+        self.price_changes = {}
+        if refreshed:
+            logging.getLogger(__name__).info(f"已增量更新组合净值快照: {refreshed}")
         logging.getLogger(__name__).info("自选股数据更新完成！")
         return len(stock_codes)
 
+    @timed('update_index_watchlist_data')
     def update_index_watchlist_data(self, force_start_date: Optional[str] = None) -> int:
         """更新自选指数列表中的数据"""
         logging.getLogger(__name__).info("开始更新自选指数数据...")
@@ -142,11 +167,14 @@ class DataFetcher:
             return 0
 
         index_codes = [item['ts_code'] for item in watchlist]
+        current_span().set(tickers=len(index_codes))
 
         if force_start_date:
             logging.getLogger(__name__).warning(f"--- 强制刷新模式：将从 {force_start_date} 开始为自选指数列表重新下载所有数据 ---")
             placeholders = ','.join('?' for _ in index_codes)
-            self.db.execute(f"DELETE FROM index_daily_price WHERE ts_code IN ({placeholders})", tuple(index_codes))
+            with self.db.transaction():
+                self.db.execute(f"DELETE FROM index_daily_price WHERE ts_code IN ({placeholders})", tuple(index_codes))
+                refresh_latest_quotes(self.db, 'index_daily_price', index_codes)
             logging.getLogger(__name__).info("已删除旧的指数行情数据。")
 
         for i, ts_code in enumerate(index_codes):
@@ -1,8 +1,11 @@
 import sqlite3
 import os
 import logging
+import time
+from contextlib import contextmanager
 from typing import List, Dict, Any, Optional
 from config.settings import get_settings
+from data.query_stats import STATS
 
 settings = get_settings()
 
@@ -14,6 +17,8 @@ class Database:
         # Connect to the database, allowing multi-threaded access for Streamlit
         self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
         self.conn.row_factory = sqlite3.Row
+        # transaction() 的嵌套深度；大于 0 时各方法不单独提交
+        self._tx_depth = 0
         self._configure_pragmas()
         self._create_tables()
 
@@ -162,48 +167,216 @@ class Database:
         )
         ''')
 
+        # Backtest run store: one row per content-addressed run (columnar payload in output/runs/<run_id>/)
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS backtest_runs (
+            run_id TEXT PRIMARY KEY,
+            created_at TEXT,
+            strategy TEXT,
+            params TEXT,
+            engine TEXT,
+            start_date TEXT,
+            end_date TEXT,
+            initial_capital REAL,
+            max_positions INTEGER,
+            ts_codes TEXT,
+            skipped_ts_codes TEXT,
+            warmup_bars INTEGER,
+            metrics TEXT,
+            path TEXT
+        )
+        ''')
+
+        # 后台回测任务队列（由 backtest/jobs.py 的工作进程消费）
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS backtest_jobs (
+            job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            status TEXT,
+            request TEXT,
+            submitted_at TEXT,
+            started_at TEXT,
+            finished_at TEXT,
+            progress REAL DEFAULT 0,
+            message TEXT,
+            cancel_requested INTEGER DEFAULT 0,
+            worker_pid INTEGER,
+            run_id TEXT
+        )
+        ''')
+
+        # 现金流水（只追加）：初始资金、入金、出金；compact_ledger 时折叠为一条 checkpoint
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cash_ledger (
+            entry_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            portfolio_name TEXT,
+            date TEXT,
+            kind TEXT,
+            amount REAL
+        )
+        ''')
+
+        # 每只股票/指数的最新行情（data/quotes.py 在写入行情的同一事务中维护）
+        quote_table_exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'latest_quote'").fetchone() is not None
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS latest_quote (
+            asset TEXT,
+            ts_code TEXT,
+            date TEXT,
+            close REAL,
+            prev_close REAL,
+            change REAL,
+            pct_change REAL,
+            volume REAL,
+            PRIMARY KEY (asset, ts_code)
+        )
+        ''')
+
+        # 滚动风险序列缓存（risk/rolling.py 按快照增量延伸）；total_value / bench_close 用于发现快照或基准被改写
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS risk_series (
+            portfolio_name TEXT,
+            benchmark TEXT,
+            window_days INTEGER,
+            date TEXT,
+            total_value REAL,
+            bench_close REAL,
+            ret REAL,
+            volatility REAL,
+            var_95 REAL,
+            drawdown REAL,
+            underwater_days INTEGER,
+            beta REAL,
+            sharpe REAL,
+            PRIMARY KEY (portfolio_name, benchmark, window_days, date)
+        )
+        ''')
+
+        # SQL 查询统计（data/query_stats.py，DB_QUERY_STATS 开启时按规范化语句累计）
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS query_stats (
+            statement TEXT PRIMARY KEY,
+            calls INTEGER,
+            total_ms REAL,
+            max_ms REAL,
+            p95_ms REAL,
+            rows INTEGER,
+            slow_calls INTEGER,
+            sample_sql TEXT,
+            sample_params TEXT,
+            last_seen TEXT
+        )
+        ''')
+
         # Indexes for performance
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_daily_price ON daily_price(ts_code, date)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_index_daily_price ON index_daily_price(ts_code, date)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_watchlist_ts ON watchlist(ts_code)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_index_watchlist_ts ON index_watchlist(ts_code)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_portfolio_snapshots ON portfolio_snapshots(portfolio_name, date)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_backtest_jobs_status ON backtest_jobs(status, job_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_trades_portfolio_date ON trades(portfolio_name, date)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_cash_ledger_portfolio ON cash_ledger(portfolio_name, entry_id)')
 
         self.conn.commit()
+        if not quote_table_exists:
+            self._backfill_latest_quotes()
 
-    def execute(self, query: str, params: tuple = None) -> None:
-        """执行SQL语句"""
+    def _backfill_latest_quotes(self):
+        """新建 latest_quote 时按已有行情一次性填充"""
+        from data.quotes import PRICE_TABLES, refresh_latest_quotes
+        for table in PRICE_TABLES:
+            codes = [r['ts_code'] for r in self.fetch_all(f"SELECT DISTINCT ts_code FROM {table}")]
+            if codes:
+                refresh_latest_quotes(self, table, codes)
+
+    @contextmanager
+    def transaction(self):
+        """
+        事务上下文：块内的 execute / insert / executemany 不单独提交，正常退出时一次提交，异常时整体回滚。
+        可嵌套，只有最外层负责提交或回滚。
+        """
+        if self._tx_depth == 0:
+            self.conn.commit()  # 结束隐式打开的事务，之后显式开始
+            self.conn.execute('BEGIN IMMEDIATE')
+        self._tx_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._tx_depth -= 1
+            if self._tx_depth == 0:
+                self.conn.rollback()
+                if STATS.enabled:
+                    STATS.maybe_flush()
+            raise
+        self._tx_depth -= 1
+        if self._tx_depth == 0:
+            self.conn.commit()
+            # 事务中推迟的查询统计写表（写锁已释放）
+            if STATS.enabled:
+                STATS.maybe_flush()
+
+    def _commit(self):
+        if self._tx_depth == 0:
+            self.conn.commit()
+
+    def execute(self, query: str, params: tuple = None) -> int:
+        """执行SQL语句，返回受影响的行数"""
         cursor = self.conn.cursor()
+        started = time.perf_counter()
         if params:
             cursor.execute(query, params)
         else:
             cursor.execute(query)
-        self.conn.commit()
+        self._commit()
+        if STATS.enabled:
+            STATS.record(self, query, params, time.perf_counter() - started, cursor.rowcount)
+        return cursor.rowcount
+
+    def insert(self, query: str, params: tuple = None) -> int:
+        """执行INSERT语句，返回新行的 rowid"""
+        cursor = self.conn.cursor()
+        started = time.perf_counter()
+        cursor.execute(query, params or ())
+        self._commit()
+        if STATS.enabled:
+            STATS.record(self, query, params, time.perf_counter() - started, cursor.rowcount)
+        return cursor.lastrowid
 
     def executemany(self, query: str, params: List[tuple]) -> None:
         """执行批量SQL语句"""
         cursor = self.conn.cursor()
+        started = time.perf_counter()
         cursor.executemany(query, params)
-        self.conn.commit()
+        self._commit()
+        if STATS.enabled:
+            # 批量语句不保存样本参数（整批参数可能很大）
+            STATS.record(self, query, None, time.perf_counter() - started, cursor.rowcount)
 
     def fetch_one(self, query: str, params: tuple = None) -> Optional[Dict[str, Any]]:
         """获取单条查询结果"""
         cursor = self.conn.cursor()
+        started = time.perf_counter()
         if params:
             cursor.execute(query, params)
         else:
             cursor.execute(query)
         result = cursor.fetchone()
+        if STATS.enabled:
+            STATS.record(self, query, params, time.perf_counter() - started, 1 if result else 0)
         return dict(result) if result else None
 
     def fetch_all(self, query: str, params: tuple = None) -> List[Dict[str, Any]]:
         """获取所有查询结果"""
         cursor = self.conn.cursor()
+        started = time.perf_counter()
         if params:
             cursor.execute(query, params)
         else:
             cursor.execute(query)
         results = cursor.fetchall()
+        if STATS.enabled:
+            STATS.record(self, query, params, time.perf_counter() - started, len(results))
         return [dict(row) for row in results]
 
     def close(self):
@@ -0,0 +1,278 @@
+"""
+SQL 查询统计与慢查询日志（按需开启：设置 DB_QUERY_STATS=true，或在“查询性能”页面临时开启）。
+
+开启后 Database 的 execute / insert / executemany / fetch_one / fetch_all 逐条计时，按规范化语句
+（字面量替换为 ?、IN (?, ?, ...) 折叠为 IN (?...)、空白合并）汇总：调用次数、累计/最大耗时、近期 p95、
+返回（或影响）的行数。超过 DB_SLOW_QUERY_MS 的语句连同 EXPLAIN QUERY PLAN 写入日志。
+
+统计先在进程内按数据库分别累计，定期（及进程退出时）合并写入各自数据库的 query_stats 表，多个进程
+（页面、回测工作进程）的调用次数、耗时、行数累加在一起；p95_ms 是最近一次写表的进程的近期样本分位数，
+不是跨进程的全局分位。业务连接处于事务中时不写表（写表需要数据库写锁），推迟到最外层事务结束后；
+写表失败的统计保留在进程内，下次再写。查看：
+    python -m data.query_stats [--top 20] [--sort total_ms|calls|p95_ms|rows] [--explain] [--reset]
+"""
+import argparse
+import atexit
+import collections
+import functools
+import json
+import logging
+import re
+import sqlite3
+import sys
+import threading
+import time
+from typing import Dict, Any, List
+
+import numpy as np
+
+# 每条语句保留的近期耗时样本数（用于 p95）
+SAMPLE_SIZE = 512
+# 进程内统计合并写入 query_stats 表的最小间隔（秒）
+FLUSH_INTERVAL = 30.0
+# 被判定为“逐标的查询”（N+1）的调用次数与平均耗时阈值
+MANY_CALLS = 100
+CHEAP_CALL_MS = 2.0
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+
+
+@functools.lru_cache(maxsize=4096)
+def normalize_sql(query: str) -> str:
+    """语句规范化：去掉字面量与 IN 列表长度差异，使同一类查询归为一条统计。"""
+    sql = _STRING_LITERAL.sub('?', query)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = _IN_LIST.sub('IN (?...)', sql)
+    return _WHITESPACE.sub(' ', sql).strip().rstrip(';')
+
+
+def _is_explainable(sql: str) -> bool:
+    head = sql.lstrip().split(' ', 1)[0].upper()
+    return head in ('SELECT', 'WITH', 'UPDATE', 'DELETE', 'INSERT', 'REPLACE')
+
+
+def explain_plan(conn, query: str, params=None) -> List[str]:
+    """EXPLAIN QUERY PLAN 的各行 detail（直接使用底层连接，不计入统计）。"""
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"EXPLAIN QUERY PLAN {query}", params or ())
+        return [row[-1] for row in cursor.fetchall()]
+    except Exception as e:
+        return [f"EXPLAIN 失败: {e}"]
+
+
+def plan_warnings(plan: List[str]) -> List[str]:
+    """从查询计划中找出全表（或整个非覆盖索引）扫描与临时 B 树排序。"""
+    notes = []
+    for line in plan:
+        if line.startswith('SCAN') and 'COVERING INDEX' not in line:
+            notes.append(f"全表扫描: {line}")
+        elif 'USE TEMP B-TREE' in line:
+            notes.append(f"临时排序: {line}")
+    return notes
+
+
+class QueryStats:
+    """进程内的查询统计注册表（线程安全）。"""
+
+    def __init__(self):
+        from config.settings import get_settings
+        settings = get_settings()
+        self.enabled = settings.DB_QUERY_STATS
+        self.slow_ms = settings.DB_SLOW_QUERY_MS
+        self._lock = threading.Lock()
+        # 数据库路径 -> 规范化语句 -> 尚未写表的累计值
+        self._stats: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._samples: Dict[str, collections.deque] = {}
+        self._last_flush = time.monotonic()
+
+    def record(self, db, query: str, params, elapsed: float, rows: int) -> None:
+        """登记一次执行；db 为发出语句的 Database（用于慢查询 EXPLAIN 与定期写表）。"""
+        sql = normalize_sql(query)
+        ms = elapsed * 1000.0
+        with self._lock:
+            stats = self._stats.setdefault(db.db_path, {})
+            entry = stats.get(sql)
+            if entry is None:
+                entry = stats[sql] = {'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'rows': 0, 'slow_calls': 0}
+            if sql not in self._samples:
+                self._samples[sql] = collections.deque(maxlen=SAMPLE_SIZE)
+            entry['calls'] += 1
+            entry['total_ms'] += ms
+            entry['max_ms'] = max(entry['max_ms'], ms)
+            entry['rows'] += max(rows, 0)
+            entry['sample_sql'] = query
+            entry['sample_params'] = params
+            self._samples[sql].append(ms)
+            if ms >= self.slow_ms:
+                entry['slow_calls'] += 1
+        if ms >= self.slow_ms and _is_explainable(query):
+            plan = explain_plan(db.conn, query, params if isinstance(params, (tuple, list, dict)) else None)
+            logging.getLogger(__name__).warning(
+                "慢查询 %.1f ms: %s | 计划: %s", ms, sql, ' / '.join(plan))
+        # 事务中的语句不触发写表：业务连接持有写锁，另开连接写表只会等锁超时（由 transaction() 结束时补上）
+        if getattr(db, '_tx_depth', 0) == 0:
+            self.maybe_flush()
+
+    def maybe_flush(self) -> None:
+        """距上次写表超过 FLUSH_INTERVAL 时写表。"""
+        if time.monotonic() - self._last_flush >= FLUSH_INTERVAL:
+            self.flush()
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """进程内尚未写表的统计（含近期 p95）。"""
+        with self._lock:
+            merged: Dict[str, Dict[str, Any]] = {}
+            for stats in self._stats.values():
+                _merge(merged, stats)
+            rows = []
+            for sql, entry in merged.items():
+                samples = self._samples[sql]
+                rows.append({'statement': sql, **entry,
+                             'p95_ms': float(np.percentile(samples, 95)) if samples else 0.0})
+            return rows
+
+    def flush(self) -> None:
+        """
+        将进程内统计合并写入各自数据库的 query_stats 表，并清空进程内计数（近期样本保留）。
+        写表失败（如数据库被其它连接锁住）的统计并回进程内，下次写表时再合并。
+        """
+        with self._lock:
+            pending = self._stats
+            p95 = {sql: float(np.percentile(s, 95)) for sql, s in self._samples.items() if s}
+            self._stats = {}
+            self._last_flush = time.monotonic()
+        now = time.strftime('%Y-%m-%d %H:%M:%S')
+        failed = {}
+        for path, stats in pending.items():
+            # 内存数据库无法从另一个连接访问，其统计只在进程内查看
+            if path == ':memory:' or not stats:
+                continue
+            rows = [(sql, e['calls'], e['total_ms'], e['max_ms'], p95.get(sql, 0.0), e['rows'], e['slow_calls'],
+                     e.get('sample_sql'), _params_json(e.get('sample_params')), now) for sql, e in stats.items()]
+            conn = None
+            try:
+                # 独立连接写表，避免与业务连接上的未提交事务交织
+                conn = sqlite3.connect(path, timeout=5)
+                conn.executemany(
+                    "INSERT INTO query_stats (statement, calls, total_ms, max_ms, p95_ms, rows, slow_calls, "
+                    "sample_sql, sample_params, last_seen) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(statement) DO UPDATE SET calls = calls + excluded.calls, "
+                    "total_ms = total_ms + excluded.total_ms, max_ms = MAX(max_ms, excluded.max_ms), "
+                    "p95_ms = excluded.p95_ms, rows = rows + excluded.rows, "
+                    "slow_calls = slow_calls + excluded.slow_calls, sample_sql = excluded.sample_sql, "
+                    "sample_params = excluded.sample_params, last_seen = excluded.last_seen", rows)
+                conn.commit()
+            except Exception as e:
+                logging.getLogger(__name__).warning(f"写入查询统计失败 ({path})，稍后重试: {e}")
+                failed[path] = stats
+            finally:
+                if conn is not None:
+                    conn.close()
+        if failed:
+            with self._lock:
+                for path, stats in failed.items():
+                    _merge(self._stats.setdefault(path, {}), stats)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+            self._samples.clear()
+
+
+def _merge(into: Dict[str, Dict[str, Any]], stats: Dict[str, Dict[str, Any]]) -> None:
+    """把一组语句累计值并入 into（样本语句与参数以 into 中已有的较新者为准）。"""
+    for sql, e in stats.items():
+        cur = into.get(sql)
+        if cur is None:
+            into[sql] = dict(e)
+            continue
+        for key in ('calls', 'total_ms', 'rows', 'slow_calls'):
+            cur[key] += e[key]
+        cur['max_ms'] = max(cur['max_ms'], e['max_ms'])
+        cur.setdefault('sample_sql', e.get('sample_sql'))
+        cur.setdefault('sample_params', e.get('sample_params'))
+
+
+def _params_json(params) -> str | None:
+    if params is None:
+        return None
+    try:
+        return json.dumps(list(params) if isinstance(params, tuple) else params, ensure_ascii=False)
+    except TypeError:
+        return None
+
+
+STATS = QueryStats()
+atexit.register(STATS.flush)
+
+
+def top_statements(db, limit: int = 20, sort: str = 'total_ms', explain: bool = False) -> List[Dict[str, Any]]:
+    """
+    读取 query_stats 表中开销最大的语句（先合并本进程尚未写表的统计）。
+    explain=True 时用保存的样本参数重新取 EXPLAIN QUERY PLAN，并标注全表扫描/临时排序与逐标的查询（N+1）。
+    """
+    if sort not in ('total_ms', 'calls', 'p95_ms', 'max_ms', 'rows', 'slow_calls'):
+        raise ValueError(f"不支持的排序字段: {sort}")
+    STATS.flush()
+    cursor = db.conn.cursor()
+    cursor.execute(f"SELECT * FROM query_stats ORDER BY {sort} DESC LIMIT ?", (int(limit),))
+    rows = [dict(r) for r in cursor.fetchall()]
+    for row in rows:
+        row['avg_ms'] = row['total_ms'] / row['calls'] if row['calls'] else 0.0
+        notes = []
+        if row['calls'] >= MANY_CALLS and row['avg_ms'] <= CHEAP_CALL_MS:
+            notes.append("高频小查询（疑似逐标的 N+1，可改为批量 IN 查询）")
+        if explain and row.get('sample_sql') and _is_explainable(row['sample_sql']):
+            params = json.loads(row['sample_params']) if row.get('sample_params') else None
+            row['plan'] = ' / '.join(explain_plan(db.conn, row['sample_sql'], params))
+            notes.extend(plan_warnings(row['plan'].split(' / ')))
+        row['notes'] = '；'.join(notes)
+    return rows
+
+
+def reset_statements(db) -> None:
+    """清空 query_stats 表与本进程的统计。"""
+    STATS.reset()
+    db.conn.execute("DELETE FROM query_stats")
+    db.conn.commit()
+
+
+def main() -> int:
+    from data.database import Database
+
+    parser = argparse.ArgumentParser(description='SQL 查询统计（按累计耗时等排序的开销最大的语句）')
+    parser.add_argument('--top', type=int, default=20, help='显示条数')
+    parser.add_argument('--sort', default='total_ms', help='排序字段：total_ms / calls / p95_ms / max_ms / rows')
+    parser.add_argument('--explain', action='store_true', help='附带查询计划与全表扫描提示')
+    parser.add_argument('--json', action='store_true', help='以 JSON 输出')
+    parser.add_argument('--reset', action='store_true', help='清空统计')
+    args = parser.parse_args()
+
+    db = Database()
+    if args.reset:
+        reset_statements(db)
+        print("查询统计已清空。")
+        return 0
+    rows = top_statements(db, args.top, args.sort, explain=args.explain)
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+        return 0
+    if not rows:
+        print("暂无查询统计（设置 DB_QUERY_STATS=true 后运行一段时间再查看）。")
+        return 0
+    for row in rows:
+        print(f"{row['total_ms']:>10.1f} ms  {row['calls']:>8} 次  avg {row['avg_ms']:>7.2f}  "
+              f"p95 {row['p95_ms']:>7.2f}  max {row['max_ms']:>8.1f}  rows {row['rows']:>9}  {row['statement']}")
+        if row.get('plan'):
+            print(f"{'':>12}计划: {row['plan']}")
+        if row['notes']:
+            print(f"{'':>12}提示: {row['notes']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
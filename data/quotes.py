@@ -0,0 +1,67 @@
+"""
+最新行情（latest_quote）的维护与读取。
+
+latest_quote 按 (asset, ts_code) 保存每只股票/指数最近一根K线的收盘价、前一根K线的收盘价、涨跌额、
+涨跌幅与成交量。行情写入统一走 upsert_prices：价格 upsert 与受影响标的的 latest_quote 刷新在同一事务中完成，
+读取现价时只需按代码查 latest_quote，不必在行情历史上做 MAX(date) 聚合。
+"""
+import json
+from typing import Dict, Any, List, Iterable
+from data.database import Database
+
+# 行情表 -> latest_quote.asset
+PRICE_TABLES = {'daily_price': 'stock', 'index_daily_price': 'index'}
+
+
+def price_upsert_sql(table: str) -> str:
+    return (f"INSERT OR REPLACE INTO {table} (ts_code, date, open, high, low, close, volume, turnover) "
+            f"VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+
+
+def _refresh_sql(table: str) -> str:
+    # 每只标的的最后日期与前一日期都经 (ts_code, date) 索引定位，不扫描历史K线
+    return f"""
+        WITH last AS MATERIALIZED (
+            SELECT p.ts_code, p.date, p.close, p.volume,
+                   (SELECT close FROM {table} q WHERE q.ts_code = p.ts_code AND q.date < p.date
+                    ORDER BY q.date DESC LIMIT 1) AS prev_close
+            FROM json_each(?2) AS codes
+            JOIN {table} p ON p.ts_code = codes.value
+                          AND p.date = (SELECT MAX(date) FROM {table} WHERE ts_code = codes.value)
+        )
+        INSERT OR REPLACE INTO latest_quote (asset, ts_code, date, close, prev_close, change, pct_change, volume)
+        SELECT ?1, ts_code, date, close, prev_close, close - prev_close,
+               CASE WHEN prev_close > 0 THEN (close / prev_close - 1) * 100 END, volume
+        FROM last"""
+
+
+def refresh_latest_quotes(db: Database, table: str, ts_codes: Iterable[str]) -> None:
+    """按行情表重新计算这些标的的 latest_quote（已无K线的标的删除其记录）。可在外层事务中调用。"""
+    codes = json.dumps(sorted(set(ts_codes)))
+    asset = PRICE_TABLES[table]
+    with db.transaction():
+        db.execute("DELETE FROM latest_quote WHERE asset = ? AND ts_code IN (SELECT value FROM json_each(?))",
+                   (asset, codes))
+        db.execute(_refresh_sql(table), (asset, codes))
+
+
+def upsert_prices(db: Database, table: str, rows: List[tuple]) -> None:
+    """
+    写入行情（每行 ts_code, date, open, high, low, close, volume, turnover，幂等 upsert），
+    并在同一事务中刷新涉及标的的 latest_quote。
+    """
+    if not rows:
+        return
+    with db.transaction():
+        db.executemany(price_upsert_sql(table), rows)
+        refresh_latest_quotes(db, table, {r[0] for r in rows})
+
+
+def get_latest_quotes(db: Database, ts_codes: List[str], asset: str = 'stock') -> Dict[str, Dict[str, Any]]:
+    """一批标的的最新行情 {ts_code: {date, close, prev_close, change, pct_change, volume}}；无行情的标的不出现。"""
+    if not ts_codes:
+        return {}
+    rows = db.fetch_all(
+        "SELECT ts_code, date, close, prev_close, change, pct_change, volume FROM latest_quote "
+        "WHERE asset = ? AND ts_code IN (SELECT value FROM json_each(?))", (asset, json.dumps(sorted(set(ts_codes)))))
+    return {r.pop('ts_code'): r for r in rows}
@@ -0,0 +1,118 @@
+"""
+券商成交记录（交割单）批量导入。
+
+成交文件（CSV / Excel）先统一为标准列 date / ts_code / side / price / qty / fee / portfolio_name，
+逐行校验后按组合分组，经 PortfolioManager.add_trades 在同一个事务中写入：整个文件要么全部导入，要么不写入任何记录。
+"""
+import io
+import os
+import pandas as pd
+from typing import Dict, List
+from data.database import Database
+from utils.code_processor import to_ts_code
+from utils.timing import timed, span
+
+# 常见券商导出的列名 -> 标准列名
+COLUMN_ALIASES = {
+    'date': ('date', '成交日期', '交易日期', '日期', '发生日期'),
+    'ts_code': ('ts_code', 'code', '证券代码', '股票代码', '代码'),
+    'side': ('side', '买卖标志', '买卖方向', '操作', '业务名称', '委托类别'),
+    'price': ('price', '成交价格', '成交均价', '成交价'),
+    'qty': ('qty', '成交数量', '成交股数', '数量'),
+    'fee': ('fee', '手续费', '佣金', '交易费用', '费用合计'),
+    'portfolio_name': ('portfolio_name', 'account', '资金账号', '账户', '组合'),
+}
+# 需要与佣金合计为费用的其它费用列
+EXTRA_FEE_COLUMNS = ('印花税', '过户费', '其他费用', '经手费', '证管费')
+SIDE_ALIASES = {'buy': 'buy', 'b': 'buy', '买': 'buy', '买入': 'buy', '证券买入': 'buy',
+                'sell': 'sell', 's': 'sell', '卖': 'sell', '卖出': 'sell', '证券卖出': 'sell'}
+
+
+class FillImportError(ValueError):
+    """成交文件校验失败；errors 为逐行的错误说明"""
+
+    def __init__(self, errors: List[str]):
+        self.errors = errors
+        super().__init__(f"成交文件校验失败（{len(errors)} 处）: " + '；'.join(errors[:5]) + ('…' if len(errors) > 5 else ''))
+
+
+def read_fill_file(source, filename: str | None = None) -> pd.DataFrame:
+    """读取 CSV / Excel 成交文件（路径、文件对象或字节），所有列按字符串读入。"""
+    name = filename or (source if isinstance(source, str) else getattr(source, 'name', ''))
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    if os.path.splitext(str(name))[1].lower() in ('.xls', '.xlsx'):
+        return pd.read_excel(source, dtype=str)
+    try:
+        return pd.read_csv(source, dtype=str, encoding='utf-8-sig')
+    except UnicodeDecodeError:
+        # 国内券商导出的 CSV 多为 GBK 编码
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        return pd.read_csv(source, dtype=str, encoding='gbk')
+
+
+def normalize_fills(raw: pd.DataFrame, default_portfolio: str = 'default') -> pd.DataFrame:
+    """
+    统一列名与取值并逐行校验：日期转为 YYYYMMDD，6 位代码补全交易所后缀，买卖方向归一为 buy/sell，
+    费用为佣金与其它费用列之和。有任何不合法的行时抛出 FillImportError（列出全部错误行）。
+    """
+    raw = raw.rename(columns=lambda c: str(c).strip())
+    columns = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        found = next((c for c in aliases if c in raw.columns), None)
+        if found is not None:
+            columns[field] = found
+    missing = [f for f in ('date', 'ts_code', 'side', 'price', 'qty') if f not in columns]
+    if missing:
+        raise FillImportError([f"缺少列: {', '.join(missing)}"])
+
+    df = pd.DataFrame({field: raw[col] for field, col in columns.items()})
+    df['date'] = pd.to_datetime(df['date'].str.strip(), errors='coerce').dt.strftime('%Y%m%d')
+    df['ts_code'] = df['ts_code'].map(lambda c: to_ts_code(str(c).strip().zfill(6)) if pd.notna(c) else None)
+    df['side'] = df['side'].map(lambda s: SIDE_ALIASES.get(str(s).strip().lower()) if pd.notna(s) else None)
+    df['price'] = pd.to_numeric(df['price'], errors='coerce')
+    # 部分券商卖出数量记为负数
+    df['qty'] = pd.to_numeric(df['qty'], errors='coerce').abs()
+    fee_cols = ([columns['fee']] if 'fee' in columns else []) + [c for c in EXTRA_FEE_COLUMNS if c in raw.columns]
+    df['fee'] = sum((pd.to_numeric(raw[c], errors='coerce').fillna(0) for c in fee_cols), pd.Series(0.0, index=raw.index))
+    if 'portfolio_name' in df:
+        df['portfolio_name'] = df['portfolio_name'].fillna(default_portfolio).str.strip()
+    else:
+        df['portfolio_name'] = default_portfolio
+
+    errors = []
+    checks = [
+        (df['date'].isna(), "日期无法解析"),
+        (~df['ts_code'].fillna('').str.match(r'^\d{6}\.(SH|SZ|BJ)$'), "证券代码不合法"),
+        (df['side'].isna(), "买卖方向无法识别"),
+        (~(df['price'] > 0), "成交价格需大于 0"),
+        (~(df['qty'] > 0), "成交数量需大于 0"),
+        (df['fee'] < 0, "费用不能为负"),
+    ]
+    for mask, message in checks:
+        for idx in df.index[mask.to_numpy()]:
+            # 行号按文件中的数据行计（表头为第 1 行）
+            errors.append(f"第 {idx + 2} 行{message}")
+    if errors:
+        raise FillImportError(errors)
+    return df[['date', 'ts_code', 'side', 'price', 'qty', 'fee', 'portfolio_name']]
+
+
+@timed('import_fills')
+def import_fills(db: Database, fills: pd.DataFrame, default_portfolio: str = 'default') -> Dict[str, int]:
+    """
+    导入成交记录（原始券商格式或已标准化均可）：校验后按组合分组写入，全部组合在同一事务中完成；
+    任一组合的资金/持仓校验失败时整体回滚。返回 {组合名: 导入笔数}。
+    """
+    from portfolio.manager import PortfolioManager
+
+    df = normalize_fills(fills, default_portfolio)
+    counts = {}
+    with span('write', rows=len(df)), db.transaction():
+        for name, group in df.groupby('portfolio_name', sort=True):
+            pm = PortfolioManager(db, name)
+            if not pm.is_initialized():
+                raise ValueError(f"组合 {name} 尚未初始化资金，无法导入成交记录。")
+            counts[name] = pm.add_trades(group.drop(columns='portfolio_name').to_dict('records'))
+    return counts
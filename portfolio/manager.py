@@ -1,10 +1,51 @@
+import numpy as np
 import pandas as pd
-from datetime import datetime
-from typing import List, Dict, Any, Optional
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional, Tuple
 from data.database import Database
-from collections import defaultdict
+from data.quotes import get_latest_quotes
+from utils.timing import timed, span
+from utils import events
+
+# 持仓表（portfolio）为交易流水与现金流水的物化结果，按单行 upsert 维护
+POSITION_UPSERT = ("INSERT INTO portfolio (portfolio_name, ts_code, qty, cost) VALUES (?, ?, ?, ?) "
+                   "ON CONFLICT(portfolio_name, ts_code) DO UPDATE SET qty = excluded.qty, cost = excluded.cost")
+TRADE_INSERT = "INSERT INTO trades (date, portfolio_name, ts_code, side, price, qty, fee) VALUES (?, ?, ?, ?, ?, ?, ?)"
+# 现金流水超过该条数时折叠为一条 checkpoint（compact_ledger）
+LEDGER_COMPACT_THRESHOLD = 500
+
+
+def _apply_trade(positions: Dict[str, Dict[str, float]], cash: float, side: str, ts_code: str,
+                 price: float, qty: float, fee: float, check_cash: bool = True) -> float:
+    """把一笔交易应用到内存中的持仓（原地修改）并返回新的现金；资金或持仓不足时抛出 ValueError。"""
+    if side == 'buy':
+        cost = price * qty + fee
+        if check_cash and cash < cost:
+            raise ValueError("Not enough cash.")
+        if ts_code in positions:
+            current_qty = positions[ts_code]['qty']
+            current_cost = positions[ts_code]['cost']
+            new_qty = current_qty + qty
+            new_avg_cost = (current_qty * current_cost + price * qty) / new_qty
+            positions[ts_code] = {'qty': new_qty, 'cost': new_avg_cost}
+        else:
+            positions[ts_code] = {'qty': qty, 'cost': price}
+        return cash - cost
+    if side == 'sell':
+        if ts_code not in positions or positions[ts_code]['qty'] < qty:
+            raise ValueError("Not enough shares to sell.")
+        positions[ts_code] = {'qty': positions[ts_code]['qty'] - qty, 'cost': positions[ts_code]['cost']}
+        if positions[ts_code]['qty'] == 0:
+            del positions[ts_code]
+        return cash + price * qty - fee
+    raise ValueError(f"Unknown side: {side}")
+
 
 class PortfolioManager:
+    """
+    单个组合的账户管理。交易（trades）与现金变动（cash_ledger）只追加记录；portfolio 表中的持仓与 CASH 行
+    是其物化结果，每次变动只 upsert 受影响的行，并与流水写入放在同一事务中。
+    """
     def __init__(self, db: Database, portfolio_name: str = 'default'):
         self.db = db
         self.portfolio_name = portfolio_name
@@ -16,15 +57,19 @@ class PortfolioManager:
         return self.cash is not None
 
     def initialize_cash(self, amount: float):
-        self.cash = amount
-        self.save_portfolio()
+        self._record_cash('init', amount)
 
     def reset_portfolio(self):
-        self.db.execute("DELETE FROM trades WHERE portfolio_name = ?", (self.portfolio_name,))
-        self.db.execute("DELETE FROM portfolio WHERE portfolio_name = ?", (self.portfolio_name,))
+        with self.db.transaction():
+            self.db.execute("DELETE FROM trades WHERE portfolio_name = ?", (self.portfolio_name,))
+            self.db.execute("DELETE FROM portfolio WHERE portfolio_name = ?", (self.portfolio_name,))
+            self.db.execute("DELETE FROM cash_ledger WHERE portfolio_name = ?", (self.portfolio_name,))
+            # 快照与滚动风险缓存属于旧组合，不能作为重新初始化后增量刷新的起点
+            self.db.execute("DELETE FROM portfolio_snapshots WHERE portfolio_name = ?", (self.portfolio_name,))
+            self.db.execute("DELETE FROM risk_series WHERE portfolio_name = ?", (self.portfolio_name,))
         self.cash = None
         self.positions = {}
-        print(f"Portfolio '{self.portfolio_name}' has been reset.")
+        events.emit('portfolio_reset', portfolio=self.portfolio_name)
 
     def load_portfolio(self):
         rows = self.db.fetch_all("SELECT ts_code, qty, cost FROM portfolio WHERE portfolio_name = ?", (self.portfolio_name,))
@@ -40,56 +85,152 @@ class PortfolioManager:
             self.cash = None
 
     def save_portfolio(self):
+        """整体重写物化持仓（仅用于 compact_ledger 等整体校正，日常变动走单行 upsert）"""
         if not self.is_initialized():
             return
-        self.db.execute("DELETE FROM portfolio WHERE portfolio_name = ?", (self.portfolio_name,))
-        data_to_insert = [(self.portfolio_name, ts_code, pos['qty'], pos['cost']) for ts_code, pos in self.positions.items()]
-        data_to_insert.append((self.portfolio_name, 'CASH', 1, self.cash))
-        self.db.executemany("INSERT INTO portfolio (portfolio_name, ts_code, qty, cost) VALUES (?, ?, ?, ?)", data_to_insert)
+        with self.db.transaction():
+            self.db.execute("DELETE FROM portfolio WHERE portfolio_name = ?", (self.portfolio_name,))
+            data_to_insert = [(self.portfolio_name, ts_code, pos['qty'], pos['cost']) for ts_code, pos in self.positions.items()]
+            data_to_insert.append((self.portfolio_name, 'CASH', 1, self.cash))
+            self.db.executemany("INSERT INTO portfolio (portfolio_name, ts_code, qty, cost) VALUES (?, ?, ?, ?)", data_to_insert)
 
     def update_cash(self, amount: float):
         if not self.is_initialized():
             raise ValueError("Portfolio not initialized.")
         if self.cash + amount < 0:
             raise ValueError(f"Not enough cash to withdraw.")
-        self.cash += amount
-        self.save_portfolio()
+        self._record_cash('deposit' if amount >= 0 else 'withdraw', amount)
+
+    def _record_cash(self, kind: str, amount: float):
+        """追加一条现金流水并 upsert CASH 行（同一事务），之后从流水日期起增量更新净值快照"""
+        cash = amount if kind == 'init' else self.cash + amount
+        date = datetime.now().strftime('%Y%m%d')
+        with self.db.transaction():
+            self.db.execute("INSERT INTO cash_ledger (portfolio_name, date, kind, amount) VALUES (?, ?, ?, ?)",
+                            (self.portfolio_name, date, kind, amount))
+            self.db.execute(POSITION_UPSERT, (self.portfolio_name, 'CASH', 1, cash))
+        self.cash = cash
+        self._maybe_compact()
+        self.refresh_snapshots(date)
+
+    def _ledger_basis(self) -> Tuple[float, Optional[str], pd.DataFrame]:
+        """
+        快照使用的现金口径：返回 (期初现金, 期初流水日期, 期初之后的入金/出金流水 DataFrame[date, amount])。
+        期初为最近一条 init / checkpoint（重新初始化会覆盖此前的现金），按第一个快照日期计入；
+        没有时（引入现金流水之前的组合）由 CASH 行扣回全部交易与流水的现金流得到，期初日期为 None。
+        """
+        anchor = self.db.fetch_one(
+            "SELECT entry_id, date, amount FROM cash_ledger WHERE portfolio_name = ? AND kind IN ('init', 'checkpoint') "
+            "ORDER BY entry_id DESC LIMIT 1", (self.portfolio_name,))
+        flows = pd.DataFrame(self.db.fetch_all(
+            "SELECT date, amount FROM cash_ledger WHERE portfolio_name = ? AND entry_id > ? "
+            "AND kind IN ('deposit', 'withdraw') ORDER BY date, entry_id",
+            (self.portfolio_name, anchor['entry_id'] if anchor else 0)), columns=['date', 'amount'])
+        if anchor:
+            return float(anchor['amount']), anchor['date'], flows
+        row = self.db.fetch_one(
+            """SELECT (SELECT cost FROM portfolio WHERE portfolio_name = ?1 AND ts_code = 'CASH') AS cash,
+                      (SELECT SUM(CASE WHEN LOWER(side) = 'buy' THEN -price * qty ELSE price * qty END - COALESCE(fee, 0))
+                       FROM trades WHERE portfolio_name = ?1) AS trade_flows""", (self.portfolio_name,))
+        opening = float(row['cash'] or 0) - float(row['trade_flows'] or 0) - float(flows['amount'].sum())
+        return opening, None, flows
 
     def add_trade(self, side: str, ts_code: str, price: float, qty: float, fee: float = 0, date: str = None):
+        self.add_trades([{'date': date, 'ts_code': ts_code, 'side': side, 'price': price, 'qty': qty, 'fee': fee}])
+
+    def add_trades(self, trades: List[Dict[str, Any]]) -> int:
+        """
+        批量记录交易（按日期稳定排序后逐笔校验资金与持仓）。任一笔不合法时抛出 ValueError，不写入任何记录；
+        全部合法时交易流水、受影响的持仓行、CASH 行与自动加入的自选股在同一事务中写入，
+        之后从最早的交易日期起增量更新净值快照。返回写入的笔数。
+        """
         if not self.is_initialized():
             raise ValueError("Portfolio not initialized.")
-        date = date or datetime.now().strftime('%Y%m%d')
-        side = side.lower()
-        if side == 'buy':
-            cost = price * qty + fee
-            if self.cash < cost:
-                raise ValueError("Not enough cash.")
-            self.cash -= cost
-            if ts_code in self.positions:
-                current_qty = self.positions[ts_code]['qty']
-                current_cost = self.positions[ts_code]['cost']
-                new_qty = current_qty + qty
-                new_avg_cost = (current_qty * current_cost + price * qty) / new_qty
-                self.positions[ts_code].update({'qty': new_qty, 'cost': new_avg_cost})
-            else:
-                self.positions[ts_code] = {'qty': qty, 'cost': price}
-            
-            stock_info = self.db.fetch_one("SELECT name FROM stocks WHERE ts_code = ?", (ts_code,))
-            if stock_info:
-                self.db.execute("INSERT OR IGNORE INTO watchlist (ts_code, name, add_date, in_pool) VALUES (?, ?, ?, ?)", 
-                                (ts_code, stock_info['name'], datetime.now().strftime('%Y-%m-%d'), 0))
-                print(f"已自动将 {ts_code} 添加到自选股列表。")
-
-        elif side == 'sell':
-            if ts_code not in self.positions or self.positions[ts_code]['qty'] < qty:
-                raise ValueError("Not enough shares to sell.")
-            revenue = price * qty - fee
-            self.cash += revenue
-            self.positions[ts_code]['qty'] -= qty
-            if self.positions[ts_code]['qty'] == 0:
-                del self.positions[ts_code]
-        self.db.execute("INSERT INTO trades (date, portfolio_name, ts_code, side, price, qty, fee) VALUES (?, ?, ?, ?, ?, ?, ?)", (date, self.portfolio_name, ts_code, side, price, qty, fee))
-        self.save_portfolio()
+        today = datetime.now().strftime('%Y%m%d')
+        rows = sorted(({'date': t.get('date') or today, 'ts_code': t['ts_code'], 'side': str(t['side']).lower(),
+                        'price': float(t['price']), 'qty': float(t['qty']), 'fee': float(t.get('fee') or 0)}
+                       for t in trades), key=lambda t: t['date'])
+        if not rows:
+            return 0
+
+        positions = dict(self.positions)
+        cash = self.cash
+        for i, t in enumerate(rows):
+            if t['price'] <= 0 or t['qty'] <= 0 or t['fee'] < 0:
+                raise ValueError(f"第 {i + 1} 笔交易 ({t['date']} {t['ts_code']} {t['side']}) 价格/数量/费用不合法。")
+            try:
+                cash = _apply_trade(positions, cash, t['side'], t['ts_code'], t['price'], t['qty'], t['fee'])
+            except ValueError as e:
+                raise ValueError(f"第 {i + 1} 笔交易 ({t['date']} {t['ts_code']} {t['side']}): {e}") from e
+
+        touched = {t['ts_code'] for t in rows}
+        bought = sorted({t['ts_code'] for t in rows if t['side'] == 'buy'})
+        names = []
+        if bought:
+            placeholders = ','.join('?' for _ in bought)
+            names = self.db.fetch_all(f"SELECT ts_code, name FROM stocks WHERE ts_code IN ({placeholders})", tuple(bought))
+        with self.db.transaction():
+            self.db.executemany(TRADE_INSERT, [(t['date'], self.portfolio_name, t['ts_code'], t['side'], t['price'],
+                                                t['qty'], t['fee']) for t in rows])
+            closed = [code for code in touched if code not in positions]
+            if closed:
+                placeholders = ','.join('?' for _ in closed)
+                self.db.execute(f"DELETE FROM portfolio WHERE portfolio_name = ? AND ts_code IN ({placeholders})",
+                                (self.portfolio_name, *closed))
+            self.db.executemany(POSITION_UPSERT,
+                                [(self.portfolio_name, code, positions[code]['qty'], positions[code]['cost'])
+                                 for code in touched if code in positions]
+                                + [(self.portfolio_name, 'CASH', 1, cash)])
+            if names:
+                self.db.executemany("INSERT OR IGNORE INTO watchlist (ts_code, name, add_date, in_pool) VALUES (?, ?, ?, ?)",
+                                    [(r['ts_code'], r['name'], datetime.now().strftime('%Y-%m-%d'), 0) for r in names])
+        self.positions, self.cash = positions, cash
+        for r in names:
+            events.emit('watchlist_auto_add', portfolio=self.portfolio_name, ts_code=r['ts_code'])
+        # 净值快照从最早一笔交易的日期起增量更新
+        self.refresh_snapshots(rows[0]['date'])
+        return len(rows)
+
+    def compact_ledger(self) -> Dict[str, Any]:
+        """
+        压缩现金流水并校正物化持仓（同一事务）：
+        - 现金流水折叠为一条 checkpoint（期初现金；没有流水的旧组合以 CASH 行扣回交易与流水的现金流补记）
+          加上每个日期一条入金/出金净额，保留快照所需的现金变动日期
+        - 持仓与 CASH 行按 checkpoint、入金/出金与全部交易重放后整体重写
+        返回 {'folded': 折叠的流水条数, 'cash': 重放得到的现金, 'positions': 持仓数}
+        """
+        trades = self.db.fetch_all("SELECT date, ts_code, side, price, qty, fee FROM trades WHERE portfolio_name = ? "
+                                   "ORDER BY date, trade_id", (self.portfolio_name,))
+        folded = self.db.fetch_one("SELECT COUNT(*) AS n FROM cash_ledger WHERE portfolio_name = ?", (self.portfolio_name,))['n']
+        if not folded and not self.is_initialized():
+            return {'folded': 0, 'cash': None, 'positions': 0}
+        opening, first, flows = self._ledger_basis()
+        first = first or (trades[0]['date'] if trades else datetime.now().strftime('%Y%m%d'))
+        net = flows.groupby('date')['amount'].sum()
+        net = net[net.abs() > 1e-9]
+
+        positions: Dict[str, Dict[str, float]] = {}
+        cash = opening + float(net.sum())
+        for t in trades:
+            # 重放不做资金校验：历史流水已被接受（当时的入金顺序未必早于买入）
+            cash = _apply_trade(positions, cash, t['side'], t['ts_code'], t['price'], t['qty'], t['fee'] or 0,
+                                check_cash=False)
+        with self.db.transaction():
+            self.db.execute("DELETE FROM cash_ledger WHERE portfolio_name = ?", (self.portfolio_name,))
+            self.db.execute("INSERT INTO cash_ledger (portfolio_name, date, kind, amount) VALUES (?, ?, 'checkpoint', ?)",
+                            (self.portfolio_name, first, opening))
+            self.db.executemany("INSERT INTO cash_ledger (portfolio_name, date, kind, amount) VALUES (?, ?, ?, ?)",
+                                [(self.portfolio_name, d, 'deposit' if a > 0 else 'withdraw', float(a)) for d, a in net.items()])
+            self.positions, self.cash = positions, cash
+            self.save_portfolio()
+        return {'folded': int(folded), 'cash': cash, 'positions': len(positions)}
+
+    def _maybe_compact(self):
+        # 已是每日一条净额时再压缩没有意义
+        row = self.db.fetch_one("SELECT COUNT(*) AS n, COUNT(DISTINCT date) AS days FROM cash_ledger WHERE portfolio_name = ?",
+                                (self.portfolio_name,))
+        if row['n'] > LEDGER_COMPACT_THRESHOLD and row['n'] > row['days'] + 1:
+            self.compact_ledger()
 
     def get_trade_history(self, ts_code: str = None, start_date: str = None, end_date: str = None) -> List[Dict[str, Any]]:
         query = "SELECT * FROM trades WHERE portfolio_name = ?"
@@ -100,94 +241,154 @@ class PortfolioManager:
         query += " ORDER BY date DESC"
         return self.db.fetch_all(query, tuple(params))
 
+    @timed('rebuild_snapshots')
     def rebuild_snapshots(self, start_date: Optional[str] = None, end_date: Optional[str] = None) -> int:
         """
-        根据交易记录与行情数据，重建每日组合净值快照。
-        近似实现：
-        - 现金：初始现金 + 卖出收入 - 买入支出（按交易日计）
-        - 持仓：根据交易日逐步调整持仓数量
-        - 市值：使用对应日期的收盘价估算
+        根据交易记录与行情数据，重建每日组合净值快照（按矩阵运算一次算出整段区间）：
+        - 持仓：日期 × 标的的带符号数量变动矩阵按列累加（cumsum）
+        - 现金：期初现金（现金流水中最近的 init / checkpoint）加上每日现金流（卖出收入 - 买入支出 - 费用，
+          以及现金流水中按日期记录的入金/出金）的累计和
+        - 市值：持仓矩阵与前向填充后的收盘价矩阵逐行点积；停牌（当日无K线）的标的按最近收盘价估值
+        交易与入金/出金日期不是快照日期（非交易日、或早于 start_date）时，计入其后的第一个快照日期。
         返回写入的天数
         """
-        trades = self.db.fetch_all("SELECT date, ts_code, side, price, qty, fee FROM trades WHERE portfolio_name = ? ORDER BY date", (self.portfolio_name,))
+        with span('load_trades') as sp:
+            trades = self.db.fetch_all("SELECT date, ts_code, side, price, qty, fee FROM trades WHERE portfolio_name = ? ORDER BY date", (self.portfolio_name,))
+            sp.add(rows=len(trades))
         if not trades:
             return 0
 
-        # 边界日期
-        all_dates = sorted(list({t['date'] for t in trades}))
-        s_date = start_date or all_dates[0]
+        s_date = start_date or trades[0]['date']
         e_date = end_date or datetime.now().strftime('%Y%m%d')
 
-        # 初始现金
-        initial_cash = 0.0
-        row = self.db.fetch_one("SELECT cost FROM portfolio WHERE portfolio_name = ? AND ts_code = 'CASH'", (self.portfolio_name,))
-        if row:
-            initial_cash = float(row['cost'] or 0)
+        opening, _, ledger_flows = self._ledger_basis()
+        snapshots = self._compute_snapshots(pd.DataFrame(trades), opening, s_date, e_date, ledger_flows=ledger_flows)
+        return self._save_snapshots(snapshots)
 
-        # 收集涉及的股票与价格数据
-        tickers = sorted(list({t['ts_code'] for t in trades}))
-        if not tickers:
-            return 0
+    def refresh_snapshots(self, since: str, end_date: Optional[str] = None) -> int:
+        """
+        增量维护快照：从受影响的最早日期 since（交易、入金/出金或行情的日期）起重算。以 since 之前最近一个已存快照的现金、
+        以及截至该日的累计持仓（由交易汇总）为起点，只重放其后的交易、入金/出金与行情；没有更早的快照时全量重建。
+        返回写入的天数
+        """
+        prev = self.db.fetch_one(
+            "SELECT date, cash FROM portfolio_snapshots WHERE portfolio_name = ? AND date < ? ORDER BY date DESC LIMIT 1",
+            (self.portfolio_name, since))
+        if not prev:
+            return self.rebuild_snapshots(end_date=end_date)
+        with span('refresh_snapshots', since=since):
+            held = self.db.fetch_all(
+                "SELECT ts_code, SUM(CASE WHEN side = 'buy' THEN qty ELSE -qty END) AS qty FROM trades "
+                "WHERE portfolio_name = ? AND date <= ? GROUP BY ts_code", (self.portfolio_name, prev['date']))
+            trades = self.db.fetch_all(
+                "SELECT date, ts_code, side, price, qty, fee FROM trades WHERE portfolio_name = ? AND date > ? ORDER BY date",
+                (self.portfolio_name, prev['date']))
+            _, _, ledger_flows = self._ledger_basis()
+            s_date = (datetime.strptime(prev['date'], '%Y%m%d') + timedelta(days=1)).strftime('%Y%m%d')
+            e_date = end_date or datetime.now().strftime('%Y%m%d')
+            snapshots = self._compute_snapshots(pd.DataFrame(trades), float(prev['cash']), s_date, e_date,
+                                                {r['ts_code']: r['qty'] for r in held},
+                                                ledger_flows[ledger_flows['date'] > prev['date']])
+            return self._save_snapshots(snapshots)
+
+    @staticmethod
+    def _cash_flows(trades_df: pd.DataFrame) -> np.ndarray:
+        """每笔交易的现金流（买入为负、卖出为正，均已扣除费用）"""
+        sign = np.where(trades_df['side'].str.lower().to_numpy() == 'buy', 1.0, -1.0)
+        return (-sign * trades_df['qty'].to_numpy(dtype=float) * trades_df['price'].to_numpy(dtype=float)
+                - trades_df['fee'].fillna(0).to_numpy(dtype=float))
+
+    def _load_close_panel(self, tickers: List[str], s_date: str, e_date: str) -> pd.DataFrame:
+        """
+        区间内的收盘价矩阵（日期 × 标的，已前向填充）。第一行之前缺失的价格用 s_date 之前最近一根K线补齐，
+        使区间开始时已停牌的持仓也按最近收盘价估值。
+        """
         placeholders = ','.join('?' for _ in tickers)
-        price_rows = self.db.fetch_all(
-            f"SELECT ts_code, date, close FROM daily_price WHERE ts_code IN ({placeholders}) AND date BETWEEN ? AND ?",
-            tuple(tickers) + (s_date, e_date)
-        )
+        with span('load_prices', tickers=len(tickers)) as sp:
+            price_rows = self.db.fetch_all(
+                f"SELECT ts_code, date, close FROM daily_price WHERE ts_code IN ({placeholders}) AND date BETWEEN ? AND ?",
+                tuple(tickers) + (s_date, e_date)
+            )
+            seed_rows = self.db.fetch_all(
+                f"""SELECT p.ts_code, p.close FROM daily_price p
+                    JOIN (SELECT ts_code, MAX(date) AS max_date FROM daily_price
+                          WHERE ts_code IN ({placeholders}) AND date < ? GROUP BY ts_code) AS prev
+                    ON p.ts_code = prev.ts_code AND p.date = prev.max_date""",
+                tuple(tickers) + (s_date,)
+            )
+            sp.add(rows=len(price_rows) + len(seed_rows))
         if not price_rows:
-            return 0
-        prices_df = pd.DataFrame(price_rows)
-        prices_df['date'] = pd.to_datetime(prices_df['date'])
-        prices_pivot = prices_df.pivot_table(index='date', columns='ts_code', values='close').sort_index()
-
-        # 生成每日日期索引（交易日集合）
-        dates = prices_pivot.index
-
-        # 累计持仓 & 现金
-        pos = defaultdict(float)
-        cash = initial_cash
-        trade_idx = 0
-        trades_df = pd.DataFrame(trades)
-        trades_df['date'] = pd.to_datetime(trades_df['date'])
-        trades_df = trades_df.sort_values('date')
-
-        snapshots = []
-        for current_date in dates:
-            # 应用当前日期的所有交易
-            today_trades = trades_df[trades_df['date'] == current_date]
-            for _, tr in today_trades.iterrows():
-                if tr['side'] == 'buy':
-                    cash -= tr['price'] * tr['qty'] + (tr['fee'] or 0)
-                    pos[tr['ts_code']] += tr['qty']
-                else:
-                    cash += tr['price'] * tr['qty'] - (tr['fee'] or 0)
-                    pos[tr['ts_code']] -= tr['qty']
-                    if abs(pos[tr['ts_code']]) < 1e-9:
-                        pos[tr['ts_code']] = 0.0
-
-            # 估算市值
-            row_prices = prices_pivot.loc[current_date]
-            investment_value = 0.0
-            for code, qty in pos.items():
-                if qty == 0:
-                    continue
-                px = row_prices.get(code)
-                if pd.notna(px):
-                    investment_value += qty * float(px)
-
-            total_value = cash + investment_value
-            snapshots.append({
-                'portfolio_name': self.portfolio_name,
-                'date': current_date.strftime('%Y%m%d'),
-                'total_value': total_value,
-                'cash': cash,
-                'investment_value': investment_value,
-            })
+            return pd.DataFrame()
+        with span('dataframe'):
+            prices_df = pd.DataFrame(price_rows)
+            prices_df['date'] = pd.to_datetime(prices_df['date'])
+            closes = prices_df.pivot_table(index='date', columns='ts_code', values='close').sort_index()
+            closes = closes.reindex(columns=tickers)
+            if seed_rows:
+                seed = pd.Series({r['ts_code']: r['close'] for r in seed_rows}, dtype=float)
+                closes.iloc[0] = closes.iloc[0].fillna(seed.reindex(tickers))
+            return closes.ffill()
 
-        # 落库（幂等 upsert）
-        self.db.executemany(
-            "INSERT OR REPLACE INTO portfolio_snapshots (portfolio_name, date, total_value, cash, investment_value) VALUES (?, ?, ?, ?, ?)",
-            [(s['portfolio_name'], s['date'], s['total_value'], s['cash'], s['investment_value']) for s in snapshots]
-        )
+    def _compute_snapshots(self, trades_df: pd.DataFrame, initial_cash: float, s_date: str, e_date: str,
+                           initial_positions: Optional[Dict[str, float]] = None,
+                           ledger_flows: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+        """
+        按矩阵运算计算 [s_date, e_date] 内每个行情日期的快照（列 date / total_value / cash / investment_value）。
+        initial_positions / initial_cash 为 trades_df 之前的持仓与现金；ledger_flows（列 date / amount）为
+        期间的入金/出金。早于第一个快照日期的交易与流水计入第一天。
+        """
+        # 已清仓（数量为 0）的标的也保留为列：快照日期取所有交易过的标的的行情日期，与全量重建一致
+        initial_positions = initial_positions or {}
+        tickers = sorted(set(trades_df['ts_code']) | set(initial_positions)) if not trades_df.empty \
+            else sorted(initial_positions)
+        if not tickers:
+            return pd.DataFrame()
+        closes = self._load_close_panel(tickers, s_date, e_date)
+        if closes.empty:
+            return pd.DataFrame()
+
+        with span('replay', days=len(closes), tickers=len(tickers)):
+            dates = closes.index
+            n_days, n_tickers = len(dates), len(tickers)
+            delta = np.zeros((n_days, n_tickers))
+            cash_flow = np.zeros(n_days)
+            start_pos = np.array([initial_positions.get(code, 0.0) for code in tickers])
+            delta[0] = start_pos
+            if not trades_df.empty:
+                trade_dates = pd.to_datetime(trades_df['date'])
+                # 每笔交易计入不早于其日期的第一个快照日期；晚于区间末尾的交易不计入
+                rows = dates.searchsorted(trade_dates, side='left')
+                in_range = rows < n_days
+                sign = np.where(trades_df['side'].str.lower().to_numpy() == 'buy', 1.0, -1.0)
+                qty = trades_df['qty'].to_numpy(dtype=float) * sign
+                flow = self._cash_flows(trades_df)
+                cols = pd.Index(tickers).get_indexer(trades_df['ts_code'])
+                np.add.at(delta, (rows[in_range], cols[in_range]), qty[in_range])
+                cash_flow += np.bincount(rows[in_range], weights=flow[in_range], minlength=n_days)
+            if ledger_flows is not None and not ledger_flows.empty:
+                rows = dates.searchsorted(pd.to_datetime(ledger_flows['date']), side='left')
+                in_range = rows < n_days
+                cash_flow += np.bincount(rows[in_range], weights=ledger_flows['amount'].to_numpy(dtype=float)[in_range],
+                                         minlength=n_days)
+            positions = np.cumsum(delta, axis=0)
+            positions[np.abs(positions) < 1e-9] = 0.0
+            cash = initial_cash + np.cumsum(cash_flow)
+            # 从未有过行情的标的（上市前等）无法估值，按 0 计
+            investment = np.einsum('ij,ij->i', positions, np.nan_to_num(closes.to_numpy(dtype=float)))
+
+        return pd.DataFrame({'date': dates.strftime('%Y%m%d'), 'total_value': cash + investment,
+                             'cash': cash, 'investment_value': investment})
+
+    def _save_snapshots(self, snapshots: pd.DataFrame) -> int:
+        """幂等 upsert 快照，返回写入的天数"""
+        if snapshots.empty:
+            return 0
+        with span('upsert', rows=len(snapshots)):
+            self.db.executemany(
+                "INSERT OR REPLACE INTO portfolio_snapshots (portfolio_name, date, total_value, cash, investment_value) VALUES (?, ?, ?, ?, ?)",
+                [(self.portfolio_name, d, float(t), float(c), float(i)) for d, t, c, i in
+                 snapshots[['date', 'total_value', 'cash', 'investment_value']].itertuples(index=False)]
+            )
         return len(snapshots)
 
     def get_snapshots(self) -> pd.DataFrame:
@@ -204,53 +405,94 @@ class PortfolioManager:
     def generate_portfolio_report(self) -> Dict[str, Any]:
         if not self.is_initialized():
             return {'portfolio_name': self.portfolio_name, 'cash': 0, 'positions': [], 'summary': {'total_value': 0, 'position_count': 0, 'investment_value': 0}}
+        return _build_reports({self.portfolio_name: (self.cash, self.positions)}, _latest_market_data(self.db, list(self.positions)))[self.portfolio_name]
+
+
+def _latest_market_data(db: Database, ts_codes: List[str]) -> Dict[str, Dict[str, Any]]:
+    """一批标的的名称与最新收盘价：一次 latest_quote 查询加一次名称查询；无行情的标的现价为 None。"""
+    if not ts_codes:
+        return {}
+    codes = sorted(set(ts_codes))
+    quotes = get_latest_quotes(db, codes)
+    placeholders = ','.join('?' for _ in codes)
+    names = {r['ts_code']: r['name'] for r in db.fetch_all(f"SELECT ts_code, name FROM stocks WHERE ts_code IN ({placeholders})", tuple(codes))}
+    return {code: {'name': names.get(code, 'N/A'), 'current_price': quotes.get(code, {}).get('close')} for code in codes}
 
-        report = {'portfolio_name': self.portfolio_name, 'cash': self.cash, 'positions': [], 'summary': {}}
-        if not self.positions:
-            report['summary'] = {'total_value': self.cash, 'position_count': 0, 'investment_value': 0}
-            return report
-
-        ts_codes = list(self.positions.keys())
-        placeholders = ','.join('?' for _ in ts_codes)
-        query = f"""SELECT p.ts_code, s.name, p.close as current_price
-                   FROM daily_price p
-                   JOIN (
-                       SELECT ts_code, MAX(date) as max_date 
-                       FROM daily_price 
-                       WHERE ts_code IN ({placeholders}) 
-                       GROUP BY ts_code
-                   ) AS latest ON p.ts_code = latest.ts_code AND p.date = latest.max_date
-                   LEFT JOIN stocks s ON p.ts_code = s.ts_code"""
-        
-        market_data_rows = self.db.fetch_all(query, tuple(ts_codes))
-        market_data = {row['ts_code']: {'name': row['name'], 'current_price': row['current_price']} for row in market_data_rows}
 
+def _build_reports(states: Dict[str, tuple], market_data: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """按 {组合名: (现金, 持仓)} 与行情生成报告，格式同 generate_portfolio_report。"""
+    reports = {}
+    for name, (cash, positions) in states.items():
+        report = {'portfolio_name': name, 'cash': cash, 'positions': [], 'summary': {}}
         total_investment_value = 0
-        for ts_code, pos in self.positions.items():
+        for ts_code, pos in positions.items():
             qty = pos['qty']
-            market_info = market_data.get(ts_code)
-            
-            if market_info:
-                current_price = market_info.get('current_price') if market_info.get('current_price') is not None else 0
-                name = market_info.get('name', 'N/A')
-            else:
-                current_price = 0
-                stock_details = self.db.fetch_one("SELECT name FROM stocks WHERE ts_code = ?", (ts_code,))
-                name = stock_details['name'] if stock_details else 'N/A'
-            
+            market_info = market_data.get(ts_code, {})
+            current_price = market_info.get('current_price') or 0
             market_value = qty * current_price
             total_investment_value += market_value
-            
             report['positions'].append({
-                'ts_code': ts_code, 
-                'name': name, 
-                'qty': qty, 
-                'cost_price': pos['cost'], 
-                'current_price': current_price, 
-                'market_value': market_value, 
+                'ts_code': ts_code,
+                'name': market_info.get('name', 'N/A'),
+                'qty': qty,
+                'cost_price': pos['cost'],
+                'current_price': current_price,
+                'market_value': market_value,
                 'pnl': (current_price - pos['cost']) * qty if current_price > 0 else 0
             })
+        report['summary'] = {'total_value': cash + total_investment_value, 'investment_value': total_investment_value,
+                             'position_count': len(positions)}
+        reports[name] = report
+    return reports
+
+
+@timed('generate_reports')
+def generate_reports(db: Database, portfolio_names: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    一次估值多个组合（默认全部已初始化的组合）：一次读取各组合的持仓与现金，
+    对所有持仓标的的并集做一次最新价查询和一次名称查询。返回 {组合名: 报告}，报告格式同 generate_portfolio_report。
+    """
+    query = "SELECT portfolio_name, ts_code, qty, cost FROM portfolio"
+    params: tuple = ()
+    if portfolio_names is not None:
+        if not portfolio_names:
+            return {}
+        query += f" WHERE portfolio_name IN ({','.join('?' for _ in portfolio_names)})"
+        params = tuple(portfolio_names)
+    with span('load_portfolios') as sp:
+        rows = db.fetch_all(query, params)
+        sp.add(rows=len(rows))
+    cash: Dict[str, float] = {}
+    positions: Dict[str, Dict[str, Dict[str, float]]] = {}
+    for row in rows:
+        if row['ts_code'] == 'CASH':
+            cash[row['portfolio_name']] = row['cost']
+        else:
+            positions.setdefault(row['portfolio_name'], {})[row['ts_code']] = {'qty': row['qty'], 'cost': row['cost']}
+    # 没有 CASH 行的组合视为未初始化，不参与估值
+    states = {name: (cash[name], positions.get(name, {})) for name in sorted(cash)}
+    with span('market_data'):
+        market_data = _latest_market_data(db, [code for _, pos in states.values() for code in pos])
+    return _build_reports(states, market_data)
+
+
+def refresh_snapshots_for_prices(db: Database, changed: Dict[str, str]) -> Dict[str, int]:
+    """
+    行情入库后的快照增量维护。changed 为 {ts_code: 本次写入的最早日期}；对交易过这些标的、且已有快照的组合，
+    从其涉及标的的最早变动日期起调用 refresh_snapshots。返回 {组合名: 写入天数}。
+    """
+    if not changed:
+        return {}
+    codes = list(changed)
+    placeholders = ','.join('?' for _ in codes)
+    rows = db.fetch_all(
+        f"""SELECT DISTINCT t.portfolio_name, t.ts_code FROM trades t
+            WHERE t.ts_code IN ({placeholders})
+              AND EXISTS (SELECT 1 FROM portfolio_snapshots s WHERE s.portfolio_name = t.portfolio_name)""",
+        tuple(codes))
+    since: Dict[str, str] = {}
+    for row in rows:
+        date = changed[row['ts_code']]
+        since[row['portfolio_name']] = min(since.get(row['portfolio_name'], date), date)
+    return {name: PortfolioManager(db, name).refresh_snapshots(date) for name, date in since.items()}
 
-        total_portfolio_value = self.cash + total_investment_value
-        report['summary'] = {'total_value': total_portfolio_value, 'investment_value': total_investment_value, 'position_count': len(self.positions)}
-        return report
@@ -3,6 +3,10 @@ import numpy as np
 from scipy.stats import norm
 from typing import List, Dict, Any
 from portfolio.manager import PortfolioManager
+from risk.position_risk import position_var, risk_inputs, DEFAULT_WINDOW
+from risk import monte_carlo
+from risk.rolling import rolling_risk, DEFAULT_BENCHMARK, DEFAULT_WINDOW as ROLLING_WINDOW
+from utils.timing import timed, span
 from config.settings import get_settings
 import logging
 
@@ -46,10 +50,51 @@ class RiskAnalyzer:
         df = pd.DataFrame(trade_history)
         df['date'] = pd.to_datetime(df['date'])
         df = df.set_index('date')
-        daily_pnl = df.apply(lambda row: row['qty'] * row['price'] if row['side'] == 'sell' else -row['qty'] * row['price'], axis=1)
+        daily_pnl = pd.Series(np.where(df['side'] == 'sell', 1.0, -1.0) * df['qty'] * df['price'], index=df.index)
         base = self.pm.cash if self.pm.cash and self.pm.cash != 0 else abs(daily_pnl).mean() or 1.0
         return (daily_pnl / base)
 
+    def position_risk(self, window: int = DEFAULT_WINDOW, report: Dict[str, Any] | None = None) -> Dict[str, Any]:
+        """
+        基于当前持仓的一日 VaR/CVaR（历史模拟法与收缩协方差参数法，见 risk/position_risk.py）。
+        收益率面板与协方差按 (持仓标的, 窗口, 最新行情日期) 缓存，仅调整持仓数量时无需重新取数。
+        """
+        report = report or self.pm.generate_portfolio_report()
+        holdings = {p['ts_code']: p['market_value'] for p in report['positions']}
+        return position_var(self.pm.db, holdings, report['summary'].get('total_value', 0), window=window)
+
+    @timed('monte_carlo_risk')
+    def monte_carlo_risk(self, horizons=monte_carlo.DEFAULT_HORIZONS, n_paths: int = monte_carlo.DEFAULT_PATHS,
+                         method: str = 'cholesky', block: int = 5, seed: int = 0, window: int = DEFAULT_WINDOW,
+                         chunk_size: int = monte_carlo.DEFAULT_CHUNK, report: Dict[str, Any] | None = None) -> Dict[str, Any]:
+        """
+        当前持仓在多个持有期上的蒙特卡洛盈亏与最大回撤分布（见 risk/monte_carlo.py）。
+        cholesky 使用持仓层面风险缓存的收缩协方差与均值，bootstrap 按块重抽同一收益率面板；现金视为无风险。
+        """
+        report = report or self.pm.generate_portfolio_report()
+        holdings = {p['ts_code']: p['market_value'] for p in report['positions'] if p['market_value']}
+        if not holdings:
+            return {'horizons': {}, 'n_paths': 0, 'method': method, 'seed': seed, 'chunk_size': chunk_size}
+        inputs = risk_inputs(self.pm.db, list(holdings), window)
+        returns = inputs['returns']
+        values = np.array([holdings[code] for code in returns.columns], dtype=float)
+        with span('simulate', paths=n_paths, tickers=len(values)):
+            result = monte_carlo.simulate(values, float(report.get('cash', 0)), method=method, cov=inputs['cov'],
+                                          mean=inputs['mean'], history=returns.to_numpy(dtype=float),
+                                          horizons=horizons, n_paths=n_paths, block=block, seed=seed,
+                                          chunk_size=chunk_size)
+        result.update(window=len(returns), asof=inputs['asof'], total_value=report['summary'].get('total_value', 0))
+        return result
+
+    @timed('rolling_risk')
+    def rolling_risk(self, benchmark: str = DEFAULT_BENCHMARK, window: int = ROLLING_WINDOW) -> pd.DataFrame:
+        """
+        基于组合净值快照的滚动风险序列：波动率、历史 VaR、回撤与水下天数、相对 benchmark 的 Beta、夏普比率
+        （见 risk/rolling.py）。结果缓存在 risk_series 表，只计算新增或被改写的快照日期。
+        """
+        return rolling_risk(self.pm.db, self.pm.portfolio_name, benchmark, window)
+
+    @timed('analyze_portfolio_risk')
     def analyze_portfolio_risk(self) -> Dict[str, Any]:
         """分析投资组合风险"""
         report = self.pm.generate_portfolio_report()
@@ -105,5 +150,6 @@ class RiskAnalyzer:
             'var_99': var_99,
             'cvar_95': cvar_95,
             'hhi': hhi * 10000, # HHI 指数通常乘以 10000
-            'violations': violations
+            'violations': violations,
+            'position_risk': self.position_risk(report=report),
         }
@@ -0,0 +1,113 @@
+"""
+持仓的蒙特卡洛风险模拟：按日模拟各持仓的收益路径，统计若干持有期的盈亏分布（VaR / CVaR）与路径最大回撤分布。
+
+- cholesky：多元正态收益 r = μ + zLᵀ，L 为（收缩）协方差的 Cholesky 因子
+- bootstrap：按块重抽历史收益率面板的整行（保留同日各标的间的相关性与块内的自相关）
+
+模拟按路径分块进行，每块只保留 (块内路径数 × 标的数) 的状态矩阵，内存与总路径数无关；
+每块使用由 (seed, 块序号) 派生的独立随机数流，同样的 seed 与 chunk_size 得到完全相同的结果。
+"""
+from typing import Dict, Any, Sequence
+
+import numpy as np
+
+DEFAULT_HORIZONS = (1, 5, 20)
+DEFAULT_PATHS = 100_000
+DEFAULT_CHUNK = 20_000
+# 正态抽样的单日收益下限（价格不能为负）
+MIN_DAILY_RETURN = -0.99
+
+
+def _chunk_paths(rng: np.random.Generator, n: int, values: np.ndarray, cash: float, horizon: int,
+                 method: str, mean: np.ndarray, chol: np.ndarray | None, history: np.ndarray | None,
+                 block: int, record_at: Sequence[int]):
+    total0 = cash + values.sum()
+    growth = np.ones((n, len(values)))
+    peak = np.full(n, total0)
+    mdd = np.zeros(n)
+    pnl, drawdown = {}, {}
+    starts = None
+    for t in range(1, horizon + 1):
+        if method == 'cholesky':
+            r = mean + rng.standard_normal((n, len(values))) @ chol.T
+            np.maximum(r, MIN_DAILY_RETURN, out=r)
+        else:
+            offset = (t - 1) % block
+            if offset == 0:
+                starts = rng.integers(0, len(history) - block + 1, n)
+            r = history[starts + offset]
+        growth *= 1 + r
+        value = cash + growth @ values
+        np.maximum(peak, value, out=peak)
+        np.maximum(mdd, 1 - value / peak, out=mdd)
+        if t in record_at:
+            pnl[t] = value - total0
+            drawdown[t] = mdd.copy()
+    return pnl, drawdown
+
+
+def simulate(values: np.ndarray, cash: float, method: str = 'cholesky', cov: np.ndarray | None = None,
+             mean: np.ndarray | None = None, history: np.ndarray | None = None,
+             horizons: Sequence[int] = DEFAULT_HORIZONS, n_paths: int = DEFAULT_PATHS, block: int = 5,
+             seed: int = 0, chunk_size: int = DEFAULT_CHUNK, confidence_levels=(0.95, 0.99)) -> Dict[str, Any]:
+    """
+    模拟持仓市值 values（与 cov / history 的列顺序一致）加现金 cash 的组合在各持有期的盈亏。
+    method='cholesky' 需要 cov（可选 mean），method='bootstrap' 需要历史收益率矩阵 history（T × N）。
+    返回 {'horizons': {h: {'var': {level: 金额}, 'cvar': {...}, 'var_pct', 'cvar_pct',
+                            'pnl_quantiles': {q: 金额}, 'max_drawdown': {'mean', 'p50', 'p95', 'p99'},
+                            'histogram': (counts, edges)}},
+          'n_paths', 'method', 'seed', 'chunk_size'}
+    """
+    values = np.asarray(values, dtype=float)
+    horizons = sorted({int(h) for h in horizons if int(h) > 0})
+    if not horizons or values.size == 0:
+        return {'horizons': {}, 'n_paths': 0, 'method': method, 'seed': seed, 'chunk_size': chunk_size}
+    n_assets = len(values)
+    chol = None
+    if method == 'cholesky':
+        if cov is None:
+            raise ValueError("cholesky 模拟需要协方差矩阵")
+        # 数值上半正定的协方差加微小对角扰动后分解
+        jitter = 1e-12 * max(np.trace(cov) / n_assets, 1e-12)
+        chol = np.linalg.cholesky(cov + jitter * np.eye(n_assets))
+        mean = np.zeros(n_assets) if mean is None else np.asarray(mean, dtype=float)
+    elif method == 'bootstrap':
+        if history is None or len(history) == 0:
+            raise ValueError("bootstrap 模拟需要历史收益率")
+        history = np.asarray(history, dtype=float)
+        block = max(1, min(int(block), len(history)))
+    else:
+        raise ValueError(f"不支持的模拟方法: {method}")
+
+    total0 = float(cash + values.sum())
+    pnl = {h: [] for h in horizons}
+    drawdown = {h: [] for h in horizons}
+    for k, lo in enumerate(range(0, n_paths, chunk_size)):
+        n = min(chunk_size, n_paths - lo)
+        rng = np.random.default_rng(np.random.SeedSequence([seed, k]))
+        chunk_pnl, chunk_dd = _chunk_paths(rng, n, values, cash, horizons[-1], method, mean, chol, history, block,
+                                           set(horizons))
+        for h in horizons:
+            pnl[h].append(chunk_pnl[h])
+            drawdown[h].append(chunk_dd[h])
+
+    result = {}
+    for h in horizons:
+        p = np.concatenate(pnl[h])
+        dd = np.concatenate(drawdown[h])
+        var, cvar = {}, {}
+        for level in confidence_levels:
+            threshold = np.quantile(p, 1 - level)
+            var[level] = float(-threshold)
+            cvar[level] = float(-p[p <= threshold].mean())
+        counts, edges = np.histogram(p, bins=100)
+        result[h] = {
+            'var': var, 'cvar': cvar,
+            'var_pct': {k: v / total0 * 100 for k, v in var.items()},
+            'cvar_pct': {k: v / total0 * 100 for k, v in cvar.items()},
+            'pnl_quantiles': {q: float(np.quantile(p, q)) for q in (0.01, 0.05, 0.5, 0.95, 0.99)},
+            'max_drawdown': {'mean': float(dd.mean()), 'p50': float(np.quantile(dd, 0.5)),
+                             'p95': float(np.quantile(dd, 0.95)), 'p99': float(np.quantile(dd, 0.99))},
+            'histogram': (counts, edges),
+        }
+    return {'horizons': result, 'n_paths': int(n_paths), 'method': method, 'seed': seed, 'chunk_size': chunk_size}
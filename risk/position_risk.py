@@ -0,0 +1,157 @@
+"""
+持仓层面的风险计算：以当前持仓市值为权重，在持仓标的对齐后的日收益率面板上计算 VaR / CVaR。
+
+- 历史模拟法：收益率面板（窗口 × 标的）与持仓市值向量的矩阵乘积即为每个历史情景下的组合盈亏，
+  取分位数得到 VaR，尾部均值得到 CVaR。
+- 参数法：Ledoit-Wolf 收缩协方差（向单位阵的缩放收缩，窗口短于标的数时依然正定），σ_p = sqrt(vᵀΣv)。
+
+收益率面板与协方差按 (标的集合, 窗口, 截至日期) 缓存在进程内：调整已有持仓的数量后重新计算，
+只需重做一次矩阵乘积；标的集合、窗口或最新行情日期变化时重新构建。
+"""
+import json
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+
+from data.database import Database
+from utils.timing import span
+
+DEFAULT_WINDOW = 250
+# 进程内缓存的 (标的集合, 窗口, 截至日期) 组合数
+CACHE_SIZE = 32
+
+_CACHE: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+
+
+def ledoit_wolf(returns: np.ndarray) -> Tuple[np.ndarray, float]:
+    """
+    Ledoit-Wolf 收缩协方差：Σ = δ·μI + (1-δ)·S，S 为样本协方差（按 1/T），μ 为其平均方差。
+    returns 为 T × N 的收益率矩阵。返回 (Σ, δ)。
+    """
+    t, n = returns.shape
+    x = returns - returns.mean(axis=0)
+    sample = x.T @ x / t
+    mu = np.trace(sample) / n
+    target = mu * np.eye(n)
+    d2 = np.sum((sample - target) ** 2)
+    if t < 2 or d2 <= 0:
+        return target if t >= 1 else np.zeros((n, n)), 1.0
+    # Σ_t ||x_t x_tᵀ - S||²_F = Σ_t ||x_t||⁴ - 2 Σ_t x_tᵀ S x_t + T ||S||²_F
+    row_sq = np.sum(x ** 2, axis=1)
+    b_bar2 = (np.sum(row_sq ** 2) - 2 * np.sum((x @ sample) * x) + t * np.sum(sample ** 2)) / t ** 2
+    shrinkage = float(min(b_bar2, d2) / d2)
+    return shrinkage * target + (1 - shrinkage) * sample, shrinkage
+
+
+def latest_date(db: Database, ts_codes: List[str]) -> str | None:
+    """这些标的在 latest_quote 中的最新行情日期（作为缓存的截至日期）"""
+    row = db.fetch_one("SELECT MAX(date) AS d FROM latest_quote WHERE asset = 'stock' AND ts_code IN "
+                       "(SELECT value FROM json_each(?))", (json.dumps(sorted(ts_codes)),))
+    return row['d'] if row else None
+
+
+def load_return_panel(db: Database, ts_codes: List[str], window: int, asof: str) -> pd.DataFrame:
+    """
+    截至 asof 的最近 window 个交易日的日收益率面板（日期 × 标的）。收盘价先前向填充：
+    停牌日收益为 0；窗口内尚未上市的标的收益记为 0。
+    """
+    codes = sorted(ts_codes)
+    placeholders = ','.join('?' for _ in codes)
+    # 多取一天用于计算第一天的收益率；按交易日历（任一标的有K线的日期）截取
+    dates = db.fetch_all(f"SELECT DISTINCT date FROM daily_price WHERE ts_code IN ({placeholders}) AND date <= ? "
+                         f"ORDER BY date DESC LIMIT ?", tuple(codes) + (asof, window + 1))
+    if len(dates) < 2:
+        return pd.DataFrame(columns=codes, dtype=float)
+    start = dates[-1]['date']
+    with span('load_prices', tickers=len(codes)) as sp:
+        rows = db.fetch_all(f"SELECT ts_code, date, close FROM daily_price WHERE ts_code IN ({placeholders}) "
+                            f"AND date BETWEEN ? AND ?", tuple(codes) + (start, asof))
+        sp.add(rows=len(rows))
+    prices = pd.DataFrame(rows).pivot(index='date', columns='ts_code', values='close').sort_index()
+    prices = prices.reindex(columns=codes).ffill()
+    returns = prices.pct_change(fill_method=None).iloc[1:].fillna(0.0)
+    returns.index = pd.to_datetime(returns.index)
+    return returns
+
+
+def risk_inputs(db: Database, ts_codes: List[str], window: int = DEFAULT_WINDOW, asof: str | None = None) -> Dict[str, Any]:
+    """
+    持仓标的的收益率面板与收缩协方差（带缓存）：
+    {'returns': DataFrame, 'cov': ndarray, 'mean': ndarray, 'shrinkage': float, 'asof': str, 'cached': bool}
+    """
+    codes = tuple(sorted(set(ts_codes)))
+    asof = asof or latest_date(db, list(codes))
+    key = (codes, int(window), asof)
+    with _CACHE_LOCK:
+        hit = _CACHE.get(key)
+        if hit is not None:
+            _CACHE.move_to_end(key)
+            return {**hit, 'cached': True}
+    with span('risk_inputs', tickers=len(codes)):
+        returns = load_return_panel(db, list(codes), window, asof) if asof else pd.DataFrame(columns=list(codes))
+        values = returns.to_numpy(dtype=float)
+        if len(values):
+            cov, shrinkage = ledoit_wolf(values)
+            mean = values.mean(axis=0)
+        else:
+            cov, shrinkage, mean = np.zeros((len(codes), len(codes))), 1.0, np.zeros(len(codes))
+    entry = {'returns': returns, 'cov': cov, 'mean': mean, 'shrinkage': shrinkage, 'asof': asof}
+    with _CACHE_LOCK:
+        _CACHE[key] = entry
+        while len(_CACHE) > CACHE_SIZE:
+            _CACHE.popitem(last=False)
+    return {**entry, 'cached': False}
+
+
+def _tail_metrics(pnl: np.ndarray, confidence: float) -> Tuple[float, float]:
+    """盈亏情景的 VaR 与 CVaR（均为正数表示损失金额）"""
+    if len(pnl) == 0:
+        return 0.0, 0.0
+    threshold = np.quantile(pnl, 1 - confidence)
+    return float(-threshold), float(-pnl[pnl <= threshold].mean())
+
+
+def position_var(db: Database, holdings: Dict[str, float], total_value: float,
+                 confidence_levels=(0.95, 0.99), window: int = DEFAULT_WINDOW, asof: str | None = None) -> Dict[str, Any]:
+    """
+    持仓层面的一日 VaR / CVaR。holdings 为 {ts_code: 持仓市值}，total_value 为组合总资产（含现金，用于换算百分比）。
+    返回 {'historical': {0.95: {'var', 'cvar', 'var_pct', 'cvar_pct'}, ...}, 'parametric': {...},
+          'window': 实际窗口天数, 'asof', 'shrinkage', 'cached', 'component_var': {ts_code: 参数法 VaR 贡献}}
+    """
+    holdings = {code: value for code, value in holdings.items() if value}
+    if not holdings or total_value <= 0:
+        return {'historical': {}, 'parametric': {}, 'window': 0, 'asof': None, 'shrinkage': None, 'cached': False,
+                'component_var': {}}
+    inputs = risk_inputs(db, list(holdings), window, asof)
+    returns = inputs['returns']
+    v = np.array([holdings[code] for code in returns.columns], dtype=float)
+
+    # 历史模拟：每个历史交易日的收益率作用在当前持仓上的组合盈亏
+    pnl = returns.to_numpy(dtype=float) @ v
+    historical, parametric = {}, {}
+    port_sigma = float(np.sqrt(max(v @ inputs['cov'] @ v, 0.0)))
+    port_mean = float(inputs['mean'] @ v)
+    for level in confidence_levels:
+        var, cvar = _tail_metrics(pnl, level)
+        historical[level] = {'var': var, 'cvar': cvar, 'var_pct': var / total_value * 100,
+                             'cvar_pct': cvar / total_value * 100}
+        z = norm.ppf(level)
+        p_var = float(z * port_sigma - port_mean)
+        p_cvar = float(port_sigma * norm.pdf(z) / (1 - level) - port_mean)
+        parametric[level] = {'var': p_var, 'cvar': p_cvar, 'var_pct': p_var / total_value * 100,
+                             'cvar_pct': p_cvar / total_value * 100}
+
+    # 参数法 VaR 的成分分解（欧拉分配，各成分之和等于组合 VaR 的波动部分）
+    level = confidence_levels[0]
+    if port_sigma > 0:
+        marginal = inputs['cov'] @ v / port_sigma
+        component = dict(zip(returns.columns, (norm.ppf(level) * marginal * v).tolist()))
+    else:
+        component = {code: 0.0 for code in returns.columns}
+    return {'historical': historical, 'parametric': parametric, 'window': len(returns), 'asof': inputs['asof'],
+            'shrinkage': inputs['shrinkage'], 'cached': inputs['cached'], 'component_var': component}
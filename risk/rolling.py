@@ -0,0 +1,132 @@
+"""
+组合风险指标的滚动时间序列：在 portfolio_snapshots 的逐日总资产上一次向量化计算
+滚动波动率、滚动历史 VaR、回撤与水下天数、相对基准指数的滚动 Beta 以及滚动夏普比率。
+
+结果按 (组合, 基准, 窗口) 缓存在 risk_series 表，每行同时记录当日的总资产与基准收盘价：
+再次读取时与快照逐行比对，找到第一处新增或被改写（补录交易、行情修正后快照重算）的日期，
+只从该日期起（带上一个窗口的历史作为上下文）重新计算并写回，之前的行直接复用。
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+
+from backtest.metrics import TRADING_DAYS_PER_YEAR, RISK_FREE_RATE
+from data.database import Database
+from utils.timing import span
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WINDOW = 60
+DEFAULT_BENCHMARK = '000300.SH'
+SERIES_COLUMNS = ['total_value', 'bench_close', 'ret', 'volatility', 'var_95', 'drawdown', 'underwater_days',
+                  'beta', 'sharpe']
+SERIES_INSERT = (f"INSERT OR REPLACE INTO risk_series (portfolio_name, benchmark, window_days, date, "
+                 f"{', '.join(SERIES_COLUMNS)}) VALUES ({', '.join('?' for _ in range(4 + len(SERIES_COLUMNS)))})")
+
+
+def compute_series(values: np.ndarray, bench: np.ndarray, window: int, start: int = 0,
+                   underwater_before: int = 0) -> pd.DataFrame:
+    """
+    计算第 start 行起的滚动指标（values 为逐日总资产，bench 为同日期的基准收盘价，可含 NaN）。
+    只使用 start 之前 window+1 行作为窗口上下文；回撤的前高取 start 之前的最大总资产，
+    水下天数从 underwater_before（第 start-1 行的水下天数）接续。
+    返回按位置索引（start..末行）的 DataFrame，列见 SERIES_COLUMNS；不足一个窗口的行为 NaN。
+    """
+    lo = max(0, start - window - 1)
+    v = pd.Series(values[lo:], dtype=float)
+    b = pd.Series(bench[lo:], dtype=float)
+    ret = v.pct_change(fill_method=None)
+    bench_ret = b.pct_change(fill_method=None)
+    roll = ret.rolling(window, min_periods=window)
+    std = roll.std()
+    rf_daily = (1 + RISK_FREE_RATE) ** (1 / TRADING_DAYS_PER_YEAR) - 1
+    out = pd.DataFrame({
+        'total_value': v,
+        'bench_close': b,
+        'ret': ret,
+        'volatility': std * np.sqrt(TRADING_DAYS_PER_YEAR) * 100,
+        'var_95': -roll.quantile(0.05) * 100,
+        'beta': ret.rolling(window, min_periods=window).cov(bench_ret) / bench_ret.rolling(window, min_periods=window).var(),
+        'sharpe': (roll.mean() - rf_daily) / std.where(std > 0) * np.sqrt(TRADING_DAYS_PER_YEAR),
+    }).iloc[start - lo:]
+    out.index = np.arange(start, len(values))
+
+    tail = out['total_value'].to_numpy()
+    prior_peak = values[:start].max() if start > 0 else -np.inf
+    peaks = np.maximum.accumulate(np.maximum(tail, prior_peak))
+    drawdown = np.where(peaks > 0, (peaks - tail) / peaks * 100, 0.0)
+    # 水下天数：距最近一次不在回撤中的交易日的天数；片段开头的连续水下日从 underwater_before 接续
+    pos = np.arange(len(tail))
+    last_dry = np.maximum.accumulate(np.where(drawdown <= 0, pos, -1))
+    out['drawdown'] = drawdown
+    out['underwater_days'] = np.where(last_dry >= 0, pos - last_dry, pos + 1 + underwater_before)
+    return out[SERIES_COLUMNS]
+
+
+def _benchmark_closes(db: Database, benchmark: str, dates: pd.Index) -> np.ndarray:
+    """基准指数在各快照日期的收盘价（非交易日沿用此前最近的收盘价，之前没有行情时为 NaN）"""
+    rows = db.fetch_all("SELECT date, close FROM index_daily_price WHERE ts_code = ? AND date <= ? ORDER BY date",
+                        (benchmark, dates[-1]))
+    if not rows:
+        return np.full(len(dates), np.nan)
+    closes = pd.DataFrame(rows).set_index('date')['close']
+    return closes.reindex(closes.index.union(dates)).ffill().reindex(dates).to_numpy(dtype=float)
+
+
+def _first_change(cached: pd.DataFrame, dates: pd.Index, values: np.ndarray, bench: np.ndarray) -> int:
+    """缓存与当前快照/基准第一处不一致的行号（缓存是当前数据的前缀时返回缓存行数）"""
+    n = min(len(cached), len(dates))
+    same = ((cached['date'].to_numpy()[:n] == dates.to_numpy()[:n])
+            & np.isclose(cached['total_value'].to_numpy(dtype=float)[:n], values[:n], rtol=1e-12, atol=1e-6)
+            & np.isclose(cached['bench_close'].to_numpy(dtype=float)[:n], bench[:n], rtol=1e-12, atol=1e-6,
+                         equal_nan=True))
+    changed = np.flatnonzero(~same)
+    return int(changed[0]) if len(changed) else n
+
+
+def rolling_risk(db: Database, portfolio_name: str, benchmark: str = DEFAULT_BENCHMARK,
+                 window: int = DEFAULT_WINDOW) -> pd.DataFrame:
+    """
+    组合的滚动风险序列（日期索引），列：
+    total_value, bench_close, ret（日收益率）, volatility（年化波动率 %）, var_95（一日历史 VaR，占总资产 %）,
+    drawdown（回撤 %）, underwater_days（水下交易日数）, beta（相对 benchmark）, sharpe（年化夏普）。
+    只重新计算相对缓存新增或被改写的部分。
+    """
+    key = (portfolio_name, benchmark, int(window))
+    snaps = db.fetch_all("SELECT date, total_value FROM portfolio_snapshots WHERE portfolio_name = ? ORDER BY date",
+                         (portfolio_name,))
+    cached = pd.DataFrame(db.fetch_all(
+        f"SELECT date, {', '.join(SERIES_COLUMNS)} FROM risk_series "
+        f"WHERE portfolio_name = ? AND benchmark = ? AND window_days = ? ORDER BY date", key),
+        columns=['date'] + SERIES_COLUMNS)
+    if not snaps:
+        if len(cached):
+            db.execute("DELETE FROM risk_series WHERE portfolio_name = ? AND benchmark = ? AND window_days = ?", key)
+        return pd.DataFrame(columns=SERIES_COLUMNS, index=pd.DatetimeIndex([], name='date'), dtype=float)
+
+    dates = pd.Index([r['date'] for r in snaps])
+    values = np.array([r['total_value'] for r in snaps], dtype=float)
+    bench = _benchmark_closes(db, benchmark, dates)
+    start = _first_change(cached, dates, values, bench)
+    kept = cached.iloc[:start]
+    with span('compute', rows=len(dates) - start, cached=start):
+        if start < len(dates) or start < len(cached):
+            fresh = compute_series(values, bench, int(window), start,
+                                   int(kept['underwater_days'].iloc[-1]) if start > 0 else 0)
+            fresh.insert(0, 'date', dates[start:])
+            rows = [key + (r[0],) + tuple(None if pd.isna(x) else float(x) for x in r[1:7])
+                    + (int(r[7]),) + tuple(None if pd.isna(x) else float(x) for x in r[8:])
+                    for r in fresh.itertuples(index=False)]
+            with db.transaction():
+                if start < len(cached):
+                    db.execute("DELETE FROM risk_series WHERE portfolio_name = ? AND benchmark = ? "
+                               "AND window_days = ? AND date >= ?", key + (cached['date'].iloc[start],))
+                db.executemany(SERIES_INSERT, rows)
+            logger.debug("risk_series %s: reused %d rows, recomputed %d", key, start, len(fresh))
+            series = pd.concat([kept, fresh], ignore_index=True) if start > 0 else fresh
+        else:
+            series = cached
+    series = series.set_index(pd.to_datetime(series['date'])).drop(columns='date')
+    series.index.name = 'date'
+    return series.astype({c: float for c in SERIES_COLUMNS if c != 'underwater_days'}).astype({'underwater_days': int})
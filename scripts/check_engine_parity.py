@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+对比 Backtrader 引擎与向量化引擎的回测结果（逐日净值、订单、已平仓交易、指标）。
+使用固定随机种子生成的合成行情（含停牌缺口），不依赖本地数据库。
+
+用法: python scripts/check_engine_parity.py [--tickers 15] [--days 700] [--seed 1]
+任一策略出现差异时以非零状态码退出。
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from backtest.engine import run_cerebro, daily_values, daily_cash, trade_counts  # noqa: E402
+from backtest.metrics import compute_metrics, values_from_returns  # noqa: E402
+from backtest.vectorized import run_vectorized  # noqa: E402
+from data.database import Database  # noqa: E402
+from strategies.manager import StrategyManager  # noqa: E402
+
+TOLERANCE = 1e-6
+
+
+def synthetic_price_data(n_tickers: int, days: int, seed: int) -> dict:
+    """生成带趋势切换与停牌缺口的合成日线行情。
+    每三只中有一只为低价、周期性急跌后快速修复的标的，用于触发周线 MACD 的区间与低分位条件。"""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2022-01-03', periods=days)
+    data = {}
+    for i in range(n_tickers):
+        low_priced = i % 3 == 2
+        if low_priced:
+            r = rng.normal(0.0, 0.01, days)
+            for k in range(60 + i * 7, days, 150):
+                r[k:k + 5] -= 0.04
+                r[k + 5:k + 15] += 0.02
+            close = np.exp(np.cumsum(r))
+        else:
+            r = rng.normal(0.0005, 0.02, days) + np.sin(np.arange(days) / 40 + i) * 0.004
+            close = 10 * np.exp(np.cumsum(r))
+        op = close * (1 + rng.normal(0, 0.005, days))
+        hi = np.maximum(op, close) * (1 + abs(rng.normal(0, 0.005, days)))
+        lo = np.minimum(op, close) * (1 - abs(rng.normal(0, 0.005, days)))
+        vol = rng.integers(1000, 5000, days) * (1 + (np.sin(np.arange(days) / 7 + i) > 0.8))
+        df = pd.DataFrame({'open': op, 'high': hi, 'low': lo, 'close': close,
+                           'volume': vol.astype(float), 'openinterest': 0.0}, index=dates)
+        # 部分标的上市较晚、部分日期停牌
+        df = df.iloc[0 if i % 5 else 30:]
+        df = df[[(j + i) % 97 != 0 for j in range(len(df))]]
+        df.index.name = 'date'
+        data[f"{600000 + i}.SH"] = df
+    return data
+
+
+def _orders_frame(orders) -> pd.DataFrame:
+    df = pd.DataFrame(orders, columns=['datetime', 'ts_code', 'side', 'size', 'price', 'commission'])
+    df['datetime'] = pd.to_datetime(df['datetime']).dt.normalize()
+    return df.sort_values(['datetime', 'ts_code', 'side']).reset_index(drop=True)
+
+
+def compare(strategy_name: str, strategy_class, price_data, capital: float, max_positions: int,
+            trade_start: pd.Timestamp) -> list:
+    """返回差异描述列表（为空表示一致）。
+    Backtrader 以完整分析器模式运行，同时核对精简模式记录的净值/交易数与 TimeReturn/TradeAnalyzer 一致。"""
+    thestrat = run_cerebro(strategy_class, price_data, capital, max_positions, trade_start=trade_start, lean=False)
+    bt_values = daily_values(thestrat, capital).loc[trade_start:]
+    bt_metrics = compute_metrics(bt_values, capital, *trade_counts(thestrat), closed_trades=thestrat.closed_trades,
+                                 executed_orders=thestrat.executed_orders, cash=daily_cash(thestrat))
+    vec = run_vectorized(strategy_class, price_data, capital, max_positions, trade_start=trade_start)
+    vec_values = vec['values'].loc[trade_start:]
+    vec_metrics = compute_metrics(vec_values, capital, vec['total_trades'], vec['won_trades'],
+                                  closed_trades=vec['closed_trades'], executed_orders=vec['executed_orders'],
+                                  cash=vec['cash'])
+
+    problems = []
+    tr_values = values_from_returns(pd.Series(thestrat.analyzers.timereturn.get_analysis(), dtype=float), capital)
+    if (daily_values(thestrat, capital) - tr_values).abs().max() > TOLERANCE * capital:
+        problems.append("精简模式记录的净值与 TimeReturn 不一致")
+    ta = thestrat.analyzers.trade_analyzer.get_analysis()
+    if trade_counts(thestrat) != (ta.get('total', {}).get('total', 0), ta.get('won', {}).get('total', 0)):
+        problems.append(f"精简模式交易数 {trade_counts(thestrat)} 与 TradeAnalyzer 不一致")
+    joined = pd.concat({'bt': bt_values, 'vec': vec_values}, axis=1)
+    diff = (joined['bt'] - joined['vec']).abs().max()
+    if joined.isna().any().any() or diff > TOLERANCE * capital:
+        problems.append(f"净值不一致（最大差异 {diff:.6f}）")
+
+    bt_orders = _orders_frame(getattr(thestrat, 'executed_orders', []))
+    vec_orders = _orders_frame(vec['executed_orders'])
+    if len(bt_orders) != len(vec_orders):
+        problems.append(f"订单数不一致: backtrader={len(bt_orders)} vectorized={len(vec_orders)}")
+    elif not bt_orders.empty:
+        keys_equal = (bt_orders[['datetime', 'ts_code', 'side']].equals(vec_orders[['datetime', 'ts_code', 'side']])
+                      and np.allclose(bt_orders['size'].astype(float), vec_orders['size'].astype(float)))
+        price_diff = (bt_orders['price'] - vec_orders['price']).abs().max()
+        if not keys_equal or price_diff > TOLERANCE:
+            problems.append(f"订单明细不一致（价格最大差异 {price_diff:.8f}）")
+
+    bt_closed = len(getattr(thestrat, 'closed_trades', []))
+    if bt_closed != len(vec['closed_trades']):
+        problems.append(f"已平仓交易数不一致: backtrader={bt_closed} vectorized={len(vec['closed_trades'])}")
+
+    for key, bt_val in bt_metrics.items():
+        if not np.isclose(float(bt_val or 0), float(vec_metrics[key] or 0), rtol=0, atol=1e-6):
+            problems.append(f"指标 {key} 不一致: backtrader={bt_val} vectorized={vec_metrics[key]}")
+
+    print(f"{strategy_name}: 订单 {len(bt_orders)} 笔, 已平仓 {bt_closed} 笔, "
+          f"总收益 {bt_metrics['total_return']:.4f}% / {vec_metrics['total_return']:.4f}% -> "
+          f"{'一致' if not problems else '存在差异'}")
+    return problems
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Backtrader / 向量化引擎一致性检查')
+    parser.add_argument('--tickers', type=int, default=15)
+    parser.add_argument('--days', type=int, default=700)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--capital', type=float, default=1_000_000)
+    parser.add_argument('--max-positions', type=int, default=5)
+    parser.add_argument('--strategy', action='append', help='仅检查指定策略（可重复）')
+    args = parser.parse_args()
+
+    price_data = synthetic_price_data(args.tickers, args.days, args.seed)
+    # 前 250 个交易日作为预热，之后开始交易
+    trade_start = pd.bdate_range('2022-01-03', periods=args.days)[min(250, args.days - 1)]
+    manager = StrategyManager(Database())
+    names = args.strategy or sorted(manager.strategies.keys())
+    failed = False
+    for name in names:
+        problems = compare(name, manager.get_strategy_class(name), price_data, args.capital, args.max_positions,
+                           trade_start)
+        for p in problems:
+            print(f"  - {p}")
+        failed |= bool(problems)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,35 +1,135 @@
+import sys
 import backtrader as bt
+import numpy as np
+import pandas as pd
 from typing import List, Dict, Any
+from utils import events
 
 # 这个文件现在作为策略的公共基类和适配器
 
+# 候选排序使用的评分列，按优先级依次比较
+SCORE_COLUMNS = ('score', 'score2', 'score3', 'score4')
+SIGNAL_COLUMNS = ('entry', 'exit') + SCORE_COLUMNS
+
+
+class SignalData(bt.feeds.PandasData):
+    """携带预计算信号列的行情数据源：策略通过 d.entry[0] / d.exit[0] / d.score[0] 读取。
+
+    加载时先把各列转为 NumPy 数组，逐行读取数组而非 DataFrame.iloc（后者在多列时开销很大）。
+    数据需以日期为索引。
+    """
+    lines = SIGNAL_COLUMNS
+    params = tuple((col, -1) for col in SIGNAL_COLUMNS)
+
+    def start(self):
+        super().start()
+        df = self.p.dataname
+        self._columns = [(getattr(self.lines, field), df.iloc[:, col].to_numpy(dtype=float))
+                         for field, col in self._colmapping.items()
+                         if field != 'datetime' and col is not None]
+        self._dtnums = [bt.date2num(ts.to_pydatetime()) for ts in df.index]
+
+    def _load(self):
+        self._idx += 1
+        if self._idx >= len(self._dtnums):
+            return False
+        for line, values in self._columns:
+            line[0] = values[self._idx]
+        self.lines.datetime[0] = self._dtnums[self._idx]
+        return True
+
+
 class WaySsystemStrategy(bt.Strategy):
     """所有策略的基类，继承自 backtrader.Strategy
 
-    注：为支持多股票并行回测，这里按“每个数据源一套指标”的方式组织，
-    并在 next 中循环遍历所有数据源分别处理买卖。
+    注：买卖信号由策略模块的 compute_signals 在回测前向量化计算，并作为 SignalData 的附加行传入；
+    next 中只做订单管理：持仓出现 exit 信号则次日开盘卖出，空余仓位按评分买入 entry 标的。
     """
+    # 买入订单类型：Market 为次日开盘成交，Close 为按收盘价成交
+    buy_exectype = bt.Order.Market
+
     params = (
         ('max_positions', 10),
+        ('trade_start', None),  # 开始交易日期（datetime.date）；此前的K线仅用于指标预热
+        ('recorder', None),  # 可选的 backtest.columnar.RunRecorder：订单/成交直接追加写盘，不在内存中累积
     )
 
     def __init__(self):
-        # 为每个数据源维护独立的卖出参考指标（30日均线）
-        self.ma30 = {}
-        for d in self.datas:
-            self.ma30[d] = bt.indicators.SimpleMovingAverage(d.close, period=30)
-
         self.closed_trades = []
         self.executed_orders = []
+        # 已开仓交易数（含未平仓）与盈利交易数，与 TradeAnalyzer 的 total.total / won.total 口径一致
+        self.opened_trades = 0
+        self.won_trades = 0
+        # 每个数据源当前未完结的订单；停牌时订单会顺延，期间不重复下单（避免重复卖出导致反向开仓）
+        self.open_orders = {}
+        self.score_lines = [col for col in SCORE_COLUMNS if hasattr(self.datas[0].lines, col)] if self.datas else []
+        # 当前持仓的数据源集合（由 notify_trade 增量维护），供策略与 Sizer 以 O(1) 读取持仓数
+        self.held = set()
+        # 当前 entry 信号为真的数据源集合，按预计算的信号变化事件增量维护
+        self.entry_active = set()
+        self._data_order = {d: i for i, d in enumerate(self.datas)}
+        self._entry_events = {}
+        # 下单事件是否记录（运行前确定一次；关闭时 next 中不做任何格式化）
+        self._log_orders = events.is_enabled('order_created')
+
+    def start(self):
+        # 行情已预加载：按“K线时间 -> 该K线上 entry 发生变化的数据源”建立事件表。
+        # 停牌期间数据源不前进，信号保持上一根K线的取值，与 d.entry[0] 的读取语义一致。
+        for d in self.datas:
+            prev = False
+            for dtnum, value in zip(d.datetime.array, d.entry.array):
+                value = bool(value)
+                if value != prev:
+                    self._entry_events.setdefault(dtnum, []).append((d, value))
+                    prev = value
+
+    def _advance_signals(self):
+        for d, value in self._entry_events.get(self.datetime[0], ()):
+            if value:
+                self.entry_active.add(d)
+            else:
+                self.entry_active.discard(d)
+
+    def trading_started(self) -> bool:
+        ''' 当前K线是否已到达开始交易日期 '''
+        if self.p.trade_start is None:
+            return True
+        return self.datetime.date(0) >= self.p.trade_start
+
+    def has_open_order(self, data) -> bool:
+        ''' 该标的是否有尚未成交/撤销的订单 '''
+        return data in self.open_orders
+
+    def buy(self, *args, **kwargs):
+        order = super().buy(*args, **kwargs)
+        if order is not None:
+            self.open_orders[order.data] = order
+        return order
+
+    def sell(self, *args, **kwargs):
+        order = super().sell(*args, **kwargs)
+        if order is not None:
+            self.open_orders[order.data] = order
+        return order
 
     def log(self, txt, dt=None):
-        ''' 策略的日志记录功能 '''
-        dt = dt or self.datas[0].datetime.date(0)
-        print(f'{dt.isoformat()}, {txt}')
+        ''' 策略的日志记录功能（strategy_log 事件，默认级别下不记录） '''
+        if events.is_enabled('strategy_log'):
+            events.emit('strategy_log', strategy=type(self).__name__,
+                        date=dt or self.datas[0].datetime.date(0), text=txt)
+
+    def _order_created(self, d, side: str):
+        events.emit('order_created', strategy=type(self).__name__, date=self.datetime.date(0),
+                    ts_code=getattr(d, '_name', ''), side=side, close=d.close[0])
 
     def notify_trade(self, trade):
+        if trade.justopened:
+            self.held.add(trade.data)
+            self.opened_trades += 1
         if trade.isclosed:
-            self.closed_trades.append({
+            self.held.discard(trade.data)
+            self.won_trades += int(trade.pnlcomm >= 0.0)
+            record = {
                 'ts_code': trade.data._name,
                 'open_datetime': bt.num2date(trade.dtopen),
                 'close_datetime': bt.num2date(trade.dtclose),
@@ -40,16 +140,25 @@ class WaySsystemStrategy(bt.Strategy):
                 'open_price': trade.price,
                 'profit': trade.pnl,
                 'profit_comm': trade.pnlcomm,
-            })
+            }
+            if self.p.recorder is not None:
+                self.p.recorder.record_trade(record)
+            else:
+                self.closed_trades.append(record)
 
     def notify_order(self, order):
+        if order.status in [order.Completed, order.Canceled, order.Margin, order.Rejected, order.Expired]:
+            # 通知中的订单为副本，按 ref 匹配
+            pending = self.open_orders.get(order.data)
+            if pending is not None and pending.ref == order.ref:
+                del self.open_orders[order.data]
         if order.status in [order.Completed]:
             try:
                 exec_dt = bt.num2date(order.executed.dt)
             except Exception:
                 exec_dt = None
             side = 'buy' if order.isbuy() else 'sell'
-            self.executed_orders.append({
+            record = {
                 'ts_code': order.data._name,
                 'datetime': exec_dt,
                 'side': side,
@@ -57,18 +166,48 @@ class WaySsystemStrategy(bt.Strategy):
                 'price': order.executed.price,
                 'value': order.executed.value,
                 'commission': order.executed.comm,
-            })
+            }
+            if self.p.recorder is not None:
+                self.p.recorder.record_order(record)
+            else:
+                self.executed_orders.append(record)
+
+    def score(self, data) -> tuple:
+        ''' 候选排序键：按 SCORE_COLUMNS 顺序比较 '''
+        return tuple(getattr(data, col)[0] for col in self.score_lines)
+
+    def prenext(self):
+        # 尚未上市（无K线）的标的不影响其他标的交易
+        self.next()
 
     def next(self):
-        # 统一的卖出逻辑：逐只股票检查是否跌破其各自的30日均线
-        for d in self.datas:
-            pos = self.getposition(d)
-            if pos.size != 0:
-                if d.close[0] < self.ma30[d][0]:
-                    # 卖出该标的全部仓位
-                    self.log(f'SELL CREATE {getattr(d, "_name", "")} Price: {d.close[0]:.2f} < MA30: {self.ma30[d][0]:.2f}')
-                    self.sell(data=d)
-        
+        self._advance_signals()
+        if not self.trading_started():
+            return
+        # 卖出：持仓标的出现 exit 信号 -> 次日开盘卖出全部仓位
+        for d in sorted(self.held, key=self._data_order.get):
+            if not self.has_open_order(d) and d.exit[0]:
+                if self._log_orders:
+                    self._order_created(d, 'sell')
+                self.sell(data=d)
+
+        # 控制最大持仓
+        remain_slots = max(0, self.p.max_positions - len(self.held))
+        if remain_slots <= 0:
+            return
+
+        # 候选按数据源顺序排列后再按评分稳定排序（评分相同时保持原顺序）
+        candidates = sorted((d for d in self.entry_active if d not in self.held and not self.has_open_order(d)),
+                            key=self._data_order.get)
+        if not candidates:
+            return
+        candidates.sort(key=self.score, reverse=True)
+        for d in candidates[:remain_slots]:
+            if self._log_orders:
+                self._order_created(d, 'buy')
+            self.buy(data=d, exectype=self.buy_exectype)
+
+
 # --- 适配器函数 ---
 def run_strategy_for_screening(strategy_class, data_df) -> List[Dict[str, Any]]:
     """
@@ -94,3 +233,73 @@ def run_strategy_for_screening(strategy_class, data_df) -> List[Dict[str, Any]]:
     # 这是一个简化的适配器，我们将在具体策略中实现这个逻辑。
     # 此处返回一个空列表，具体逻辑将在策略文件中实现。
     return []
+
+
+# --- 信号预计算与向量化指标（与 backtrader 内置指标口径一致） ---
+def resolve_params(strategy_class, params: dict | None = None) -> Dict[str, Any]:
+    """合并策略默认参数与传入参数。"""
+    merged = dict(strategy_class.params._getitems())
+    merged.update(params or {})
+    return merged
+
+
+def build_signals(strategy_class, df: pd.DataFrame, params: dict | None = None) -> pd.DataFrame:
+    """调用策略模块的 compute_signals 计算逐日信号；缺失的评分列补 0（不影响排序）。"""
+    module = sys.modules[strategy_class.__module__]
+    if not hasattr(module, 'compute_signals'):
+        raise ValueError(f"策略 '{strategy_class.__name__}' 未提供 compute_signals")
+    signals = module.compute_signals(df, resolve_params(strategy_class, params))
+    signals = signals.reindex(df.index)
+    signals['entry'] = signals['entry'].fillna(False).astype(bool)
+    signals['exit'] = signals['exit'].fillna(False).astype(bool)
+    for col in SCORE_COLUMNS:
+        signals[col] = signals[col].astype(float).fillna(0.0) if col in signals else 0.0
+    return signals[list(SIGNAL_COLUMNS)]
+
+
+def required_warmup(strategy_class, params: dict | None = None) -> int:
+    """策略模块 warmup_bars 给出的预热K线数（首个交易日之前）；未提供时为 0。"""
+    module = sys.modules[strategy_class.__module__]
+    if not hasattr(module, 'warmup_bars'):
+        return 0
+    return int(module.warmup_bars(resolve_params(strategy_class, params)))
+
+
+def with_signals(df: pd.DataFrame, signals: pd.DataFrame) -> pd.DataFrame:
+    """将信号列并入行情，供 SignalData 使用。"""
+    return df.join(signals.astype(float))
+
+
+def sma(series: pd.Series, period: int) -> pd.Series:
+    return series.rolling(period).mean()
+
+
+def smma(series: pd.Series, period: int) -> pd.Series:
+    """Wilder 平滑均线：以首个完整窗口的简单均值为种子（同 bt.indicators.SmoothedMovingAverage）。"""
+    seed = series.rolling(period).mean()
+    valid = seed.notna().to_numpy()
+    if not valid.any():
+        return seed
+    first = int(valid.argmax())
+    values = series.to_numpy(dtype=float, copy=True)
+    values[:first] = np.nan
+    values[first] = seed.iloc[first]
+    return pd.Series(values, index=series.index).ewm(alpha=1.0 / period, adjust=False).mean()
+
+
+def rsi_safe(close: pd.Series, period: int) -> pd.Series:
+    """同 bt.indicators.RSI_Safe：下跌均值为 0 时取 100（上涨均值也为 0 时取 50）。"""
+    delta = close.diff()
+    up = smma(delta.clip(lower=0), period)
+    down = smma((-delta).clip(lower=0), period)
+    rsi = 100.0 - 100.0 / (1.0 + up / down)
+    return rsi.mask(down == 0, pd.Series(np.where(up == 0, 50.0, 100.0), index=close.index))
+
+
+def crossover(fast: pd.Series, slow: pd.Series) -> pd.Series:
+    """同 bt.indicators.CrossOver：上穿为 1，下穿为 -1，否则为 0（比较前一个非零差值）。"""
+    diff = fast - slow
+    nzd = diff.mask((diff == 0) & diff.shift(1).notna()).ffill()
+    prev = nzd.shift(1)
+    cross = ((prev < 0) & (fast > slow)).astype(float) - ((prev > 0) & (fast < slow)).astype(float)
+    return cross.where(prev.notna())
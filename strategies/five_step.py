@@ -1,9 +1,13 @@
-import backtrader as bt
-from .base import WaySsystemStrategy
+from .base import WaySsystemStrategy, resolve_params, sma, rsi_safe
 import pandas as pd
 import numpy as np
 
 class FiveStepStrategy(WaySsystemStrategy):
+    """
+    五步选股策略：MA240 上升、距240日涨幅达标、短均线向上、量能放大、RSI 过滤；
+    次日开盘买入，收盘跌破30日线次日开盘卖出。信号见 compute_signals。
+    """
+
     params = (
         ('ma_long_period', 240),
         ('ma_short_period_1', 60),
@@ -16,77 +20,46 @@ class FiveStepStrategy(WaySsystemStrategy):
         ('rsi_buy_threshold_2', 60),
     )
 
-    def __init__(self):
-        super().__init__()
-        # 为每个数据源构建一套独立指标
-        self.ma240 = {}
-        self.ma60 = {}
-        self.ma20 = {}
-        self.rsi13 = {}
-        self.rsi6 = {}
-        self.vol_sma = {}
-        for d in self.datas:
-            self.ma240[d] = bt.indicators.SimpleMovingAverage(d.close, period=self.params.ma_long_period)
-            self.ma60[d] = bt.indicators.SimpleMovingAverage(d.close, period=self.params.ma_short_period_1)
-            self.ma20[d] = bt.indicators.SimpleMovingAverage(d.close, period=self.params.ma_short_period_2)
-            self.rsi13[d] = bt.indicators.RSI_Safe(d.close, period=self.params.rsi_period_1)
-            self.rsi6[d] = bt.indicators.RSI_Safe(d.close, period=self.params.rsi_period_2)
-            self.vol_sma[d] = bt.indicators.SimpleMovingAverage(d.volume, period=20)
-
-    def next(self):
-        # 首先，执行基类中的统一卖出逻辑（逐标的）
-        super().next()
-
-        # 统计当前持仓数量（按标的）
-        open_positions = 0
-        for d in self.datas:
-            if self.getposition(d).size != 0:
-                open_positions += 1
-
-        remaining_slots = max(0, self.p.max_positions - open_positions)
-        if remaining_slots <= 0:
-            return
-
-        # 收集当日满足买入条件的候选标的，并打分排序
-        candidates = []
-        for d in self.datas:
-            if self.getposition(d).size == 0:
-                # Step 1: MA240 上升
-                cond1 = self.ma240[d][0] > self.ma240[d][-1]
-                # Step 2: 距 240 日涨幅阈值
-                cond2 = False
-                mom240 = 0.0
-                if len(d.close) > self.params.ma_long_period:
-                    base = d.close[-self.params.ma_long_period]
-                    if base and base != 0:
-                        mom240 = d.close[0] / base - 1.0
-                        cond2 = d.close[0] >= base * self.params.price_increase_factor
-                # Step 3: 短均线趋势
-                cond3 = (self.ma60[d][0] > self.ma60[d][-1]) or (self.ma20[d][0] > self.ma20[d][-1])
-                # Step 4: 量能放大
-                vol_ratio = 0.0
-                if self.vol_sma[d][0] and self.vol_sma[d][0] != 0:
-                    vol_ratio = d.volume[0] / self.vol_sma[d][0]
-                cond4 = d.volume[0] > self.vol_sma[d][0] * self.params.vol_multiplier
-                # Step 5: RSI 过滤
-                rsi6_v = float(self.rsi6[d][0])
-                cond5 = (self.rsi13[d][0] > self.params.rsi_buy_threshold_1) and (rsi6_v > self.params.rsi_buy_threshold_2)
-
-                if cond1 and cond2 and cond3 and cond4 and cond5:
-                    ma20_dist = 0.0
-                    if self.ma20[d][0]:
-                        ma20_dist = d.close[0] / self.ma20[d][0] - 1.0
-                    # 排序关键：RSI6 优先，其次量比，再次与MA20偏离，最后240日动量
-                    score_key = (rsi6_v, vol_ratio, ma20_dist, mom240)
-                    candidates.append((score_key, d))
-
-        if not candidates:
-            return
-
-        candidates.sort(key=lambda x: x[0], reverse=True)
-        for _, d in candidates[:remaining_slots]:
-            self.log(f'BUY CREATE {getattr(d, "_name", "")}, {d.close[0]:.2f}')
-            self.buy(data=d)
+
+def warmup_bars(params: dict | None = None) -> int:
+    """首个交易日之前需要的K线数，使当日全部信号均有效（MA240 斜率与240日涨幅各需回看 240 根）。"""
+    p = resolve_params(FiveStepStrategy, params)
+    return max(p['ma_long_period'], p['ma_short_period_1'], p['ma_short_period_2'],
+               p['rsi_period_1'], p['rsi_period_2'], 20 - 1, 30 - 1)
+
+
+def compute_signals(df: pd.DataFrame, params: dict | None = None) -> pd.DataFrame:
+    """
+    向量化计算逐日信号（回测前一次算好，作为 SignalData 的附加行传入策略）。
+    返回列：entry（买入条件）、exit（收盘跌破30日线）、score..score4（候选排序键）。
+    """
+    p = resolve_params(FiveStepStrategy, params)
+    close = df['close']
+    volume = df['volume']
+    ma240 = sma(close, p['ma_long_period'])
+    ma60 = sma(close, p['ma_short_period_1'])
+    ma20 = sma(close, p['ma_short_period_2'])
+    vol_sma = sma(volume, 20)
+    rsi13 = rsi_safe(close, p['rsi_period_1'])
+    rsi6 = rsi_safe(close, p['rsi_period_2'])
+
+    base = close.shift(p['ma_long_period'])
+    base_ok = base.notna() & (base != 0)
+    cond1 = ma240 > ma240.shift(1)
+    cond2 = base_ok & (close >= base * p['price_increase_factor'])
+    cond3 = (ma60 > ma60.shift(1)) | (ma20 > ma20.shift(1))
+    cond4 = volume > vol_sma * p['vol_multiplier']
+    cond5 = (rsi13 > p['rsi_buy_threshold_1']) & (rsi6 > p['rsi_buy_threshold_2'])
+
+    return pd.DataFrame({
+        'entry': cond1 & cond2 & cond3 & cond4 & cond5,
+        'exit': close < sma(close, 30),
+        # 排序关键：RSI6 优先，其次量比，再次与MA20偏离，最后240日动量
+        'score': rsi6,
+        'score2': (volume / vol_sma).where(vol_sma != 0, 0.0),
+        'score3': (close / ma20 - 1.0).where(ma20 != 0, 0.0),
+        'score4': (close / base - 1.0).where(base_ok, 0.0),
+    }, index=df.index)
 
 
 def _rsi(series: pd.Series, period: int) -> pd.Series:
@@ -122,7 +95,7 @@ def screen_stock(df: pd.DataFrame):
         return False
 
     # 读取策略默认参数，确保与回测一致
-    params = dict(FiveStepStrategy.params)
+    params = resolve_params(FiveStepStrategy)
     ma240 = close.rolling(params['ma_long_period']).mean()
     ma60 = close.rolling(params['ma_short_period_1']).mean()
     ma20 = close.rolling(params['ma_short_period_2']).mean()
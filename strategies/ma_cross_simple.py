@@ -1,5 +1,5 @@
 import backtrader as bt
-from .base import WaySsystemStrategy
+from .base import WaySsystemStrategy, resolve_params, sma, crossover
 import pandas as pd
 
 
@@ -7,10 +7,12 @@ class SMA20_120_VolStop30Strategy(WaySsystemStrategy):
     """
     简单均线策略：
     - 买入：20日均线上穿120日均线（当日金叉），且当日成交量 > MA3 且 > MA18；当日收盘买入。
-    - 卖出：收盘价 < 30日均线，次日开盘卖出（继承基类卖出逻辑）。
+    - 卖出：收盘价 < 30日均线，次日开盘卖出（exit 信号，由基类统一下单）。
     - 最大持仓通过 max_positions 控制。
     """
 
+    buy_exectype = bt.Order.Close
+
     params = (
         ('max_positions', 10),
         ('sma_fast', 20),
@@ -21,73 +23,40 @@ class SMA20_120_VolStop30Strategy(WaySsystemStrategy):
         ('signal_valid_days', 3),  # 金叉发生后N日内有效
     )
 
-    def __init__(self):
-        super().__init__()
-        self.sma_fast = {}
-        self.sma_slow = {}
-        self.sma_stop = {}
-        self.vol_ma_short = {}
-        self.vol_ma_long = {}
-        self.cross_fast_slow = {}
-
-        for d in self.datas:
-            self.sma_fast[d] = bt.indicators.SimpleMovingAverage(d.close, period=self.p.sma_fast)
-            self.sma_slow[d] = bt.indicators.SimpleMovingAverage(d.close, period=self.p.sma_slow)
-            self.sma_stop[d] = bt.indicators.SimpleMovingAverage(d.close, period=self.p.sma_stop)
-            self.vol_ma_short[d] = bt.indicators.SimpleMovingAverage(d.volume, period=self.p.vol_ma_short)
-            self.vol_ma_long[d] = bt.indicators.SimpleMovingAverage(d.volume, period=self.p.vol_ma_long)
-            self.cross_fast_slow[d] = bt.indicators.CrossOver(self.sma_fast[d], self.sma_slow[d])
-
-    def next(self):
-        # 卖出：收盘价跌破 stop 均线 -> 次日开盘卖出
-        for d in self.datas:
-            pos = self.getposition(d)
-            if pos.size != 0 and len(self.sma_stop[d]) > 0:
-                if d.close[0] < self.sma_stop[d][0]:
-                    self.log(f'SELL CREATE {getattr(d, "_name", "")} Close {d.close[0]:.2f} < SMA{self.p.sma_stop} {self.sma_stop[d][0]:.2f}')
-                    self.sell(data=d)
-
-        # 统计当前持仓数量，控制最大持仓
-        open_positions = sum(1 for d in self.datas if self.getposition(d).size != 0)
-        remain_slots = max(0, self.p.max_positions - open_positions)
-        if remain_slots <= 0:
-            return
-
-        # 逐标的检查买入条件
-        candidates = []
-        for d in self.datas:
-            if self.getposition(d).size != 0:
-                continue
-            if len(self.sma_slow[d]) < self.p.sma_slow or len(self.vol_ma_long[d]) < self.p.vol_ma_long or len(self.vol_ma_short[d]) < self.p.vol_ma_short:
-                continue
-
-            # 金叉在过去N日内是否出现
-            n = max(1, int(self.p.signal_valid_days))
-            recent_cross = False
-            for i in range(0, n):
-                if len(self.cross_fast_slow[d]) > i and self.cross_fast_slow[d][-i] > 0:
-                    recent_cross = True
-                    break
-
-            # 当天保持趋势与量能要求
-            price_ok = d.close[0] >= self.sma_fast[d][0]
-            vol_ok = (d.volume[0] > self.vol_ma_short[d][0]) and (d.volume[0] > self.vol_ma_long[d][0])
-
-            if recent_cross and price_ok and vol_ok:
-                # 简单评分：与120日均线的距离越小越优先（避免过度乖离）+ 量比
-                dist = abs((d.close[0] / self.sma_slow[d][0]) - 1.0)
-                vol_ratio = d.volume[0] / max(self.vol_ma_long[d][0], 1e-9)
-                score = (-dist, vol_ratio)
-                candidates.append((score, d))
-
-        if not candidates:
-            return
-
-        candidates.sort(key=lambda x: x[0], reverse=True)
-        for _, d in candidates[:remain_slots]:
-            # 当日收盘买入
-            self.log(f'BUY CREATE {getattr(d, "_name", "")} @ Close {d.close[0]:.2f}')
-            self.buy(data=d, exectype=bt.Order.Close)
+
+def warmup_bars(params: dict | None = None) -> int:
+    """首个交易日之前需要的K线数：金叉判定需 sma_slow 根，N日内有效再回看 N-1 根。"""
+    p = resolve_params(SMA20_120_VolStop30Strategy, params)
+    n = max(1, int(p['signal_valid_days']))
+    return max(p['sma_slow'] + n - 1, p['sma_stop'] - 1, p['vol_ma_short'] - 1, p['vol_ma_long'] - 1)
+
+
+def compute_signals(df: pd.DataFrame, params: dict | None = None) -> pd.DataFrame:
+    """
+    向量化计算逐日信号（回测前一次算好，作为 SignalData 的附加行传入策略）。
+    返回列：entry（N日内金叉且价量达标）、exit（收盘跌破止损均线）、score/score2（候选排序键）。
+    """
+    p = resolve_params(SMA20_120_VolStop30Strategy, params)
+    close = df['close']
+    volume = df['volume']
+    sma_fast_s = sma(close, p['sma_fast'])
+    sma_slow_s = sma(close, p['sma_slow'])
+    vol_short = sma(volume, p['vol_ma_short'])
+    vol_long = sma(volume, p['vol_ma_long'])
+
+    n = max(1, int(p['signal_valid_days']))
+    recent_cross = (crossover(sma_fast_s, sma_slow_s) > 0).astype(float).rolling(n, min_periods=1).max() > 0
+    ready = sma_slow_s.notna() & vol_long.notna() & vol_short.notna()
+    price_ok = close >= sma_fast_s
+    vol_ok = (volume > vol_short) & (volume > vol_long)
+
+    return pd.DataFrame({
+        'entry': ready & recent_cross & price_ok & vol_ok,
+        'exit': close < sma(close, p['sma_stop']),
+        # 与120日均线的距离越小越优先（避免过度乖离），其次量比
+        'score': -((close / sma_slow_s) - 1.0).abs(),
+        'score2': volume / vol_long.clip(lower=1e-9),
+    }, index=df.index)
 
 
 def screen_stock(df: pd.DataFrame, params: dict | None = None):
@@ -1,6 +1,5 @@
 import backtrader as bt
-from .base import WaySsystemStrategy
-from collections import deque
+from .base import WaySsystemStrategy, resolve_params, sma
 import pandas as pd
 import numpy as np
 
@@ -11,177 +10,74 @@ class WeeklyMACDFilterStrategy(WaySsystemStrategy):
     日线量价过滤；买在当日收盘；破SMA20于次日开盘卖出。
     """
 
+    buy_exectype = bt.Order.Close
+
     params = (
         ('max_positions', 10),
         ('signal_valid_days', 3),  # 周线信号在N个交易日内有效
+        ('macd_fast', 12),  # 周线 MACD 快线 EMA 跨度（周）
+        ('macd_slow', 26),  # 周线 MACD 慢线 EMA 跨度（周）
+        ('macd_signal', 9),  # DEA 信号线 EMA 跨度（周）
     )
 
-    def __init__(self):
-        super().__init__()
-        # 日线过滤指标
-        self.price_sma20 = {}
-        self.vol_ma3 = {}
-        self.vol_ma18 = {}
-
-        # 周线MACD状态（按标的）
-        self.week_state = {}
-
-        for d in list(self.datas):
-            # 日线指标
-            self.price_sma20[d] = bt.indicators.SimpleMovingAverage(d.close, period=20)
-            self.vol_ma3[d] = bt.indicators.SimpleMovingAverage(d.volume, period=3)
-            self.vol_ma18[d] = bt.indicators.SimpleMovingAverage(d.volume, period=18)
-
-            # 周线状态：用周五收盘价驱动 EMA 递推；跨日持久可用
-            self.week_state[d] = {
-                'ema12': None,
-                'ema26': None,
-                'signal9': None,
-                'prev_dif': None,
-                'prev_dea': None,
-                'dif_hist': deque(maxlen=20),  # 过去20周 DIF（不含本周）
-                'last_cross_up': False,       # 最近一次（上周/本周）的金叉标记（在最近一个周五更新）
-                'last_signal_week_date': None,  # 最近一次满足周线全部条件的周（周五）日期
-                'last_signal_bar_index': None,  # 对应日线bar索引（用于N日内有效判定）
-                'last_update_date': None,
-            }
-
-        # 预先计算 EMA 系数（周线）
-        self._alpha12 = 2.0 / (12 + 1)
-        self._alpha26 = 2.0 / (26 + 1)
-        self._alpha9 = 2.0 / (9 + 1)
-
-    def _is_friday(self, d) -> bool:
-        try:
-            dt = bt.num2date(d.datetime[0])
-            # 中国A股常规周终为周五；节假日略有偏差，此处近似处理
-            return dt.weekday() == 4  # Monday=0 ... Friday=4
-        except Exception:
-            return False
-
-    def _update_weekly_macd(self, d):
-        """在周五收盘后用当日收盘价更新周线MACD状态。"""
-        state = self.week_state[d]
-        price = float(d.close[0])
-
-        # 初始化
-        if state['ema12'] is None:
-            state['ema12'] = price
-            state['ema26'] = price
-            state['signal9'] = 0.0
-            state['prev_dif'] = 0.0
-            state['prev_dea'] = 0.0
-            state['last_cross_up'] = False
-            state['last_update_date'] = bt.num2date(d.datetime[0]).date()
-            return
-
-        # 上一周值
-        prev_dif = state['prev_dif']
-        prev_dea = state['prev_dea']
-
-        # 递推 EMA 与 DIF/DEA
-        ema12 = state['ema12'] = (self._alpha12 * price + (1 - self._alpha12) * state['ema12'])
-        ema26 = state['ema26'] = (self._alpha26 * price + (1 - self._alpha26) * state['ema26'])
-        dif = ema12 - ema26
-        dea = state['signal9'] = (self._alpha9 * dif + (1 - self._alpha9) * state['signal9'])
-
-        # 本次金叉判定：上周 DIF<=DEA 且 本周 DIF>DEA
-        cross_up = (prev_dif is not None and prev_dea is not None and prev_dif <= prev_dea and dif > dea)
-        state['last_cross_up'] = bool(cross_up)
-
-        # 分位用过去20周（不含本周）
-        if prev_dif is not None:
-            state['dif_hist'].append(prev_dif)
-
-        state['prev_dif'] = dif
-        state['prev_dea'] = dea
-        state['last_update_date'] = bt.num2date(d.datetime[0]).date()
-
-        # 若本周满足“完整周线信号”（金叉 + 区间 + 低分位），记录信号周与bar索引
-        try:
-            q20 = np.quantile(list(state['dif_hist']), 0.2) if len(state['dif_hist']) >= 20 else None
-        except Exception:
-            q20 = None
-        cond_week_range = (-0.05 <= dif <= 0.15)
-        cond_week_lowpct = (q20 is not None and dif <= q20)
-        full_week_signal = bool(state['last_cross_up'] and cond_week_range and cond_week_lowpct)
-        if full_week_signal:
-            state['last_signal_week_date'] = state['last_update_date']
-            try:
-                state['last_signal_bar_index'] = len(d) - 1
-            except Exception:
-                state['last_signal_bar_index'] = None
-
-    def next(self):
-        # 先执行“破SMA20于次日开盘卖出”逻辑
-        for d in self.datas:
-            pos = self.getposition(d)
-            if pos.size != 0:
-                if len(self.price_sma20[d]) > 0 and d.close[0] < self.price_sma20[d][0]:
-                    self.log(f'SELL CREATE {getattr(d, "_name", "")} Close {d.close[0]:.2f} < SMA20 {self.price_sma20[d][0]:.2f}')
-                    # 市价单，默认在下一根K线的开盘成交
-                    self.sell(data=d)
-
-        # 更新当周（若为周五）周线MACD
-        for d in self.datas:
-            if self._is_friday(d):
-                self._update_weekly_macd(d)
-
-        # 统计持仓，控制最大持仓数
-        open_positions = sum(1 for d in self.datas if self.getposition(d).size != 0)
-        remain_slots = max(0, self.p.max_positions - open_positions)
-        if remain_slots <= 0:
-            return
-
-        # 逐标的检查买入信号（周线信号N日内有效 + 日线过滤）
-        candidates = []
-        for d in self.datas:
-            if self.getposition(d).size != 0:
-                continue
-
-            state = self.week_state[d]
-            # 检查最近一次完整周线信号是否在 N 日内
-            valid = False
-            try:
-                n = max(1, int(self.p.signal_valid_days))
-            except Exception:
-                n = 3
-            last_bar_idx = state.get('last_signal_bar_index')
-            if last_bar_idx is not None:
-                age = (len(d) - 1) - int(last_bar_idx)
-                valid = (age <= (n - 1))
-            if not valid:
-                continue
-
-            # 日线过滤（使用当日收盘数据）
-            if len(self.price_sma20[d]) < 20 or len(self.vol_ma18[d]) < 18 or len(self.vol_ma3[d]) < 3:
-                continue
-            price_ok = d.close[0] > self.price_sma20[d][0]
-            vol_ok = (d.volume[0] > self.vol_ma3[d][0]) and (d.volume[0] > self.vol_ma18[d][0])
-
-            if price_ok and vol_ok:
-                # 评分：越接近0轴越优先，量能越强越优先
-                zero_proximity = -abs(dif)  # 更接近0越大
-                vol_ratio = 0.0
-                if self.vol_ma18[d][0] and self.vol_ma18[d][0] != 0:
-                    vol_ratio = float(d.volume[0] / self.vol_ma18[d][0])
-                score = (cond_week_cross, zero_proximity, vol_ratio)
-                candidates.append((score, d))
-
-        if not candidates:
-            return
-
-        candidates.sort(key=lambda x: x[0], reverse=True)
-        for _, d in candidates[:remain_slots]:
-            # 买在当日收盘
-            self.log(f'BUY CREATE {getattr(d, "_name", "")} @ Close {d.close[0]:.2f}')
-            self.buy(data=d, exectype=bt.Order.Close)
+
+# DIF 分位的回看周数
+DIF_QUANTILE_WEEKS = 20
 
 
 def _ema(series: pd.Series, span: int) -> pd.Series:
     return series.ewm(span=span, adjust=False).mean()
 
 
+def warmup_bars(params: dict | None = None) -> int:
+    """首个交易日之前需要的K线数：周线 MACD 取慢线与信号线跨度之和（不少于 20 周分位窗口加 1 周），按每周 5 根折算。"""
+    p = resolve_params(WeeklyMACDFilterStrategy, params)
+    return max(int(p['macd_slow']) + int(p['macd_signal']), DIF_QUANTILE_WEEKS + 1) * 5
+
+
+def compute_signals(df: pd.DataFrame, params: dict | None = None) -> pd.DataFrame:
+    """
+    向量化计算逐日信号：
+    周线 MACD 仅在周五K线上更新（以首个周五收盘价为 EMA 种子），DIF 分位取此前 20 周（含首周的初始 0 值）。
+    返回列：entry（周线信号N日内有效且日线量价达标）、exit（收盘跌破SMA20）、score..score3（候选排序键）。
+    """
+    p = resolve_params(WeeklyMACDFilterStrategy, params)
+    n = max(1, int(p['signal_valid_days']))
+    close = df['close']
+    volume = df['volume']
+
+    fridays = df.index.dayofweek == 4
+    weekly_close = close[fridays]
+    dif = _ema(weekly_close, int(p['macd_fast'])) - _ema(weekly_close, int(p['macd_slow']))
+    dea = _ema(dif, int(p['macd_signal']))
+    prev_dif = dif.shift(1)
+    cross_up = (prev_dif <= dea.shift(1)) & (dif > dea)
+    q20 = prev_dif.rolling(DIF_QUANTILE_WEEKS).quantile(0.2)
+    full_signal = cross_up & dif.between(-0.05, 0.15) & (dif <= q20)
+
+    # 将周线状态映射回日线（按日线 bar 序号计算信号距今天数）
+    bar_no = pd.Series(np.arange(len(df), dtype=float), index=df.index)
+    last_signal_bar = bar_no[fridays].where(full_signal.to_numpy()).reindex(df.index).ffill()
+    week_valid = (bar_no - last_signal_bar) <= (n - 1)
+    last_dif = dif.reindex(df.index).ffill()
+    last_cross = cross_up.astype(float).reindex(df.index).ffill().fillna(0.0)
+
+    price_sma20 = sma(close, 20)
+    vol_ma3 = sma(volume, 3)
+    vol_ma18 = sma(volume, 18)
+    price_ok = close > price_sma20
+    vol_ok = (volume > vol_ma3) & (volume > vol_ma18)
+
+    return pd.DataFrame({
+        'entry': week_valid & price_ok & vol_ok,
+        'exit': close < price_sma20,
+        # 评分：本周金叉优先，DIF 越接近0轴越优先，量能越强越优先
+        'score': last_cross,
+        'score2': -last_dif.abs(),
+        'score3': (volume / vol_ma18).where(vol_ma18 != 0, 0.0),
+    }, index=df.index)
+
+
 def screen_stock(df: pd.DataFrame, params: dict | None = None):
     """
     选股判定：用 pandas 复现与回测一致的逻辑（以最后一日为基准）。
@@ -195,20 +91,19 @@ def screen_stock(df: pd.DataFrame, params: dict | None = None):
         return {'passed': False}
 
     df = df.sort_index().copy()
-    p = params or {}
-    valid_days = int(p.get('signal_valid_days', 3))
-    if len(df) < 240:
+    p = resolve_params(WeeklyMACDFilterStrategy, params)
+    valid_days = int(p['signal_valid_days'])
+    warmup = warmup_bars(p)
+    if len(df) < warmup:
         return {'passed': False}
 
     # 周线（以周五收盘聚合）
     weekly_close = df['close'].resample('W-FRI').last().dropna()
-    if len(weekly_close) < 30:
+    if len(weekly_close) < warmup // 5:
         return {'passed': False}
 
-    ema12 = _ema(weekly_close, 12)
-    ema26 = _ema(weekly_close, 26)
-    dif = ema12 - ema26
-    dea = _ema(dif, 9)
+    dif = _ema(weekly_close, int(p['macd_fast'])) - _ema(weekly_close, int(p['macd_slow']))
+    dea = _ema(dif, int(p['macd_signal']))
 
     # 计算每个周点是否产生“完整周线信号”
     if len(dif) < 2 or len(dea) < 2:
@@ -217,7 +112,7 @@ def screen_stock(df: pd.DataFrame, params: dict | None = None):
     prev_dea = dea.shift(1)
     cond_cross = (prev_dif <= prev_dea) & (dif > dea)
     cond_range = (dif.between(-0.05, 0.15))
-    dif_hist_series = dif.shift(1).rolling(20).apply(lambda x: float(np.quantile(x, 0.2)) if np.isfinite(x).all() else np.nan, raw=False)
+    dif_hist_series = dif.shift(1).rolling(DIF_QUANTILE_WEEKS).apply(lambda x: float(np.quantile(x, 0.2)) if np.isfinite(x).all() else np.nan, raw=False)
     cond_lowpct = dif <= dif_hist_series
     full_signal = cond_cross & cond_range & cond_lowpct
     # 最近一次周线信号周（索引为周五标签）
@@ -5,18 +5,18 @@ import pandas as pd
 from typing import Dict, Type, List, Any
 from datetime import datetime, timedelta
 from data.database import Database
+from strategies.base import build_signals
+from utils.timing import timed, span, current_span
 import backtrader as bt
 import logging
 
 class StrategyManager:
     def __init__(self, db: Database):
         self.db = db
-        # 先初始化strategy_modules字典
+        # 先初始化strategy_modules字典（策略名 -> 模块，用于 screen_stock / compute_signals 等辅助函数）
         self.strategy_modules: Dict[str, Any] = {}
         # 再调用_load_strategies方法
         self.strategies: Dict[str, Type[bt.Strategy]] = self._load_strategies()
-        # Map strategy name to its module to allow custom screening helpers
-        self.strategy_modules: Dict[str, Any] = {}
 
     def _load_strategies(self) -> Dict[str, Type[bt.Strategy]]:
         """动态加载所有策略类"""
@@ -41,6 +41,7 @@ class StrategyManager:
         """按名称获取策略类"""
         return self.strategies.get(name)
 
+    @timed('run_screening')
     def run_screening(self, strategy_name: str, ts_codes: List[str], strategy_params: Dict[str, Any] | None = None) -> List[Dict[str, Any]]:
         """
         为“选股”功能运行策略。
@@ -51,6 +52,7 @@ class StrategyManager:
             logging.getLogger(__name__).error(f"Strategy {strategy_name} not found.")
             return []
 
+        current_span().set(strategy=strategy_name, tickers=len(ts_codes))
         selected_stocks = []
         module = self.strategy_modules.get(strategy_name)
         has_custom_screen = hasattr(module, 'screen_stock') if module else False
@@ -59,22 +61,25 @@ class StrategyManager:
             end_date = datetime.now().strftime('%Y%m%d')
             start_date = (datetime.now() - timedelta(days=365)).strftime('%Y%m%d')
             query = "SELECT date, open, high, low, close, volume FROM daily_price WHERE ts_code = ? AND date BETWEEN ? AND ? ORDER BY date"
-            df = pd.DataFrame(self.db.fetch_all(query, (ts_code, start_date, end_date)))
-            
-            if df.empty or len(df) < 240: # 确保有足够的数据来计算指标
-                continue
-
-            df['date'] = pd.to_datetime(df['date'])
-            df.set_index('date', inplace=True)
+            with span('sql') as sql:
+                rows = self.db.fetch_all(query, (ts_code, start_date, end_date))
+                sql.add(rows=len(rows))
+            with span('dataframe'):
+                df = pd.DataFrame(rows)
+                if df.empty or len(df) < 240: # 确保有足够的数据来计算指标
+                    continue
+                df['date'] = pd.to_datetime(df['date'])
+                df.set_index('date', inplace=True)
 
             if has_custom_screen:
                 try:
                     # 向自定义筛选器传参（可选）
-                    try:
-                        decision = module.screen_stock(df.copy(), params=(strategy_params or {}))
-                    except TypeError:
-                        # 兼容旧签名 screen_stock(df)
-                        decision = module.screen_stock(df.copy())
+                    with span('indicators'):
+                        try:
+                            decision = module.screen_stock(df.copy(), params=(strategy_params or {}))
+                        except TypeError:
+                            # 兼容旧签名 screen_stock(df)
+                            decision = module.screen_stock(df.copy())
                     passed = False
                     details: Dict[str, Any] = {}
                     if isinstance(decision, dict):
@@ -95,16 +100,14 @@ class StrategyManager:
                 except Exception as e:
                     logging.getLogger(__name__).exception(f"Custom screening failed for {ts_code}: {e}")
 
-            # Fallback: run a lightweight backtrader check (may be less accurate)
-            cerebro = bt.Cerebro(stdstats=False)
-            data_feed = bt.feeds.PandasData(dataname=df)
-            # pass mode to avoid trades affecting screening (if supported)
+            # Fallback: 使用策略的预计算信号，判定最后一日是否出现买入信号
             try:
-                cerebro.addstrategy(strategy_class)
-            except Exception:
-                cerebro.addstrategy(strategy_class)
-            thestrat = cerebro.run()[0]
-            if thestrat.position:
+                with span('indicators'):
+                    signals = build_signals(strategy_class, df, strategy_params)
+            except ValueError as e:
+                logging.getLogger(__name__).warning(f"{e}，跳过 {ts_code}")
+                continue
+            if bool(signals['entry'].iloc[-1]):
                 stock_info = self.db.fetch_one("SELECT name FROM stocks WHERE ts_code = ?", (ts_code,))
                 selected_stocks.append({
                     'ts_code': ts_code,
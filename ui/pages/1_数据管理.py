@@ -5,7 +5,7 @@ import streamlit as st
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from utils.ui_helpers import init_state, show_status_panel
+from utils.ui_helpers import init_state, show_status_panel, show_timing_details
 
 init_state()
 show_status_panel()
@@ -49,4 +49,6 @@ if c4.button("更新自选指数行情数据"):
         count = data_fetcher.update_index_watchlist_data(force_start_date=start_date_str)
         st.session_state.message = {"type": "success", "body": f"自选指数数据更新完成，共处理 {count} 个指数。"}
         st.rerun()
+show_timing_details('update_watchlist_data', "性能详情（自选股行情更新）")
+show_timing_details('update_index_watchlist_data', "性能详情（自选指数行情更新）")
 
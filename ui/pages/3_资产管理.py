@@ -6,8 +6,10 @@ import plotly.express as px
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from utils.ui_helpers import init_state, show_status_panel
+from utils.ui_helpers import init_state, show_status_panel, show_timing_details
 from utils.code_processor import to_ts_code
+from portfolio.manager import generate_reports
+from portfolio.importer import read_fill_file, import_fills
 
 init_state()
 show_status_panel()
@@ -49,6 +51,20 @@ else:
                 st.session_state.message = {"type": "error", "body": f"交易失败: {e}"}
                 st.rerun()
 
+    with st.expander("批量导入成交记录"):
+        st.caption("支持券商导出的交割单（CSV/Excel），需包含成交日期、证券代码、买卖方向、成交价格、成交数量列；"
+                   "含“资金账号/组合”列时按组合分别导入（组合需已初始化资金）。整个文件校验通过才会写入。")
+        fill_file = st.file_uploader("选择成交文件", type=['csv', 'xls', 'xlsx'])
+        if fill_file is not None and st.button("导入"):
+            try:
+                counts = import_fills(db, read_fill_file(fill_file.getvalue(), fill_file.name), pm.portfolio_name)
+                pm.load_portfolio()
+                st.session_state.message = {"type": "success", "body": "导入成功: " + "，".join(f"{k} {v} 笔" for k, v in counts.items())}
+                st.rerun()
+            except ValueError as e:
+                st.error(f"导入失败: {e}")
+        show_timing_details('import_fills')
+
     st.divider()
     st.subheader("投资组合概览")
     if st.button("刷新投资组合报告"):
@@ -68,18 +84,30 @@ else:
             else:
                 st.info("当前无任何持仓")
 
+    with st.expander("全部组合估值"):
+        if st.button("刷新全部组合"):
+            reports = generate_reports(db)
+            st.dataframe(pd.DataFrame([{'组合': name, '总资产': r['summary']['total_value'], '现金': r['cash'],
+                                        '持仓市值': r['summary']['investment_value'], '持仓数量': r['summary']['position_count']}
+                                       for name, r in reports.items()]), hide_index=True)
+            show_timing_details('generate_reports')
+
     st.divider()
     st.subheader("净值快照")
+    st.caption("新增交易与行情更新后，快照会从受影响的日期起自动增量更新；手工修改过历史数据时可全量重建。")
     c1, c2 = st.columns(2)
     if c1.button("重建净值快照"):
         with st.spinner("正在重建净值快照..."):
             days = pm.rebuild_snapshots()
             st.success(f"已生成 {days} 天的组合净值快照。")
+        show_timing_details('rebuild_snapshots')
     if c2.button("查看净值曲线"):
         df_snap = pm.get_snapshots()
         if df_snap is not None and not df_snap.empty:
-            import plotly.express as px
-            fig = px.line(df_snap.reset_index(), x='date', y='total_value', title='组合净值曲线')
+            import plotly.graph_objects as go
+            from utils.plotting import line_trace
+            fig = go.Figure(line_trace(df_snap['total_value'], '组合净值'))
+            fig.update_layout(title='组合净值曲线', xaxis_title='date', yaxis_title='total_value')
             st.plotly_chart(fig, use_container_width=True)
         else:
             st.info("暂无快照数据，请先重建净值快照。")
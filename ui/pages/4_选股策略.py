@@ -5,7 +5,7 @@ import pandas as pd
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from utils.ui_helpers import init_state, show_status_panel
+from utils.ui_helpers import init_state, show_status_panel, show_timing_details
 
 init_state()
 show_status_panel()
@@ -64,3 +64,4 @@ if st.button("开始选股", type="primary"):
             )
         else:
             st.info("根据最新数据，您的自选股中没有找到符合该策略条件的股票。")
+    show_timing_details('run_screening')
@@ -3,12 +3,13 @@ import sys
 from datetime import date
 import streamlit as st
 import pandas as pd
-import plotly.express as px
+import plotly.graph_objects as go
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from utils.ui_helpers import init_state, show_status_panel
 from analysis.market_comparison import compare_indices
+from utils.plotting import line_trace
 
 init_state()
 show_status_panel()
@@ -97,10 +98,11 @@ if st.session_state.get('carousel_started'):
                 latest_ma10 = result_df[result_df['date'] == latest_date]['c_ma10'].iloc[0] if 'c_ma10' in result_df.columns else None
                 if pd.notna(latest_ma10):
                     st.info(f"截至 {latest_date.strftime('%Y年%m月%d日')}，比值为 {latest_ratio:.3f}，MA10 为 {latest_ma10:.3f}。")
-                fig = px.line(result_df, x='date', y=['ratio_c', 'c_ma10', 'c_ma20', 'c_ma60'],
-                              title=f'{comparison_label} vs {base_selection} 收盘价比值',
-                              labels={'value': '比值', 'date': '日期', 'variable': '指标'})
-                fig.update_layout(legend_title_text='指标图例')
+                curves = result_df.set_index(pd.to_datetime(result_df['date']))
+                fig = go.Figure([line_trace(curves[col], col) for col in ['ratio_c', 'c_ma10', 'c_ma20', 'c_ma60']
+                                 if col in curves.columns])
+                fig.update_layout(title=f'{comparison_label} vs {base_selection} 收盘价比值',
+                                  xaxis_title='日期', yaxis_title='比值', legend_title_text='指标图例')
                 fig.update_xaxes(tickformat="%Y-%m-%d", dtick="M1", ticklabelmode="period")
                 st.plotly_chart(fig, use_container_width=True)
                 st.subheader("📋 详细数据")
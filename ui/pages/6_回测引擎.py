@@ -1,3 +1,4 @@
+import json
 import os
 import sys
 from datetime import date
@@ -5,8 +6,11 @@ import streamlit as st
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from utils.ui_helpers import init_state, show_status_panel
-from backtest.engine import run_backtest
+from utils.ui_helpers import init_state, show_status_panel, show_timing_details
+from backtest.engine import run_backtest, create_backtest_plot, trades_csv_bytes, orders_csv_bytes
+from utils.plotting import DEFAULT_MAX_POINTS, line_trace
+from backtest.run_store import BacktestRunStore
+from backtest.jobs import submit_job, list_jobs, get_job, cancel_job, ensure_worker_pool, worker_pool_alive
 
 init_state()
 show_status_panel()
@@ -14,6 +18,86 @@ show_status_panel()
 db = st.session_state.db
 sm = st.session_state.sm
 
+
+def show_result(result):
+    """展示一次回测的指标、图表、基准对比与导出文件。"""
+    st.subheader("回测结果摘要")
+    if result.get('cached'):
+        st.caption(f"已从回测记录读取（记录ID：{result['run_id']}），未重新计算。")
+    else:
+        st.caption(f"回测结果已保存（记录ID：{result['run_id']}）。")
+    metrics = result.get('metrics', {})
+    cols = st.columns(4)
+    cols[0].metric("策略总收益率", f"{metrics.get('total_return', 0):.2f}%")
+    cols[1].metric("策略年化收益率", f"{metrics.get('annual_return', 0):.2f}%")
+    cols[2].metric("最大回撤", f"{metrics.get('max_drawdown', 0):.2f}%")
+    cols[3].metric("夏普比率", f"{metrics.get('sharpe_ratio') or 0:.2f}")
+    cols = st.columns(4)
+    cols[0].metric("索提诺比率", f"{metrics.get('sortino_ratio') or 0:.2f}")
+    cols[1].metric("卡玛比率", f"{metrics.get('calmar_ratio') or 0:.2f}")
+    cols[2].metric("最长回撤期", f"{metrics.get('max_drawdown_duration', 0)} 天")
+    cols[3].metric("胜率", f"{metrics.get('win_rate', 0):.1f}%")
+    cols = st.columns(4)
+    cols[0].metric("盈利因子", f"{metrics.get('profit_factor') or 0:.2f}")
+    cols[1].metric("年化换手率", f"{metrics.get('turnover') or 0:.2f} 倍")
+    cols[2].metric("平均仓位", f"{metrics.get('exposure') or 0:.1f}%")
+    cols[3].metric("交易次数", f"{metrics.get('total_trades', 0)}")
+    st.subheader("回测图表")
+    figure = result['plot_figure']
+    plot_data = result.get('plot_data')
+    if plot_data is not None and len(plot_data['values']) > DEFAULT_MAX_POINTS:
+        # 长区间曲线已降采样；选择子区间后按原始数据重绘，区间足够短时为全分辨率
+        dates = list(plot_data['values'].index.date)
+        zoom = st.select_slider("图表区间（缩小区间可查看原始分辨率）", options=dates,
+                                value=(dates[0], dates[-1]), key=f"zoom_{result['run_id']}")
+        if zoom != (dates[0], dates[-1]):
+            figure = create_backtest_plot(**plot_data, x_range=zoom)
+    st.plotly_chart(figure, use_container_width=True)
+
+    bench_stats = result.get('benchmark_stats')
+    if bench_stats is not None and not bench_stats.empty:
+        st.subheader("相对基准表现")
+        st.dataframe(bench_stats.reset_index().rename(columns={
+            'ts_code': '指数代码', 'name': '指数名称', 'excess_return': '超额收益(%)', 'beta': 'Beta',
+            'alpha': '年化Alpha(%)', 'tracking_error': '跟踪误差(%)', 'information_ratio': '信息比率',
+        }).round(4), hide_index=True, use_container_width=True)
+
+    st.caption(f"预热K线：开始日期前 {result.get('warmup_bars', 0)} 根；本次回测峰值内存 {result.get('peak_rss_mb', 0):.0f} MB")
+    # 展示被忽略的股票（区间内无行情）
+    skipped = result.get('skipped_ts_codes') or []
+    if skipped:
+        st.info(f"有 {len(skipped)} 只股票在回测区间内没有行情数据，已被忽略。")
+        try:
+            placeholders = ','.join('?' for _ in skipped)
+            q = f"SELECT ts_code, name FROM watchlist WHERE ts_code IN ({placeholders})"
+            rows = db.fetch_all(q, tuple(skipped))
+            if rows:
+                import pandas as pd
+                with st.expander("查看被忽略的股票名单"):
+                    st.dataframe(pd.DataFrame(rows), hide_index=True)
+            else:
+                st.write(', '.join(skipped))
+        except Exception:
+            st.write(', '.join(skipped))
+    show_timing_details('run_backtest')
+    # 交易与订单明细保存在回测记录的列式文件中，点击时才读取并生成 CSV
+    if st.button("生成交易记录与订单明细下载", key=f"export_{result['run_id']}"):
+        run = BacktestRunStore(db).load(result['run_id'])
+        if run is None:
+            st.info("回测记录文件暂不可用。")
+        else:
+            st.session_state['backtest_exports'] = {
+                'run_id': result['run_id'],
+                'trades': trades_csv_bytes(run['closed_trades']),
+                'orders': orders_csv_bytes(run['executed_orders']),
+            }
+    exports = st.session_state.get('backtest_exports')
+    if exports and exports['run_id'] == result['run_id']:
+        st.download_button("下载回测交易记录", data=exports['trades'],
+                           file_name=f"backtest_trades_{result['run_id'][:8]}.csv", mime="text/csv")
+        st.download_button("下载订单执行明细（含买入/卖出）", data=exports['orders'],
+                           file_name=f"backtest_orders_{result['run_id'][:8]}.csv", mime="text/csv")
+
 st.header("回测引擎")
 st.subheader("回测参数设置")
 col1, col2 = st.columns(2)
@@ -50,7 +134,22 @@ elif strategy_name == 'WeeklyMACDFilterStrategy':
         'signal_valid_days': int(valid_days)
     }
 date_range = st.date_input("选择回测时间周期", [date(2024, 1, 1), date.today()], key="backtest_date_range")
-normalized = st.toggle("显示归一化净值（与沪深300对比）", value=True)
+normalized = st.toggle("显示归一化净值", value=True)
+index_rows = db.fetch_all("SELECT ts_code, name FROM index_watchlist ORDER BY ts_code")
+benchmark_options = {r['ts_code']: f"{r['name']} ({r['ts_code']})" for r in index_rows}
+benchmark_options.setdefault('000300.SH', "沪深300 (000300.SH)")
+benchmarks = st.multiselect("对比基准指数", list(benchmark_options.keys()), default=['000300.SH'],
+                            format_func=benchmark_options.get,
+                            help="可选自选指数列表中的任意指数（如中证500、中证1000、申万行业指数），需先在数据管理中更新其行情")
+engine_labels = {
+    "Backtrader（逐K线）": 'backtrader',
+    "向量化（NumPy，速度快）": 'vectorized',
+    "全市场低内存（内存映射）": 'memmap',
+}
+engine_label = st.radio("回测引擎", list(engine_labels.keys()), horizontal=True,
+                        help="三种引擎撮合口径一致；向量化引擎预先批量计算信号，适合大股票池；"
+                             "低内存模式分批计算信号并写入 float32 内存映射文件，适合全市场长周期回测")
+engine = engine_labels[engine_label]
 if date_range and len(date_range) == 2:
     start_date, end_date = date_range
 else:
@@ -64,7 +163,7 @@ if not backtest_pool:
     st.warning("您的回测池为空。请先在“自选列表管理”页面将股票加入回测池。")
 else:
     st.success(f"当前回测池中有 {len(backtest_pool)} 只股票可供回测。")
-    st.info("提示：回测会自动忽略样本长度不足 241 个交易日的股票。")
+    st.info("提示：回测会在开始日期之前自动加载策略所需的预热K线，交易与收益统计从开始日期起算；回测区间内无行情的股票会被忽略。")
     with st.expander("查看回测池中的股票"):
         placeholders = ','.join('?' for _ in backtest_pool)
         query = f"SELECT ts_code, name FROM watchlist WHERE ts_code IN ({placeholders})"
@@ -73,58 +172,100 @@ else:
             import pandas as pd
             st.dataframe(pd.DataFrame(pool_details), hide_index=True)
 
+    force_rerun = st.checkbox("忽略历史结果，强制重新计算", value=False,
+                              help="相同参数、股票池、区间与数据版本的回测会直接读取已保存的结果")
+    run_in_background = st.checkbox("后台运行（可查看进度、取消，刷新页面不丢失）", value=True,
+                                    help="提交到独立的回测工作进程池执行，不占用页面进程")
     if st.button("开始回测", type="primary"):
         start_str, end_str = start_date.strftime('%Y%m%d'), end_date.strftime('%Y%m%d')
-        with st.spinner(f"正在使用 Backtrader 引擎进行回测..."):
-            result = run_backtest(strategy_name, list(backtest_pool), start_str, end_str, initial_capital, max_positions, normalized, strategy_params)
+        request = dict(strategy_name=strategy_name, ts_codes=sorted(backtest_pool), start_date=start_str,
+                       end_date=end_str, initial_capital=float(initial_capital), max_positions=int(max_positions),
+                       normalized=normalized, strategy_params=strategy_params, engine=engine,
+                       use_cache=not force_rerun, benchmarks=benchmarks)
+        if run_in_background:
+            ensure_worker_pool()
+            job_id = submit_job(db, request)
+            st.success(f"已提交后台回测任务 #{job_id}，可在下方“后台回测任务”中查看进度。")
+        else:
+            with st.spinner(f"正在使用 {engine_label} 引擎进行回测..."):
+                result = run_backtest(**request)
             if result:
-                st.subheader("回测结果摘要")
-                metrics = result.get('metrics', {})
-                cols = st.columns(4)
-                cols[0].metric("策略总收益率", f"{metrics.get('total_return', 0):.2f}%")
-                cols[1].metric("策略年化收益率", f"{metrics.get('annual_return', 0):.2f}%")
-                cols[2].metric("最大回撤", f"{metrics.get('max_drawdown', 0):.2f}%")
-                cols[3].metric("夏普比率", f"{metrics.get('sharpe_ratio') or 0:.2f}")
-                st.subheader("回测图表")
-                st.plotly_chart(result['plot_figure'], use_container_width=True)
-
-                # 展示被忽略的股票（样本不足）
-                skipped = result.get('skipped_ts_codes') or []
-                if skipped:
-                    st.info(f"有 {len(skipped)} 只股票因样本长度不足（< {result.get('min_required_bars', 241)} 个交易日）被忽略。")
-                    try:
-                        placeholders = ','.join('?' for _ in skipped)
-                        q = f"SELECT ts_code, name FROM watchlist WHERE ts_code IN ({placeholders})"
-                        rows = db.fetch_all(q, tuple(skipped))
-                        if rows:
-                            import pandas as pd
-                            with st.expander("查看被忽略的股票名单"):
-                                st.dataframe(pd.DataFrame(rows), hide_index=True)
-                        else:
-                            st.write(', '.join(skipped))
-                    except Exception:
-                        st.write(', '.join(skipped))
-                if result.get('trades_csv'):
-                    try:
-                        with open(result['trades_csv'], 'rb') as f:
-                            st.download_button(
-                                label="下载回测交易记录",
-                                data=f.read(),
-                                file_name=os.path.basename(result['trades_csv']),
-                                mime="text/csv"
-                            )
-                    except Exception:
-                        st.info("交易记录文件暂不可用。")
-                if result.get('orders_csv'):
-                    try:
-                        with open(result['orders_csv'], 'rb') as f:
-                            st.download_button(
-                                label="下载订单执行明细（含买入/卖出）",
-                                data=f.read(),
-                                file_name=os.path.basename(result['orders_csv']),
-                                mime="text/csv"
-                            )
-                    except Exception:
-                        st.info("订单执行明细文件暂不可用。")
+                show_result(result)
             else:
                 st.error("回测执行失败或没有产生任何结果。")
+
+st.divider()
+st.subheader("后台回测任务")
+jobs_df = list_jobs(db, limit=20)
+if jobs_df.empty:
+    st.info("暂无后台回测任务。")
+else:
+    status_labels = {'queued': '排队中', 'running': '运行中', 'done': '已完成', 'failed': '失败', 'cancelled': '已取消'}
+    c1, c2 = st.columns([1, 3])
+    if c1.button("刷新任务状态"):
+        st.rerun()
+    if (jobs_df['status'].isin(['queued', 'running']).any()) and not worker_pool_alive():
+        c2.warning("没有运行中的回测工作进程，排队任务将在下次提交时由自动启动的进程池执行。")
+    view = jobs_df.assign(状态=jobs_df['status'].map(status_labels), progress=jobs_df['progress'] * 100)[
+        ['job_id', '状态', 'strategy', 'engine', 'period', 'n_codes', 'progress', 'message', 'submitted_at', 'finished_at']]
+    st.dataframe(view, hide_index=True, use_container_width=True, column_config={
+        'progress': st.column_config.ProgressColumn("进度", min_value=0, max_value=100, format="%.0f%%"),
+    })
+    active = jobs_df[jobs_df['status'].isin(['queued', 'running']) & (jobs_df['cancel_requested'] == 0)]
+    if not active.empty:
+        cc1, cc2 = st.columns([3, 1])
+        cancel_id = cc1.selectbox("选择要取消的任务", active['job_id'].tolist(), key="cancel_job_id")
+        if cc2.button("取消任务"):
+            cancel_job(db, int(cancel_id))
+            st.rerun()
+    finished = jobs_df[jobs_df['status'] == 'done']
+    if not finished.empty:
+        fc1, fc2 = st.columns([3, 1])
+        view_id = fc1.selectbox("选择已完成的任务查看结果", finished['job_id'].tolist(), key="view_job_id")
+        if fc2.button("查看结果"):
+            st.session_state.view_job_id = int(view_id)
+    if st.session_state.get('view_job_id'):
+        job = get_job(db, st.session_state.view_job_id)
+        if job and job['status'] == 'done':
+            # 结果已在回测记录库中，按原请求读取（不会重新计算）
+            with st.spinner("正在读取回测结果..."):
+                show_result(run_backtest(**{**job['request'], 'use_cache': True}))
+
+st.divider()
+st.subheader("历史回测记录")
+run_store = BacktestRunStore(db)
+runs_df = run_store.list_runs()
+if runs_df.empty:
+    st.info("暂无已保存的回测记录。")
+else:
+    metric_labels = {
+        'total_return': '总收益率(%)', 'annual_return': '年化收益率(%)', 'max_drawdown': '最大回撤(%)',
+        'sharpe_ratio': '夏普比率', 'sortino_ratio': '索提诺比率', 'calmar_ratio': '卡玛比率',
+        'max_drawdown_duration': '最长回撤期(天)', 'total_trades': '交易次数', 'win_rate': '胜率(%)',
+        'profit_factor': '盈利因子', 'turnover': '年化换手率(倍)', 'exposure': '平均仓位(%)',
+    }
+    display_cols = ['run_id', 'created_at', 'strategy', 'engine', 'start_date', 'end_date', 'n_codes',
+                    'max_positions'] + [c for c in metric_labels if c in runs_df.columns]
+    st.dataframe(runs_df[display_cols].rename(columns=metric_labels), hide_index=True, use_container_width=True)
+
+    labels = {r['run_id']: f"{r['strategy']} {r['start_date']}~{r['end_date']} ({r['run_id'][:8]})"
+              for _, r in runs_df.iterrows()}
+    selected_runs = st.multiselect("选择要对比的回测记录", list(labels.keys()), format_func=labels.get,
+                                   max_selections=8)
+    if selected_runs:
+        import pandas as pd
+        import plotly.graph_objects as go
+        fig = go.Figure()
+        compare_rows = []
+        for run_id in selected_runs:
+            run = run_store.load(run_id, events=False)
+            if run is None:
+                st.warning(f"记录 {run_id} 的结果文件已丢失。")
+                continue
+            curve = run['values'] / float(run['initial_capital'])
+            fig.add_trace(line_trace(curve, labels[run_id]))
+            compare_rows.append({'记录': labels[run_id], '参数': json.dumps(run['params'], ensure_ascii=False),
+                                 **{metric_labels.get(k, k): v for k, v in run['metrics'].items()}})
+        fig.update_layout(title="归一化净值对比", xaxis_title="日期", yaxis_title="净值", hovermode='x unified')
+        st.plotly_chart(fig, use_container_width=True)
+        st.dataframe(pd.DataFrame(compare_rows), hide_index=True, use_container_width=True)
@@ -6,7 +6,7 @@ import plotly.express as px
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from utils.ui_helpers import init_state, show_status_panel
+from utils.ui_helpers import init_state, show_status_panel, show_timing_details
 
 init_state()
 show_status_panel()
@@ -26,6 +26,22 @@ if st.button("开始分析"):
             col2.metric("99% VaR", f"{risk_report['var_99']:.2f}%")
             col3.metric("95% CVaR", f"{risk_report['cvar_95']:.2f}%")
             col4.metric("行业集中度 (HHI)", f"{risk_report['hhi']:.2f}")
+            position_risk = risk_report['position_risk']
+            st.subheader("持仓层面 VaR / CVaR（一日）")
+            if position_risk['window']:
+                st.caption(f"按当前持仓市值，在截至 {position_risk['asof']} 的 {position_risk['window']} 个交易日收益率上计算；"
+                           f"参数法使用收缩协方差（收缩强度 {position_risk['shrinkage']:.2f}）。")
+                rows = []
+                for method, label in (('historical', '历史模拟'), ('parametric', '参数法（收缩协方差）')):
+                    for level, m in position_risk[method].items():
+                        rows.append({'方法': label, '置信度': f"{level:.0%}", 'VaR(元)': m['var'], 'VaR(%)': m['var_pct'],
+                                     'CVaR(元)': m['cvar'], 'CVaR(%)': m['cvar_pct']})
+                st.dataframe(pd.DataFrame(rows).style.format({'VaR(元)': '{:,.0f}', 'VaR(%)': '{:.2f}',
+                                                               'CVaR(元)': '{:,.0f}', 'CVaR(%)': '{:.2f}'}), hide_index=True)
+                contrib = pd.Series(position_risk['component_var'], name='VaR 贡献(元)').sort_values(ascending=False)
+                st.plotly_chart(px.bar(contrib.head(20), title='参数法 VaR 成分贡献（前 20）'), use_container_width=True)
+            else:
+                st.info("当前无持仓或缺少行情，无法计算持仓层面风险。")
             st.subheader("风险违规")
             if risk_report['violations']:
                 st.dataframe(pd.DataFrame(risk_report['violations']))
@@ -34,3 +50,89 @@ if st.button("开始分析"):
         except Exception as e:
             st.error(f"风险分析失败: {e}")
 
+show_timing_details('analyze_portfolio_risk')
+
+
+st.header("蒙特卡洛模拟")
+st.caption("按当前持仓模拟未来若干交易日的盈亏路径：正态法使用收缩协方差的 Cholesky 分解生成相关收益，"
+           "块自助法按块重抽历史收益率；同样的随机种子得到同样的结果。")
+with st.form("monte_carlo"):
+    col1, col2, col3, col4 = st.columns(4)
+    mc_method = col1.selectbox("方法", ['cholesky', 'bootstrap'],
+                               format_func=lambda m: {'cholesky': '正态（Cholesky）', 'bootstrap': '块自助法'}[m])
+    mc_paths = col2.select_slider("路径数", options=[10_000, 20_000, 50_000, 100_000, 200_000], value=100_000)
+    mc_seed = col3.number_input("随机种子", min_value=0, value=0, step=1)
+    mc_block = col4.number_input("自助块长（天）", min_value=1, max_value=60, value=5, step=1)
+    mc_horizons = st.multiselect("持有期（交易日）", [1, 5, 10, 20, 60], default=[1, 5, 20])
+    submitted = st.form_submit_button("开始模拟")
+if submitted:
+    with st.spinner("正在模拟..."):
+        try:
+            st.session_state.mc_result = ra.monte_carlo_risk(horizons=mc_horizons, n_paths=int(mc_paths),
+                                                             method=mc_method, block=int(mc_block), seed=int(mc_seed))
+        except Exception as e:
+            st.session_state.mc_result = None
+            st.error(f"蒙特卡洛模拟失败: {e}")
+
+mc = st.session_state.get('mc_result')
+if mc is not None:
+    if not mc['horizons']:
+        st.info("当前无持仓或缺少行情，无法模拟。")
+    else:
+        st.caption(f"{mc['n_paths']:,} 条路径，收益率窗口 {mc['window']} 个交易日（截至 {mc['asof']}），随机种子 {mc['seed']}。")
+        rows = []
+        for h, m in mc['horizons'].items():
+            row = {'持有期(日)': h}
+            for level in m['var']:
+                row[f"VaR {level:.0%}(元)"] = m['var'][level]
+                row[f"VaR {level:.0%}(%)"] = m['var_pct'][level]
+                row[f"CVaR {level:.0%}(元)"] = m['cvar'][level]
+            row['最大回撤中位数(%)'] = m['max_drawdown']['p50'] * 100
+            row['最大回撤 95%分位(%)'] = m['max_drawdown']['p95'] * 100
+            rows.append(row)
+        table = pd.DataFrame(rows)
+        st.dataframe(table.style.format({c: ('{:,.0f}' if '(元)' in c else '{:.2f}') for c in table.columns
+                                         if c != '持有期(日)'}), hide_index=True)
+        h = st.selectbox("盈亏分布", list(mc['horizons']), index=len(mc['horizons']) - 1,
+                         format_func=lambda d: f"{d} 个交易日")
+        counts, edges = mc['horizons'][h]['histogram']
+        hist = pd.DataFrame({'盈亏(元)': (edges[:-1] + edges[1:]) / 2, '路径数': counts})
+        st.plotly_chart(px.bar(hist, x='盈亏(元)', y='路径数', title=f"{h} 日盈亏分布"), use_container_width=True)
+
+show_timing_details('monte_carlo_risk')
+
+
+st.header("风险指标历史")
+st.caption("基于组合每日净值快照的滚动指标；结果缓存在数据库中，新增或改写的快照日期才会重新计算。")
+index_rows = st.session_state.db.fetch_all("SELECT ts_code, name FROM index_watchlist ORDER BY ts_code")
+col1, col2 = st.columns(2)
+benchmark = col1.selectbox("基准指数", [r['ts_code'] for r in index_rows] or ['000300.SH'],
+                           format_func=lambda c: next((f"{c} {r['name']}" for r in index_rows if r['ts_code'] == c), c))
+window = col2.select_slider("滚动窗口（交易日）", options=[20, 60, 120, 250], value=60)
+try:
+    series = ra.rolling_risk(benchmark, window)
+except Exception as e:
+    series = None
+    st.error(f"滚动风险计算失败: {e}")
+if series is not None and series.empty:
+    st.info("暂无组合净值快照，无法计算风险指标历史。")
+elif series is not None:
+    latest = series.iloc[-1]
+    col1, col2, col3, col4, col5 = st.columns(5)
+    col1.metric("年化波动率", f"{latest['volatility']:.2f}%")
+    col2.metric("95% VaR（一日）", f"{latest['var_95']:.2f}%")
+    col3.metric("当前回撤", f"{latest['drawdown']:.2f}%", f"水下 {latest['underwater_days']} 天", delta_color="off")
+    col4.metric("Beta", f"{latest['beta']:.2f}")
+    col5.metric("夏普比率", f"{latest['sharpe']:.2f}")
+    tab1, tab2, tab3 = st.tabs(["波动率与 VaR", "回撤", "Beta 与夏普"])
+    with tab1:
+        st.plotly_chart(px.line(series[['volatility', 'var_95']].rename(
+            columns={'volatility': '年化波动率(%)', 'var_95': '95% VaR(%)'})), use_container_width=True)
+    with tab2:
+        st.plotly_chart(px.area(-series['drawdown'].rename('回撤(%)')), use_container_width=True)
+        st.plotly_chart(px.line(series['underwater_days'].rename('水下天数')), use_container_width=True)
+    with tab3:
+        st.plotly_chart(px.line(series[['beta', 'sharpe']].rename(columns={'beta': 'Beta', 'sharpe': '夏普比率'})),
+                        use_container_width=True)
+
+show_timing_details('rolling_risk')
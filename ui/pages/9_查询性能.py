@@ -0,0 +1,55 @@
+import os
+import sys
+import streamlit as st
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.ui_helpers import init_state, show_status_panel
+from data.query_stats import STATS, top_statements, reset_statements
+
+init_state()
+show_status_panel()
+
+db = st.session_state.db
+
+st.header("查询性能")
+st.info("统计各类 SQL 语句的调用次数与耗时，找出开销最大的查询（逐标的 N+1 查询、缺少索引的全表扫描等）。"
+        "统计默认关闭：设置环境变量 DB_QUERY_STATS=true 对所有进程开启，或在下方仅对当前页面进程开启。")
+
+col1, col2, col3 = st.columns([1, 1, 1])
+with col1:
+    enabled = st.toggle("记录查询统计（当前进程）", value=STATS.enabled)
+    if enabled != STATS.enabled:
+        STATS.enabled = enabled
+with col2:
+    sort_labels = {'累计耗时': 'total_ms', '调用次数': 'calls', 'p95 耗时': 'p95_ms', '最大耗时': 'max_ms', '返回行数': 'rows'}
+    sort_by = sort_labels[st.selectbox("排序", list(sort_labels))]
+with col3:
+    limit = st.number_input("显示条数", min_value=5, max_value=200, value=20, step=5)
+
+st.caption(f"慢查询阈值 {STATS.slow_ms:.0f} ms（DB_SLOW_QUERY_MS），超过阈值的语句连同查询计划写入日志。")
+
+rows = top_statements(db, int(limit), sort_by, explain=True)
+if not rows:
+    st.warning("暂无查询统计。开启统计后使用其它页面（选股、回测、资产管理等），再回到本页查看。")
+else:
+    df = pd.DataFrame(rows)
+    display = df[['statement', 'calls', 'total_ms', 'avg_ms', 'p95_ms', 'max_ms', 'rows', 'slow_calls', 'notes']].rename(
+        columns={'statement': '语句', 'calls': '调用次数', 'total_ms': '累计耗时(ms)', 'avg_ms': '平均(ms)',
+                 'p95_ms': 'p95(ms)', 'max_ms': '最大(ms)', 'rows': '行数', 'slow_calls': '慢查询次数', 'notes': '提示'})
+    st.dataframe(display.style.format({'累计耗时(ms)': '{:.1f}', '平均(ms)': '{:.2f}', 'p95(ms)': '{:.2f}',
+                                       '最大(ms)': '{:.1f}'}), use_container_width=True, hide_index=True)
+    flagged = df[df['notes'] != '']
+    if not flagged.empty:
+        st.subheader("需要关注的语句")
+        for _, row in flagged.iterrows():
+            with st.expander(f"{row['statement'][:100]}"):
+                st.code(row['statement'], language='sql')
+                st.write(row['notes'])
+                if row.get('plan'):
+                    st.caption(f"查询计划: {row['plan']}")
+
+if st.button("清空统计"):
+    reset_statements(db)
+    st.rerun()
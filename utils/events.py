@@ -0,0 +1,146 @@
+"""
+结构化事件日志：按级别开关的交易/组合事件通道，取代策略与组合管理中的 print()。
+
+- 事件为 (类型, 级别, 字段)：字段是原始值（日期、代码、价格），不预先拼接字符串；
+  级别低于阈值的事件在 is_enabled() 处即被丢弃，调用方据此跳过字段的计算，关闭时几乎没有开销。
+- 每条记录带 ISO 格式的时间戳 ts（精确到微秒、含时区），多个进程写出的日志可合并排序。
+- 开启的事件按类型采样（sample_rates，如 {'order_created': 0.1} 只保留约 10%，按计数确定性抽取，
+  同样的运行得到同样的样本），再进入缓冲的 JSONL 文件（每满 buffer_size 条或进程退出时批量写盘）。
+- 默认阈值与路径来自配置 EVENT_LOG_LEVEL / EVENT_LOG_PATH / EVENT_SAMPLE_RATES，可用 configure() 在运行时修改。
+
+用法:
+    from utils import events
+    if events.is_enabled('order_created'):
+        events.emit('order_created', date=dt, ts_code=code, side='buy', close=price)
+"""
+import atexit
+import datetime
+import json
+import logging
+import os
+import threading
+from typing import Dict, Any, List
+
+from config.settings import get_settings
+
+DEBUG, INFO, WARNING = logging.DEBUG, logging.INFO, logging.WARNING
+
+# 各事件类型的级别；未登记的类型按 INFO 处理
+EVENT_LEVELS: Dict[str, int] = {
+    'order_created': DEBUG,  # 策略下单（每只标的每次买卖各一条，大回测中数量极多）
+    'strategy_log': DEBUG,  # 策略自定义的 log() 文本
+    'watchlist_auto_add': INFO,  # 买入时自动加入自选股
+    'portfolio_reset': WARNING,  # 组合被清空
+}
+
+
+def _parse_level(level) -> int:
+    if isinstance(level, int):
+        return level
+    value = logging.getLevelName(str(level).upper())
+    if not isinstance(value, int):
+        raise ValueError(f"未知的事件级别: {level}")
+    return value
+
+
+def _default(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if hasattr(value, 'item'):  # NumPy 标量
+        return value.item()
+    return str(value)
+
+
+class JsonlSink:
+    """缓冲写入 JSONL 文件：每满 buffer_size 条追加写盘一次。"""
+
+    def __init__(self, path: str, buffer_size: int = 512):
+        self.path = path
+        self.buffer_size = buffer_size
+        self._buffer: List[str] = []
+
+    def write(self, record: Dict[str, Any]) -> None:
+        self._buffer.append(json.dumps(record, ensure_ascii=False, default=_default))
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._buffer:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write('\n'.join(self._buffer) + '\n')
+        self._buffer = []
+
+
+class MemorySink:
+    """内存中的事件列表（页面展示、调试用）。"""
+
+    def __init__(self):
+        self.records: List[Dict[str, Any]] = []
+
+    def write(self, record: Dict[str, Any]) -> None:
+        self.records.append(record)
+
+    def flush(self) -> None:
+        pass
+
+
+_LOCK = threading.Lock()
+_state: Dict[str, Any] = {}
+# 各事件类型的采样累加器
+_sample_acc: Dict[str, float] = {}
+
+
+def configure(level=None, path: str | None = None, sample_rates: Dict[str, float] | None = None, sink=None) -> None:
+    """设置事件阈值、输出文件（或直接给定 sink）与各类型的采样比例；未给出的项保持原值。"""
+    with _LOCK:
+        old_sink = _state.get('sink')
+        if level is not None:
+            _state['level'] = _parse_level(level)
+        if sample_rates is not None:
+            _state['sample_rates'] = {k: float(v) for k, v in sample_rates.items()}
+            _sample_acc.clear()
+        if sink is not None:
+            _state['sink'] = sink
+        elif path is not None:
+            _state['sink'] = JsonlSink(path)
+    if old_sink is not None and old_sink is not _state.get('sink'):
+        old_sink.flush()
+
+
+def _load_defaults() -> None:
+    settings = get_settings()
+    configure(level=settings.EVENT_LOG_LEVEL, path=settings.EVENT_LOG_PATH, sample_rates=settings.EVENT_SAMPLE_RATES)
+
+
+def is_enabled(event_type: str) -> bool:
+    """该类型的事件当前是否会被记录（调用方据此跳过字段计算）。"""
+    return EVENT_LEVELS.get(event_type, INFO) >= _state['level']
+
+
+def emit(event_type: str, **fields) -> None:
+    """记录一个事件；低于阈值或未被采样时直接返回。"""
+    if EVENT_LEVELS.get(event_type, INFO) < _state['level']:
+        return
+    with _LOCK:
+        rate = _state['sample_rates'].get(event_type)
+        if rate is not None and rate < 1.0:
+            acc = _sample_acc.get(event_type, 0.0) + rate
+            if acc < 1.0:
+                _sample_acc[event_type] = acc
+                return
+            _sample_acc[event_type] = acc - 1.0
+        _state['sink'].write({'ts': datetime.datetime.now().astimezone().isoformat(timespec='microseconds'),
+                              'event': event_type, 'level': logging.getLevelName(EVENT_LEVELS.get(event_type, INFO)),
+                              **fields})
+
+
+def flush() -> None:
+    """将缓冲中的事件写出。"""
+    with _LOCK:
+        _state['sink'].flush()
+
+
+_load_defaults()
+atexit.register(flush)
@@ -0,0 +1,74 @@
+"""
+折线图公共工具：按视口分辨率做保形降采样（LTTB，Largest-Triangle-Three-Buckets），点数较多时改用 WebGL（Scattergl）。
+
+几十年的日线净值叠加多个基准和回撤子图时，逐点发送到浏览器会使页面渲染明显变慢；
+降采样后每条曲线最多 max_points 个点，峰谷等形状特征保留。需要看细节时按区间重新取原始数据再降采样
+（见 slice_range），区间足够短时即为全分辨率。
+"""
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+# 每条曲线发送到浏览器的最大点数（约为常见图表宽度像素数的两倍）
+DEFAULT_MAX_POINTS = 2000
+# 单条曲线实际绘制的点数超过该值时使用 Scattergl
+WEBGL_THRESHOLD = 1000
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    LTTB 降采样，返回保留点的下标（升序，含首尾点）。
+    x 需单调递增；除首尾外按下标均分为 n_out-2 个桶，每桶保留与前一保留点、下一桶均值构成三角形面积最大的点。
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    idx = np.empty(n_out, dtype=np.int64)
+    idx[0], idx[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i < n_out - 3:
+            nlo, nhi = edges[i + 1], edges[i + 2]
+        else:
+            nlo, nhi = n - 1, n
+        avg_x, avg_y = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        idx[i + 1] = a
+    return idx
+
+
+def downsample_series(series: pd.Series, max_points: int | None = DEFAULT_MAX_POINTS) -> pd.Series:
+    """对时间序列（或数值索引序列）做 LTTB 降采样；缺失值先剔除，max_points 为 None/0 时不降采样。"""
+    series = series.dropna()
+    if not max_points or len(series) <= max_points:
+        return series
+    index = series.index
+    if isinstance(index, pd.DatetimeIndex):
+        x = index.asi8.astype(float)
+    else:
+        x = np.arange(len(series), dtype=float)
+    return series.iloc[lttb_indices(x, series.to_numpy(dtype=float), max_points)]
+
+
+def slice_range(data, x_range=None):
+    """按 (起, 止) 截取 Series/DataFrame 的索引区间（含端点）；x_range 为 None 时原样返回。"""
+    if x_range is None or data is None:
+        return data
+    start, end = x_range
+    return data.loc[pd.Timestamp(start) if start is not None else None:pd.Timestamp(end) if end is not None else None]
+
+
+def line_trace(series: pd.Series, name: str, max_points: int | None = DEFAULT_MAX_POINTS,
+               webgl_threshold: int = WEBGL_THRESHOLD, **kwargs):
+    """
+    生成一条折线 trace：先降采样到 max_points，实际点数超过 webgl_threshold 时返回 go.Scattergl，否则 go.Scatter。
+    其余关键字参数（line、hovertemplate 等）原样传给 trace。
+    """
+    curve = downsample_series(series, max_points)
+    trace_cls = go.Scattergl if len(curve) > webgl_threshold else go.Scatter
+    return trace_cls(x=curve.index, y=curve.to_numpy(), name=name, mode='lines', **kwargs)
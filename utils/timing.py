@@ -0,0 +1,150 @@
+"""
+轻量的分阶段计时：用 span() 包住一段流程，嵌套的 span 构成一次调用的耗时树（trace）。
+
+- 最外层 span 结束时，整棵树按路径（如 run_backtest/load_price_data）汇总为计时记录：
+  次数、累计耗时、以及 span 上登记的行数/标的数等计数；循环内重复进入的同名 span 合并为一条。
+- 每条记录以 JSON 写入日志（logger 'utils.timing'，INFO 级别），同时保留每种流程最近一次的明细
+  （last_trace），供页面的“性能详情”展示；timer_summary() 给出进程内各阶段的累计耗时。
+- 计时只在 span 边界调用 time.perf_counter，开销可以忽略；线程之间互不干扰。
+
+用法:
+    with span('run_backtest', tickers=len(codes)) as sp:
+        with span('load_price_data') as load:
+            ...
+            load.add(rows=n_rows)
+"""
+import functools
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, List
+
+_local = threading.local()
+_LOCK = threading.Lock()
+# 每种流程（最外层 span 名）最近一次的计时明细
+_LAST_TRACES: Dict[str, Dict[str, Any]] = {}
+# 进程内按路径累计的 [次数, 耗时]
+_TOTALS: Dict[str, List[float]] = {}
+
+
+class Span:
+    """正在计时的一个阶段；add() 登记计数（同名计数累加），set() 登记其它字段。"""
+    __slots__ = ('name', 'path', 'fields')
+
+    def __init__(self, name: str, path: str, fields: Dict[str, Any]):
+        self.name = name
+        self.path = path
+        self.fields = dict(fields)
+
+    def add(self, **counts) -> None:
+        for key, value in counts.items():
+            self.fields[key] = self.fields.get(key, 0) + value
+
+    def set(self, **fields) -> None:
+        self.fields.update(fields)
+
+
+class _Trace:
+    def __init__(self, name: str):
+        self.name = name
+        self.started_at = time.strftime('%Y-%m-%d %H:%M:%S')
+        self.records: Dict[str, Dict[str, Any]] = {}
+
+    def open(self, path: str, depth: int) -> None:
+        # 按首次进入的顺序保留记录，子阶段排在父阶段之后
+        if path not in self.records:
+            self.records[path] = {'span': path, 'depth': depth, 'count': 0, 'seconds': 0.0}
+
+    def close(self, path: str, elapsed: float, fields: Dict[str, Any]) -> None:
+        record = self.records[path]
+        record['count'] += 1
+        record['seconds'] += elapsed
+        for key, value in fields.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and key in record:
+                record[key] += value
+            else:
+                record[key] = value
+
+
+def _stack() -> list:
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+@contextmanager
+def span(name: str, **fields):
+    """计时一个阶段；fields 为该阶段的计数（rows、tickers 等）或标签。产出 Span，可在阶段内继续登记计数。"""
+    stack = _stack()
+    parent = stack[-1] if stack else None
+    trace = parent[1] if parent else _Trace(name)
+    path = f"{parent[0].path}/{name}" if parent else name
+    sp = Span(name, path, fields)
+    trace.open(path, len(stack))
+    stack.append((sp, trace))
+    started = time.perf_counter()
+    try:
+        yield sp
+    except BaseException:
+        sp.set(error=True)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        stack.pop()
+        trace.close(path, elapsed, sp.fields)
+        if parent is None:
+            _finish(trace)
+
+
+def current_span() -> Span:
+    """当前线程最内层的 Span；不在任何 span 内时返回一个不被记录的临时 Span（登记的计数被丢弃）。"""
+    stack = _stack()
+    return stack[-1][0] if stack else Span('', '', {})
+
+
+def timed(name: str | None = None):
+    """装饰器：以 span 计时整个函数调用（默认以函数名为阶段名）。"""
+    def decorator(fn):
+        label = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _finish(trace: _Trace) -> None:
+    records = list(trace.records.values())
+    total = records[0]['seconds'] if records else 0.0
+    for record in records:
+        record['share'] = round(record['seconds'] / total, 4) if total > 0 else None
+        record['seconds'] = round(record['seconds'], 6)
+    with _LOCK:
+        _LAST_TRACES[trace.name] = {'name': trace.name, 'started_at': trace.started_at, 'seconds': total,
+                                    'records': records}
+        for record in records:
+            entry = _TOTALS.setdefault(record['span'], [0, 0.0])
+            entry[0] += record['count']
+            entry[1] += record['seconds']
+    logger = logging.getLogger(__name__)
+    if logger.isEnabledFor(logging.INFO):
+        for record in records:
+            logger.info("timing %s", json.dumps({'trace': trace.name, **record}, ensure_ascii=False, default=str))
+
+
+def last_trace(name: str) -> Dict[str, Any] | None:
+    """某种流程最近一次的计时明细：{'name', 'started_at', 'seconds', 'records': [...]}，没有时返回 None。"""
+    with _LOCK:
+        return _LAST_TRACES.get(name)
+
+
+def timer_summary() -> List[Dict[str, Any]]:
+    """进程内各阶段的累计次数与耗时（按累计耗时降序）。"""
+    with _LOCK:
+        rows = [{'span': path, 'count': int(c), 'seconds': round(s, 6)} for path, (c, s) in _TOTALS.items()]
+    return sorted(rows, key=lambda r: r['seconds'], reverse=True)
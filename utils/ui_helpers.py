@@ -53,6 +53,22 @@ def show_status_panel():
         st.sidebar.info("系统准备就绪，请选择操作。")
 
 
+def show_timing_details(trace_name: str, label: str = "性能详情"):
+    """以折叠面板展示某种流程最近一次的分阶段耗时（见 utils.timing）；没有记录时不显示。"""
+    from utils.timing import last_trace
+    trace = last_trace(trace_name)
+    if not trace:
+        return
+    with st.expander(f"{label}（{trace['started_at']}，共 {trace['seconds']:.2f} 秒）", expanded=False):
+        df = pd.DataFrame(trace['records'])
+        df['阶段'] = ['\u3000' * int(d) + path.rsplit('/', 1)[-1] for d, path in zip(df['depth'], df['span'])]
+        df['耗时(ms)'] = (df['seconds'] * 1000).round(1)
+        df['占比'] = (df['share'] * 100).round(1).astype(str) + '%'
+        columns = ['阶段', '耗时(ms)', '占比', 'count'] + [c for c in ('rows', 'tickers', 'days') if c in df.columns]
+        st.dataframe(df[columns].rename(columns={'count': '次数', 'rows': '行数', 'tickers': '标的数',
+                                                 'days': '交易日数'}), hide_index=True, use_container_width=True)
+
+
 def render_watchlist_editor(db, item_type='stock'):
     """Extracted from legacy app for reuse in multipage."""
     watchlist_table = "watchlist" if item_type == 'stock' else "index_watchlist"
@@ -113,27 +129,38 @@ def render_watchlist_editor(db, item_type='stock'):
 
     st.divider()
     st.subheader(f"当前自选{type_name}列表")
-    watchlist = db.fetch_all(f"SELECT ts_code, name, in_pool FROM {watchlist_table} ORDER BY ts_code")
+    # 最新价与涨跌幅直接取 latest_quote（行情入库时维护），不在行情历史上聚合
+    watchlist = db.fetch_all(
+        f"SELECT w.ts_code, w.name, w.in_pool, q.close, q.pct_change, q.date AS quote_date FROM {watchlist_table} w "
+        f"LEFT JOIN latest_quote q ON q.asset = ? AND q.ts_code = w.ts_code ORDER BY w.ts_code",
+        ('stock' if item_type == 'stock' else 'index',))
     if watchlist:
         df_watch = pd.DataFrame(watchlist)
         df_watch['delete'] = False
         df_watch['in_pool'] = df_watch['in_pool'].astype(bool)
+        quote_columns = {
+            "close": st.column_config.NumberColumn("最新价", format="%.2f", disabled=True),
+            "pct_change": st.column_config.NumberColumn("涨跌幅(%)", format="%.2f", disabled=True),
+            "quote_date": st.column_config.TextColumn("行情日期", disabled=True),
+        }
 
         if item_type == 'stock':
             column_config = {
                 "ts_code": st.column_config.TextColumn("代码", disabled=True),
                 "name": st.column_config.TextColumn("名称", disabled=True),
+                **quote_columns,
                 "in_pool": st.column_config.CheckboxColumn("加入回测池"),
                 "delete": st.column_config.CheckboxColumn("删除")
             }
-            display_columns = ['ts_code', 'name', 'in_pool', 'delete']
+            display_columns = ['ts_code', 'name', 'close', 'pct_change', 'quote_date', 'in_pool', 'delete']
         else:
             column_config = {
                 "ts_code": st.column_config.TextColumn("代码", disabled=True),
                 "name": st.column_config.TextColumn("名称", disabled=True),
+                **quote_columns,
                 "delete": st.column_config.CheckboxColumn("删除")
             }
-            display_columns = ['ts_code', 'name', 'delete']
+            display_columns = ['ts_code', 'name', 'close', 'pct_change', 'quote_date', 'delete']
 
         edited_df = st.data_editor(df_watch, column_config=column_config, hide_index=True, key=f"editor_{item_type}", column_order=display_columns)
         st.write("**批量操作**")